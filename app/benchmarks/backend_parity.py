@@ -0,0 +1,347 @@
+"""Check that the in-memory test backend answers every route like MongoDB does.
+
+The routes are written against MongoDB's query language, and
+``benchmarks.memory`` emulates the part of it they use so the app can run in
+tests without a mongod. This check keeps the two in step. It seeds a scratch
+database on the reference backend (see ``benchmarks.seed``), copies every
+collection into a ``MemoryClient``, then sends the same requests through the
+app to each backend and compares the responses:
+
+- every case of ``benchmarks.plan_check``, which between them use every
+  filter of every read route, and the ``PAGED`` cases, followed cursor by
+  cursor to the last page;
+- ``write_scenario``, which goes through every write route and job handler
+  on a customer of its own and reads the results back.
+
+Both backends start from the same documents, so reads must match exactly;
+text search is compared without its scores, which the memory backend
+computes differently. Writes generate their own ids and timestamps, so
+their responses are compared with every id numbered in order of appearance
+and every timestamp masked. Any difference fails the check; exits non-zero
+on any difference.
+
+The reference is a real ``mongod`` by default. ``--reference mongomock``
+compares against mongomock instead where no server is available; requests
+it cannot run (``$text``, ``$unionWith``, ...) are counted as unsupported
+rather than compared, so only a ``mongod`` run covers every route.
+
+    python -m benchmarks.backend_parity --customers 50 --assets 5000
+    python -m benchmarks.backend_parity --reference mongomock --customers 5 --assets 200
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from benchmarks.memory import MemoryClient
+from benchmarks.plan_check import CASES, Case, sample
+from benchmarks.seed import add_arguments, seed
+from src import database, jobs
+from src.config import settings
+from src.indexes import reconcile_indexes
+from src.jobs import job_runner
+from src.pagination import NEXT_CURSOR_HEADER
+
+# Followed page by page; nullable sort fields exercise the keyset edge cases
+PAGED: List[Case] = [
+    Case("/assets", {"sort": "site_id", "limit": "{page_size}"}),
+    Case("/assets", {"sort": "-site_id", "limit": "{page_size}"}),
+    Case("/assets", {"customer_id": "{customer_id}", "sort": "-hostname", "limit": "{page_size}"}),
+    Case("/assets", {"cidr": "{cidr}", "sort": "ip_address", "fields": "hostname", "limit": "{page_size}"}),
+    Case("/assets", {"as_of": "{as_of}", "limit": "{page_size}"}),
+    Case("/customers/", {"sort": "-name", "limit": "{page_size}"}),
+    Case("/sites/", {"sort": "customer_id", "limit": "{page_size}"}),
+    Case("/infrastructure/", {"sort": "site_id", "expand": "site", "limit": "{page_size}"}),
+]
+
+ADDRESS = {"country": "NO", "city": "Oslo", "street_address": "Storgata 1", "postal_code": "0155"}
+CUSTOMER = {"name": "Parity AS", "contact_email": "ops@parity.example", "contact_phone": "+47 1", "address": ADDRESS}
+
+_OBJECT_ID = re.compile(r"\b[0-9a-f]{24}\b")
+_DATETIME = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?([+-]\d{2}:\d{2}|Z)?")
+
+Step = Tuple[str, int, Any]
+
+# Status of a request a backend could not run
+UNSUPPORTED = -1
+
+# What mongomock raises for the parts of the query language it lacks
+MONGOMOCK_ERRORS = (NotImplementedError, TypeError)
+
+
+def _body(response: httpx.Response):
+    if response.headers.get("content-type", "").startswith("application/json"):
+        return response.json()
+    return response.text
+
+
+def _without_scores(body):
+    if isinstance(body, list):
+        return sorted((_without_scores(item) for item in body), key=lambda item: item.get("id", ""))
+    return {key: value for key, value in body.items() if key != "score"}
+
+
+def normalise(value, ids: Dict[str, str]):
+    """``value`` with ids numbered in order of appearance and timestamps masked"""
+    if isinstance(value, dict):
+        return {normalise(key, ids): normalise(item, ids) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(normalise(item, ids) for item in value)
+    if isinstance(value, str):
+        value = _DATETIME.sub("<datetime>", value)
+        return _OBJECT_ID.sub(lambda match: ids.setdefault(match.group(), f"<id {len(ids) + 1}>"), value)
+    return value
+
+
+async def read_case(
+    http, case: Case, samples: Dict[str, str], paged: bool = False, unsupported=()
+) -> List[Step]:
+    """The responses to a case, one per page when ``paged``.
+
+    A request raising one of the ``unsupported`` errors is recorded as such.
+    """
+    url = case.path.format(**samples)
+    params = {name: value.format(**samples) for name, value in case.params.items()}
+    pages = []
+    while True:
+        try:
+            response = await http.get(url, params=params)
+        except unsupported as e:
+            pages.append((f"{case.path} {params}", UNSUPPORTED, repr(e)))
+            return pages
+        body = _body(response)
+        if params.get("mode") == "text" and response.status_code == 200:
+            body = _without_scores(body)
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        pages.append((f"{case.path} {params}", response.status_code, {"body": body, "next": cursor}))
+        if not paged or not cursor:
+            return pages
+        params = {**params, "after": cursor}
+
+
+async def _report(name: str, value: int):
+    pass
+
+
+async def write_scenario(http, db, unsupported=()) -> List[Step]:
+    """Create, change, sync and delete a customer's documents; every response in order"""
+    steps: List[Step] = []
+
+    async def call(label: str, method: str, url: str, **kwargs):
+        try:
+            response = await http.request(method, url, **kwargs)
+        except unsupported as e:
+            steps.append((label, UNSUPPORTED, repr(e)))
+            return None
+        body = _body(response)
+        steps.append((label, response.status_code, body))
+        return body
+
+    async def run_job(kind: str, params: dict):
+        try:
+            steps.append((f"{kind} job", 0, await jobs.HANDLERS[kind](db, params, _report)))
+        except unsupported as e:
+            steps.append((f"{kind} job", UNSUPPORTED, repr(e)))
+
+    customer = await call("create customer", "POST", "/customers/", json=CUSTOMER)
+    customer_id = customer["id"]
+    await call("duplicate customer", "POST", "/customers/", json=CUSTOMER)
+    await call("patch customer", "PATCH", f"/customers/{customer_id}", json={"address": {"city": "Bergen"}})
+    site_id = (await call("customer sites", "GET", "/sites/", params={"customer_id": customer_id}))[0]["id"]
+    branch = await call(
+        "create site", "POST", "/sites/", json={"name": "Branch", "customer_id": customer_id, "address": ADDRESS}
+    )
+    await call("patch site", "PATCH", f"/sites/{branch['id']}", json={"notes": "second floor"})
+
+    location = await call("create infrastructure", "POST", "/infrastructure/", json={
+        "name": "eu", "type": "aws", "customer_id": customer_id, "site_id": site_id,
+        "config": {"region": "eu-north-1", "vpc_id": "vpc-1"},
+    })
+    location_id = location["id"]
+    await call(
+        "patch infrastructure", "PATCH", f"/infrastructure/{location_id}",
+        json={"config": {"region": "eu-west-1"}, "description": None},
+    )
+    await call("mismatched config", "PATCH", f"/infrastructure/{location_id}", json={"config": {"location": "x"}})
+
+    host = {
+        "hostname": "web-1", "ip_address": "10.200.0.1", "asset_type": "host",
+        "customer_id": customer_id, "site_id": site_id,
+        "specs": {"manufacturer": "Dell", "cpu_cores": 4, "ram_gb": 16},
+    }
+    vm = {
+        "hostname": "app-1", "ip_address": "10.200.0.10", "asset_type": "vm", "customer_id": customer_id,
+        "specs": {"cpu_cores": 2, "ram_gb": 4, "os": "ubuntu", "os_version": "24.04",
+                  "infrastructure_location_id": location_id},
+    }
+    asset_id = (await call("create asset", "POST", "/assets", json=host))["id"]
+    await call("conflicting ip", "POST", "/assets", json={**host, "hostname": "web-2"})
+    await call("bulk", "POST", "/assets/bulk", json=[
+        vm, {**host, "hostname": "web-2", "ip_address": "10.200.0.2"}, {**host, "ip_address": "not-an-ip"},
+    ])
+    await call("patch specs", "PATCH", f"/assets/{asset_id}", json={"specs": {"cpu_cores": 8}, "notes": "rack 4"})
+    await call("clear notes", "PATCH", f"/assets/{asset_id}", json={"notes": None})
+    await call("stale version", "PATCH", f"/assets/{asset_id}", params={"version": 1}, json={"notes": "x"})
+    await call("put asset", "PUT", f"/assets/{asset_id}", json={**host, "hostname": "web-1b"})
+    await call("move to branch", "PATCH", f"/assets/{asset_id}", json={"site_id": branch["id"]})
+
+    scan = [
+        {**host, "hostname": "web-1b", "site_id": branch["id"], "specs": {**host["specs"], "cpu_cores": 8}},
+        {**host, "hostname": "web-3", "ip_address": "10.200.0.3"},
+        {"hostname": "incomplete"},
+    ]
+    sync = f"/customers/{customer_id}/assets/sync"
+    await call("sync dry run", "POST", sync, params={"dry_run": "true", "delete": "true"}, json=scan)
+    await call("sync", "POST", sync, params={"delete": "true"}, json=scan)
+
+    await call("history", "GET", f"/assets/{asset_id}/history")
+    await call("as of", "GET", "/assets", params={"customer_id": customer_id, "as_of": datetime.now().isoformat()})
+    await call("utilization", "GET", "/assets/subnets/utilization", params={"cidr": "10.200.0.0/24"})
+    await call("prefix search", "GET", "/assets/search", params={"q": "web", "mode": "prefix", "customer_id": customer_id})
+    await call("expanded", "GET", "/assets", params={
+        "customer_id": customer_id, "fields": "hostname", "expand": "customer,site,infrastructure",
+    })
+    await call("customer", "GET", f"/customers/{customer_id}")
+    await call("summary", "GET", f"/customers/{customer_id}/summary")
+    await call("topology", "GET", f"/customers/{customer_id}/topology")
+    await call("impact", "GET", f"/infrastructure/{location_id}/impact")
+    await call("export", "GET", "/export/assets", params={"customer_id": customer_id, "format": "csv"})
+
+    await call("delete asset", "DELETE", f"/assets/{asset_id}")
+    await call("delete branch", "DELETE", f"/sites/{branch['id']}")
+    await call("delete infrastructure", "DELETE", f"/infrastructure/{location_id}")
+    await run_job("recount_counters", {"customer_id": customer_id})
+    await run_job("backfill_documents", {})
+    await call("delete customer", "DELETE", f"/customers/{customer_id}")
+    await run_job("delete_customer", {"customer_id": customer_id})
+    await call("deleted customer", "GET", f"/customers/{customer_id}")
+    await call("orphaned assets", "GET", "/assets", params={"customer_id": customer_id})
+    return steps
+
+
+async def copy_database(source, target):
+    for name in await source.list_collection_names():
+        documents = await source[name].find({}).to_list(None)
+        if documents:
+            await target[name].insert_many(documents)
+
+
+async def _run_backend(client, samples: Dict[str, str], unsupported=()) -> Dict[str, List[Step]]:
+    """Every read case, then the write scenario, with the app routed to ``client``"""
+    database.db.client = client
+    db = client[settings.database_name]
+    # The scenario runs job handlers itself; submitted jobs are only recorded
+    job_runner.db = db
+    from src.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://parity", timeout=None) as http:
+        reads = [step for case in CASES for step in await read_case(http, case, samples, unsupported=unsupported)]
+        reads += [
+            step for case in PAGED
+            for step in await read_case(http, case, samples, paged=True, unsupported=unsupported)
+        ]
+        writes = await write_scenario(http, db, unsupported)
+    ids: Dict[str, str] = {}
+    return {"reads": reads, "writes": [normalise(step, ids) for step in writes]}
+
+
+def differences(mongo: List[Step], memory: List[Step]) -> List[dict]:
+    found = []
+    for expected, actual in zip(mongo, memory):
+        if expected[1] != UNSUPPORTED and expected != actual:
+            found.append({
+                "request": expected[0],
+                "mongo": {"status": expected[1], "body": expected[2]},
+                "memory": {"status": actual[1], "body": actual[2]},
+            })
+    if len(mongo) != len(memory):
+        found.append({"request": "count", "mongo": len(mongo), "memory": len(memory)})
+    return found
+
+
+def unsupported_steps(steps: List[Step]) -> List[str]:
+    return [step[0] for step in steps if step[1] == UNSUPPORTED]
+
+
+def comparable_writes(steps: List[Step]) -> int:
+    """How many write steps ran before the reference first failed to run one.
+
+    The backends hold different data from then on, so later steps are not compared.
+    """
+    return next((position for position, step in enumerate(steps) if step[1] == UNSUPPORTED), len(steps))
+
+
+def reference_client(reference: str):
+    if reference == "mongomock":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("--reference mongomock needs the mongomock-motor package")
+        return AsyncMongoMockClient()
+    return AsyncIOMotorClient(settings.mongodb_url)
+
+
+async def run(args) -> dict:
+    client = reference_client(args.reference)
+    unsupported = MONGOMOCK_ERRORS if args.reference == "mongomock" else ()
+    memory = MemoryClient()
+    db = client[args.database]
+    settings.database_name = args.database
+    settings.cache_enabled = False
+    settings.access_log = False
+    try:
+        await seed(db, args.customers, args.assets, args.sites, args.infrastructure,
+                   args.seed, args.batch_size, args.concurrency)
+        indexes = await reconcile_indexes(db)
+        await copy_database(db, memory[args.database])
+        samples = {**await sample(db), "page_size": str(args.page_size)}
+
+        results = {}
+        for name, backend in (("mongo", client), ("memory", memory)):
+            results[name] = await _run_backend(backend, samples, unsupported)
+        compared = comparable_writes(results["mongo"]["writes"])
+        return {
+            "reference": args.reference,
+            "reads": len(results["mongo"]["reads"]),
+            "writes": len(results["mongo"]["writes"]),
+            "writes_compared": compared,
+            "unsupported_by_reference": unsupported_steps(results["mongo"]["reads"] + results["mongo"]["writes"]),
+            "read_differences": differences(results["mongo"]["reads"], results["memory"]["reads"]),
+            "write_differences": differences(
+                results["mongo"]["writes"][:compared], results["memory"]["writes"][:compared]
+            ),
+            "indexes_failed": indexes["failed"],
+        }
+    finally:
+        if not args.keep:
+            await client.drop_database(args.database)
+        client.close()
+        memory.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    # The memory backend scans what its hash indexes cannot narrow down
+    parser.set_defaults(customers=50, assets=5000)
+    parser.add_argument("--database", default=f"{settings.database_name}_parity")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--reference", choices=("mongod", "mongomock"), default="mongod",
+                        help="backend the memory backend is compared with")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database")
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2, default=str))
+    if report["read_differences"] or report["write_differences"] or report["indexes_failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
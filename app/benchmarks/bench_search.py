@@ -0,0 +1,118 @@
+"""Latency of ``GET /assets/search`` queries against a seeded collection.
+
+Seeds a scratch database with synthetic assets, reconciles the index plan and
+runs the same finds as the search route in both modes. Needs a running
+MongoDB; the scratch database is dropped afterwards unless ``--keep`` is
+given. Exits non-zero when the p95 of either mode is over the budget.
+
+    python -m benchmarks.bench_search --assets 100000
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from src.config import settings
+from src.documents import asset_document
+from src.indexes import reconcile_indexes
+from src.routes.assets import SearchMode, search_find
+
+ROLES = ["web", "db", "cache", "proxy", "mail", "build", "backup", "monitor"]
+OS = ["ubuntu", "debian", "rhel", "windows", "freebsd"]
+MODELS = ["poweredge", "proliant", "catalyst", "nexus", "fortigate", "srx"]
+NOTES = ["primary", "replica", "decommission", "legacy", "staging", "production", "spare"]
+
+
+def make_assets(count: int, customers: int, rng: random.Random) -> list:
+    customer_ids = [str(ObjectId()) for _ in range(customers)]
+    assets = []
+    for i in range(count):
+        role = rng.choice(ROLES)
+        asset = {
+            "hostname": f"{role}-{rng.choice(OS)}-{i:06d}",
+            "ip_address": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+            "customer_id": rng.choice(customer_ids),
+            "notes": " ".join(rng.sample(NOTES, 2)),
+            "site_id": None,
+        }
+        if i % 2:
+            asset["asset_type"] = "vm"
+            asset["specs"] = {"cpu_cores": 4, "ram_gb": 16, "os": rng.choice(OS),
+                              "os_version": "1", "infrastructure_location_id": str(ObjectId())}
+        else:
+            asset["asset_type"] = "switch"
+            asset["specs"] = {"manufacturer": "acme", "model": rng.choice(MODELS)}
+        assets.append(asset_document(asset))
+    return assets
+
+
+def summarise(latencies: list, budget_ms: float) -> dict:
+    latencies = sorted(latencies)
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50_ms": round(quantiles[49], 2),
+        "p95_ms": round(quantiles[94], 2),
+        "p99_ms": round(quantiles[98], 2),
+        "max_ms": round(latencies[-1], 2),
+        "over_budget": sum(1 for latency in latencies if latency > budget_ms),
+    }
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    client = AsyncIOMotorClient(settings.mongodb_url)
+    db = client[args.database]
+    try:
+        await db.assets.drop()
+        assets = make_assets(args.assets, args.customers, rng)
+        for start in range(0, len(assets), 10000):
+            await db.assets.insert_many(assets[start:start + 10000], ordered=False)
+        await reconcile_indexes(db)
+
+        terms = {
+            SearchMode.PREFIX: [f"{rng.choice(ROLES)}-{rng.choice(OS)[:rng.randint(0, 3)]}"
+                       for _ in range(args.queries)],
+            SearchMode.TEXT: [rng.choice(ROLES + OS + MODELS + NOTES) for _ in range(args.queries)],
+        }
+        results = {}
+        for mode, queries in terms.items():
+            latencies = []
+            for q in queries:
+                query, projection, sort = search_find(q, mode, {})
+                start = time.perf_counter()
+                await db.assets.find(query, projection).sort(sort).limit(args.limit).to_list(None)
+                latencies.append((time.perf_counter() - start) * 1000)
+            results[mode.value] = summarise(latencies, args.budget_ms)
+        return results
+    finally:
+        if not args.keep:
+            await client.drop_database(args.database)
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--assets", type=int, default=100000)
+    parser.add_argument("--customers", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=settings.search_time_budget_ms)
+    parser.add_argument("--database", default=f"{settings.database_name}_bench")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps({"assets": args.assets, "budget_ms": args.budget_ms, **results}, indent=2))
+    if any(mode["p95_ms"] > args.budget_ms for mode in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
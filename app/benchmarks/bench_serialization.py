@@ -0,0 +1,93 @@
+"""Per-document cost of turning Mongo documents into a list response.
+
+Compares the previous path (dict copy per document, ``response_model``
+validation, ``jsonable_encoder`` and ``json.dumps``) with the fast path
+(in-place ``_id`` rename and ``ORJSONResponse``).
+
+    python -m benchmarks.bench_serialization --docs 10000
+"""
+import argparse
+import copy
+import json
+import time
+from datetime import datetime
+from typing import List
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from src.schemas.asset import AssetInDB
+from src.serialization import ORJSONResponse, to_response
+
+
+ASSET_LIST = TypeAdapter(List[AssetInDB])
+
+
+def make_documents(count: int) -> list:
+    docs = []
+    for i in range(count):
+        if i % 2:
+            specs = {
+                "cpu_cores": 4, "ram_gb": 16, "os": "linux", "os_version": "22.04",
+                "infrastructure_location_id": str(ObjectId()), "vm_id": f"vm-{i}",
+            }
+            asset_type, site_id = "vm", None
+        else:
+            specs = {"manufacturer": "Dell", "cpu_cores": 32, "ram_gb": 256}
+            asset_type, site_id = "host", str(ObjectId())
+        docs.append({
+            "_id": ObjectId(),
+            "hostname": f"host-{i:06d}",
+            "ip_address": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+            "asset_type": asset_type,
+            "customer_id": str(ObjectId()),
+            "notes": None,
+            "site_id": site_id,
+            "specs": specs,
+            "added": datetime(2024, 1, 1, 12, 0, 0),
+            "modified": None,
+        })
+    return docs
+
+
+def previous_path(docs: list) -> bytes:
+    items = [{"id": str(d["_id"]), **{k: v for k, v in d.items() if k != "_id"}} for d in docs]
+    validated = ASSET_LIST.validate_python(items)
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+
+def fast_path(docs: list) -> bytes:
+    return ORJSONResponse([to_response(d) for d in docs]).body
+
+
+def measure(fn, docs: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        batch = copy.deepcopy(docs)
+        start = time.perf_counter()
+        fn(batch)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    docs = make_documents(args.docs)
+    results = {}
+    for name, fn in (("previous", previous_path), ("fast", fast_path)):
+        seconds = measure(fn, docs, args.repeat)
+        results[name] = {
+            "total_ms": round(seconds * 1000, 2),
+            "per_doc_us": round(seconds / args.docs * 1e6, 3),
+        }
+    results["speedup"] = round(results["previous"]["total_ms"] / results["fast"]["total_ms"], 1)
+    print(json.dumps({"docs": args.docs, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Validation throughput of asset and infrastructure payloads, per type.
+
+Compares the schemas, which validate ``specs``/``config`` against the one
+model selected by ``asset_type``/``type``, with copies of the previous
+schemas whose plain unions pydantic resolves by trying every member.
+
+    python -m benchmarks.bench_validation --records 20000
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+from typing import Optional, Union
+
+from pydantic import BaseModel, TypeAdapter, model_validator
+
+from src.models.asset import AssetType, HostSpecs, NetworkDeviceSpecs, VmSpecs
+from src.models.infrastructure import (AwsConfig, AzureConfig,
+                                       DatacenterConfig, LocationType,
+                                       OnPremiseConfig)
+from src.schemas.asset import AssetCreate
+from src.schemas.infrastructure import InfrastructureCreate
+
+
+class UnionAsset(BaseModel):
+    hostname: str
+    ip_address: str
+    asset_type: AssetType
+    customer_id: str
+    notes: Optional[str] = None
+    site_id: Optional[str] = None
+    specs: Union[VmSpecs, NetworkDeviceSpecs, HostSpecs]
+    added: datetime = datetime.now()
+    modified: Optional[datetime] = None
+
+    @model_validator(mode='after')
+    def validate_location(self):
+        if self.asset_type == AssetType.VM:
+            if not hasattr(self.specs, 'infrastructure_location_id'):
+                raise ValueError("VM assets require infrastructure_location_id in specs")
+        if self.asset_type in [AssetType.SWITCH, AssetType.FIREWALL, AssetType.HOST]:
+            if not self.site_id:
+                raise ValueError(f"{self.asset_type} assets require site_id")
+        return self
+
+
+class UnionInfrastructure(BaseModel):
+    name: str
+    type: LocationType
+    customer_id: str
+    description: Optional[str] = None
+    config: Union[AzureConfig, AwsConfig, DatacenterConfig, OnPremiseConfig]
+    is_active: bool = True
+    site_id: Optional[str] = None
+
+
+ASSETS = {
+    "vm": {"cpu_cores": 4, "ram_gb": 16, "os": "linux", "os_version": "22.04",
+           "infrastructure_location_id": "65f000000000000000000001"},
+    "host": {"manufacturer": "Dell", "cpu_cores": 32, "ram_gb": 256},
+    "switch": {"manufacturer": "Cisco", "model": "C9300"},
+    "firewall": {"manufacturer": "Fortinet", "model": "FG-100F"},
+}
+
+LOCATIONS = {
+    "azure": {"subscription_id": "sub", "resource_group": "rg", "region": "westeurope"},
+    "aws": {"region": "eu-west-1", "vpc_id": "vpc-1"},
+    "datacenter": {"name": "DC1"},
+    "on_premise": {"location": "Basement"},
+}
+
+
+def asset_payload(asset_type: str, specs: dict) -> dict:
+    return {
+        "hostname": "host-1", "ip_address": "10.0.0.1", "asset_type": asset_type,
+        "customer_id": "65f000000000000000000002", "site_id": "65f000000000000000000003",
+        "specs": specs,
+    }
+
+
+def location_payload(location_type: str, config: dict) -> dict:
+    return {
+        "name": "loc", "type": location_type, "customer_id": "65f000000000000000000002",
+        "site_id": "65f000000000000000000003", "config": config,
+    }
+
+
+def measure(model, payload: dict, records: int, repeat: int) -> float:
+    adapter = TypeAdapter(model)
+    batch = [payload] * records
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for record in batch:
+            adapter.validate_python(record)
+        best = min(best, time.perf_counter() - start)
+    return best / records * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    cases = [("asset", name, asset_payload(name, specs), AssetCreate, UnionAsset)
+             for name, specs in ASSETS.items()]
+    cases += [("infrastructure", name, location_payload(name, config), InfrastructureCreate,
+               UnionInfrastructure)
+              for name, config in LOCATIONS.items()]
+
+    results = {}
+    for kind, name, payload, schema, union in cases:
+        schema_us = measure(schema, payload, args.records, args.repeat)
+        union_us = measure(union, payload, args.records, args.repeat)
+        results[f"{kind}.{name}"] = {
+            "union_us": round(union_us, 3),
+            "schema_us": round(schema_us, 3),
+            "records_per_s": int(1e6 / schema_us),
+        }
+    print(json.dumps({"records": args.records, "per_record": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
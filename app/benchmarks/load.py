@@ -0,0 +1,324 @@
+"""HTTP load benchmark of the asset, customer, site and infrastructure routes.
+
+Seeds a scratch database (see ``benchmarks.seed``), then drives every
+scenario in ``SCENARIOS`` with ``--concurrency`` concurrent clients for
+``--requests`` requests each, and reports throughput and latency
+percentiles per route as JSON. The app runs in-process over an ASGI
+transport by default, or under a uvicorn subprocess with ``--uvicorn``, or
+is an already running server given with ``--url``. The response cache is
+off unless ``--cache`` is given, so reads measure the database path.
+
+With ``--baseline`` the report is compared to a stored one and the run exits
+non-zero when a route's p99 grew, or its throughput fell, by more than
+``--tolerance``; ``--save`` stores the report to compare later runs with.
+
+    python -m benchmarks.load --requests 500 --concurrency 16 --save baseline.json
+    python -m benchmarks.load --uvicorn --baseline baseline.json
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from benchmarks.seed import seed
+from src.config import settings
+
+Request = Tuple[str, str, Optional[dict]]  # method, url, JSON body
+
+
+class Scenario(NamedTuple):
+    name: str
+    request: Callable[["Pools", int], Request]
+
+
+class Pools:
+    """Ids of existing documents the scenarios pick from, and run-unique values"""
+
+    def __init__(self, customers: list, sites: list, infrastructure: list, assets: list, seed: int):
+        self.customers = customers
+        self.sites = sites
+        self.infrastructure = infrastructure
+        self.assets = assets
+        self.created_assets: List[str] = []
+        self.rng = random.Random(seed)
+        self.run = f"{seed}-{int(time.time())}"
+        self._counter = itertools.count()
+
+    def unique(self) -> int:
+        return next(self._counter)
+
+    def customer(self) -> dict:
+        return self.rng.choice(self.customers)
+
+    def site(self) -> dict:
+        return self.rng.choice(self.sites)
+
+
+def _asset_body(pools: Pools, n: int) -> dict:
+    site = pools.site()
+    return {
+        "hostname": f"load-{pools.run}-{n}",
+        "ip_address": f"172.{16 + n // 65536 % 16}.{n // 256 % 256}.{n % 256}",
+        "asset_type": "host",
+        "customer_id": site["customer_id"],
+        "site_id": str(site["_id"]),
+        "notes": "load test",
+        "specs": {"manufacturer": "dell", "cpu_cores": 32, "ram_gb": 256},
+    }
+
+
+def _delete_asset(pools: Pools, n: int) -> Request:
+    if pools.created_assets:
+        return "DELETE", f"/assets/{pools.created_assets.pop()}", None
+    # Nothing left to delete: measure the not-found path instead
+    return "DELETE", "/assets/000000000000000000000000", None
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("GET /assets?customer_id", lambda p, n: (
+        "GET", f"/assets?customer_id={p.customer()['_id']}&limit=100", None)),
+    Scenario("GET /assets?customer_id&expand", lambda p, n: (
+        "GET", f"/assets?customer_id={p.customer()['_id']}&limit=100&expand=site,infrastructure", None)),
+    Scenario("GET /assets/{asset_id}", lambda p, n: ("GET", f"/assets/{p.rng.choice(p.assets)}", None)),
+    Scenario("GET /assets/site/{site_id}", lambda p, n: ("GET", f"/assets/site/{p.site()['_id']}?limit=100", None)),
+    Scenario("GET /assets/search", lambda p, n: (
+        "GET", f"/assets/search?q={p.rng.choice(['web', 'db', 'cache', 'proxy'])}-&mode=prefix", None)),
+    Scenario("POST /assets", lambda p, n: ("POST", "/assets", _asset_body(p, n))),
+    Scenario("PATCH /assets/{asset_id}", lambda p, n: (
+        "PATCH", f"/assets/{p.rng.choice(p.assets)}", {"notes": f"patched {n}"})),
+    Scenario("DELETE /assets/{asset_id}", _delete_asset),
+    Scenario("GET /customers", lambda p, n: ("GET", "/customers/?limit=100", None)),
+    Scenario("GET /customers/{customer_id}", lambda p, n: ("GET", f"/customers/{p.customer()['_id']}", None)),
+    Scenario("GET /customers/{customer_id}/summary", lambda p, n: (
+        "GET", f"/customers/{p.customer()['_id']}/summary", None)),
+    Scenario("GET /customers/{customer_id}/topology", lambda p, n: (
+        "GET", f"/customers/{p.customer()['_id']}/topology", None)),
+    Scenario("POST /customers", lambda p, n: ("POST", "/customers/", {
+        "name": f"Load {p.run} {n}",
+        "contact_email": f"load{n}@example.com",
+        "contact_phone": "+47 00000000",
+        "address": {"country": "NO", "city": "Oslo", "street_address": f"{n} Load Street", "postal_code": "0150"},
+    })),
+    Scenario("PATCH /customers/{customer_id}", lambda p, n: (
+        "PATCH", f"/customers/{p.customer()['_id']}", {"contact_phone": f"+47 {n:08d}"})),
+    Scenario("GET /sites?customer_id", lambda p, n: ("GET", f"/sites/?customer_id={p.customer()['_id']}", None)),
+    Scenario("POST /sites", lambda p, n: ("POST", "/sites/", {
+        "name": f"Load {p.run} {n}", "customer_id": str(p.customer()["_id"]),
+    })),
+    Scenario("PATCH /sites/{site_id}", lambda p, n: (
+        "PATCH", f"/sites/{p.site()['_id']}", {"notes": f"patched {n}"})),
+    Scenario("GET /infrastructure?customer_id", lambda p, n: (
+        "GET", f"/infrastructure/?customer_id={p.customer()['_id']}", None)),
+    Scenario("GET /infrastructure/{infrastructure_id}/impact", lambda p, n: (
+        "GET", f"/infrastructure/{p.rng.choice(p.infrastructure)}/impact", None)),
+    Scenario("POST /infrastructure", lambda p, n: ("POST", "/infrastructure/", {
+        "name": f"Load {p.run} {n}",
+        "type": "aws",
+        "customer_id": str(p.customer()["_id"]),
+        "config": {"region": "eu-north-1", "vpc_id": f"vpc-{n:08x}"},
+    })),
+    Scenario("PATCH /infrastructure/{infrastructure_id}", lambda p, n: (
+        "PATCH", f"/infrastructure/{p.rng.choice(p.infrastructure)}", {"description": f"patched {n}"})),
+]
+
+
+def summarise(latencies: List[float], errors: int, seconds: float) -> dict:
+    latencies = sorted(latencies)
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "p50_ms": round(quantiles[49], 2),
+        "p90_ms": round(quantiles[89], 2),
+        "p99_ms": round(quantiles[98], 2),
+        "max_ms": round(latencies[-1], 2),
+    }
+
+
+async def drive(http: httpx.AsyncClient, scenario: Scenario, pools: Pools, requests: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for _ in remaining:
+            method, url, body = scenario.request(pools, pools.unique())
+            start = time.perf_counter()
+            response = await http.request(method, url, json=body)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+            elif method == "POST" and url == "/assets":
+                pools.created_assets.append(response.json()["id"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarise(latencies, errors, time.perf_counter() - start)
+
+
+async def load_pools(db, seed: int, size: int = 500) -> Pools:
+    async def sample(collection, projection: dict) -> list:
+        return await collection.aggregate([{"$sample": {"size": size}}, {"$project": projection}]).to_list(None)
+
+    return Pools(
+        customers=await sample(db.customers, {"_id": 1}),
+        sites=await sample(db.sites, {"customer_id": 1}),
+        infrastructure=[str(d["_id"]) for d in await sample(db.infrastructure, {"_id": 1})],
+        assets=[str(d["_id"]) for d in await sample(db.assets, {"_id": 1})],
+        seed=seed,
+    )
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Routes that got slower or handle less throughput than in ``baseline``"""
+    regressions = []
+    for name, current in report["routes"].items():
+        previous = baseline.get("routes", {}).get(name)
+        if previous is None:
+            continue
+        if current["p99_ms"] > previous["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {previous['p99_ms']} -> {current['p99_ms']} ms")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s"
+            )
+    return regressions
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_until_up(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url) as http:
+        while True:
+            try:
+                if (await http.get("/health/db")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise SystemExit(f"The server at {url} did not come up")
+            await asyncio.sleep(0.2)
+
+
+async def run(args) -> dict:
+    client = AsyncIOMotorClient(settings.mongodb_url)
+    db = client[args.database]
+    server = None
+    app = None
+    try:
+        if args.seed_data:
+            await seed(db, args.customers, args.assets, random_seed=args.seed)
+        pools = await load_pools(db, args.seed)
+        environment = {"DATABASE_NAME": args.database, "CACHE_ENABLED": str(args.cache), "ACCESS_LOG": "false"}
+
+        if args.url:
+            transport, base_url = None, args.url
+        elif args.uvicorn:
+            port = _free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(port),
+                 "--workers", str(args.workers), "--log-level", "warning"],
+                env={**os.environ, **environment},
+            )
+            await _wait_until_up(base_url)
+            transport = None
+        else:
+            from src.main import app
+
+            settings.database_name = args.database
+            settings.cache_enabled = args.cache
+            settings.access_log = False
+            # Count failures as error responses, the way a real server reports them
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            base_url = "http://load"
+
+        limits = httpx.Limits(max_connections=args.concurrency)
+        routes: Dict[str, dict] = {}
+        async with contextlib.AsyncExitStack() as stack:
+            if app is not None:
+                # The ASGI transport does not send lifespan events
+                await stack.enter_async_context(app.router.lifespan_context(app))
+            http = await stack.enter_async_context(
+                httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits, timeout=None)
+            )
+            for scenario in SCENARIOS:
+                if args.only and not any(part in scenario.name for part in args.only):
+                    continue
+                routes[scenario.name] = await drive(http, scenario, pools, args.requests, args.concurrency)
+        return {
+            "config": {
+                "server": "url" if args.url else "uvicorn" if args.uvicorn else "in-process",
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "cache": args.cache,
+                "customers": args.customers,
+                "assets": args.assets,
+            },
+            "routes": routes,
+        }
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if args.seed_data and not args.keep:
+            await client.drop_database(args.database)
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--assets", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", default=f"{settings.database_name}_load")
+    parser.add_argument("--no-seed", dest="seed_data", action="store_false",
+                        help="use the data already in --database")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database")
+    parser.add_argument("--cache", action="store_true", help="leave the response cache on")
+    parser.add_argument("--uvicorn", action="store_true", help="run the app under a uvicorn subprocess")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--url", help="benchmark an already running server instead")
+    parser.add_argument("--only", nargs="*", help="only routes whose name contains one of these")
+    parser.add_argument("--baseline", help="report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--save", help="write the report to this file")
+    args = parser.parse_args()
+    if args.requests < 2:
+        parser.error("--requests must be at least 2 to compute percentiles")
+
+    report = asyncio.run(run(args))
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,933 @@
+"""In-memory stand-in for MongoDB, for running the app in tests and benchmarks without a mongod.
+
+``MemoryClient`` stands in for ``AsyncIOMotorClient``: point
+``src.database.db.client`` at one, as ``benchmarks.backend_parity`` does.
+Databases and collections are dicts in the process, and operations never
+yield to the event loop, so each one is atomic. It is not part of the app:
+the routes are written against MongoDB and only ever run on it in production.
+
+Every collection keeps a hash index on the leading field of each index in the
+index plan (``customer_id``, ``site_id``, ``asset_type``, ``type``, ...), so an
+equality or ``$in`` condition on one of them is a dictionary lookup and only
+the candidates it returns are checked against the rest of the filter. Unique
+indexes are enforced and raise ``DuplicateKeyError`` like the server does.
+
+The supported subset of the MongoDB API is what the app uses:
+
+- filters: equality (``None`` also matches a missing field, and a value
+  matches the elements of an array), ``$eq``, ``$ne``, ``$gt``, ``$gte``,
+  ``$lt``, ``$lte``, ``$in``, ``$nin``, ``$exists``, ``$type``, ``$regex``,
+  ``$not``, ``$and``, ``$or``, ``$nor`` and a top-level ``$text``, which
+  matches whole lowercased words of the text-indexed fields (no stemming,
+  phrases or negation) and scores them by field weight
+- updates: ``$set``, ``$unset`` and ``$inc`` on dotted paths, without upserts
+- projections: inclusion or exclusion of dotted paths and ``$meta: textScore``
+- cursors: ``sort``, ``skip``, ``limit``, ``to_list`` and ``async for``;
+  ``batch_size`` and ``max_time_ms`` are accepted and ignored
+- aggregation: ``$match``, ``$project`` (field paths, ``$literal`` and
+  ``$convert`` to ``objectId`` or ``string``), ``$group`` (``$sum``, ``$avg``,
+  ``$min``, ``$max``, ``$first``, ``$last``, ``$push``), ``$sort``, ``$skip``,
+  ``$limit``, ``$count``, ``$facet``, ``$unionWith`` and the ``localField`` /
+  ``foreignField`` form of ``$lookup``, with an optional ``pipeline``
+- ``bulk_write`` of ``InsertOne``, ``UpdateOne``, ``UpdateMany``,
+  ``DeleteOne`` and ``DeleteMany``, and the ``ping`` command
+
+Anything else raises ``OperationFailure``, so unsupported use fails loudly
+instead of matching the wrong documents. There are no change streams, so
+change events are published by the routes. ``benchmarks.backend_parity``
+sends every route the same requests to this and a reference backend and
+fails on any difference in the responses.
+"""
+import itertools
+import operator
+import re
+from datetime import datetime, timezone
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DeleteMany, DeleteOne, InsertOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import (BulkWriteResult, DeleteResult, InsertManyResult,
+                             InsertOneResult, UpdateResult)
+
+from src.indexes import INDEXES
+
+_MISSING = object()
+# Hash index bucket of documents whose value cannot be hashed (arrays,
+# subdocuments); they are candidates for every lookup on the field
+_UNHASHABLE = object()
+
+COMPARISONS = {"$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+
+TYPES = {
+    "double": float, "int": int, "long": int, "number": (int, float), "string": str,
+    "object": dict, "array": list, "binData": bytes, "objectId": ObjectId,
+    "bool": bool, "date": datetime, "null": type(None),
+}
+
+
+# Values stored as they are
+_IMMUTABLE = {str, int, float, bool, type(None), bytes, ObjectId}
+
+
+CONVERSIONS = {"objectId": ObjectId, "string": str}
+
+
+def _unsupported(what: str):
+    return OperationFailure(f"{what} is not supported by the in-memory store")
+
+
+def _copy(value):
+    """Copy the dicts and lists of a document; the other BSON values are immutable"""
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _stored(value):
+    """Copy a value as a BSON round trip returns it.
+
+    Enums come back as their plain value, tuples as lists and datetimes as
+    naive UTC with millisecond precision.
+    """
+    if type(value) in _IMMUTABLE:
+        return value
+    if isinstance(value, dict):
+        return {key: _stored(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_stored(item) for item in value]
+    if isinstance(value, str):
+        return str.__str__(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return int.__int__(value)
+    if isinstance(value, float):
+        return float.__float__(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+
+def _get(document, path: str):
+    if "." not in path:
+        return document.get(path, _MISSING) if isinstance(document, dict) else _MISSING
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _set(document: dict, path: str, value):
+    *parents, field = path.split(".")
+    for part in parents:
+        child = document.get(part)
+        if not isinstance(child, dict):
+            child = document[part] = {}
+        document = child
+    document[field] = value
+
+
+def _unset(document: dict, path: str):
+    *parents, field = path.split(".")
+    for part in parents:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(field, None)
+
+
+def _rank(value) -> int:
+    """Position of the value's type in MongoDB's comparison order"""
+    if value is None or value is _MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def _sort_key(value):
+    rank = _rank(value)
+    if rank == 1:
+        return rank, 0
+    if rank in (4, 5, 10):
+        return rank, repr(value)
+    return rank, value
+
+
+def _hash_key(value) -> Hashable:
+    if value is _MISSING:
+        return None
+    try:
+        hash(value)
+    except TypeError:
+        return _UNHASHABLE
+    return value
+
+
+def _group_key(value) -> Hashable:
+    if isinstance(value, dict):
+        return 4, tuple((key, _group_key(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return 5, tuple(_group_key(item) for item in value)
+    return _rank(value), value
+
+
+def _candidates_of(value) -> list:
+    """The value and, for an array, its elements, which a condition can match"""
+    return [value, *value] if isinstance(value, list) else [value]
+
+
+def _equals(value, expected) -> bool:
+    if expected is None and value is _MISSING:
+        return True
+    return any(
+        _rank(candidate) == _rank(expected) and candidate == expected
+        for candidate in _candidates_of(value)
+    )
+
+
+def _compare(value, operand, compare) -> bool:
+    for candidate in _candidates_of(value):
+        # Values of different types never match a range
+        if candidate is _MISSING or _rank(candidate) != _rank(operand):
+            continue
+        if candidate is None:
+            if compare in (operator.ge, operator.le):
+                return True
+            continue
+        try:
+            if compare(candidate, operand):
+                return True
+        except TypeError:
+            continue
+    return False
+
+
+def _is_operators(condition) -> bool:
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith("$") for key in condition)
+
+
+def _match_value(value, condition) -> bool:
+    if not _is_operators(condition):
+        return _equals(value, condition)
+    for name, operand in condition.items():
+        if name == "$eq":
+            matched = _equals(value, operand)
+        elif name == "$ne":
+            matched = not _equals(value, operand)
+        elif name in COMPARISONS:
+            matched = _compare(value, operand, COMPARISONS[name])
+        elif name == "$in":
+            matched = any(_equals(value, item) for item in operand)
+        elif name == "$nin":
+            matched = not any(_equals(value, item) for item in operand)
+        elif name == "$exists":
+            matched = (value is not _MISSING) == bool(operand)
+        elif name == "$type":
+            types = tuple(TYPES[t] for t in (operand if isinstance(operand, list) else [operand]) if t in TYPES)
+            matched = value is not _MISSING and isinstance(value, types) and not (
+                isinstance(value, bool) and bool not in types
+            )
+        elif name == "$regex":
+            flags = sum(getattr(re, flag.upper(), 0) for flag in condition.get("$options", ""))
+            pattern = operand if isinstance(operand, re.Pattern) else re.compile(operand, flags)
+            matched = any(isinstance(c, str) and pattern.search(c) for c in _candidates_of(value))
+        elif name == "$options":
+            continue
+        elif name == "$not":
+            matched = not _match_value(value, operand)
+        else:
+            raise _unsupported(f"Query operator {name}")
+        if not matched:
+            return False
+    return True
+
+
+def _matches(document: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$and":
+            matched = all(_matches(document, clause) for clause in condition)
+        elif key == "$or":
+            matched = any(_matches(document, clause) for clause in condition)
+        elif key == "$nor":
+            matched = not any(_matches(document, clause) for clause in condition)
+        elif key == "$text":
+            continue  # scored by the collection
+        elif key.startswith("$"):
+            raise _unsupported(f"Query operator {key}")
+        else:
+            matched = _match_value(_get(document, key), condition)
+        if not matched:
+            return False
+    return True
+
+
+def _project(document: dict, projection: Optional[dict], score=None) -> dict:
+    """Apply a find projection to a stored document, returning a copy"""
+    if not projection:
+        return _copy(document)
+    meta = [field for field, value in projection.items() if isinstance(value, dict)]
+    flags = {field: value for field, value in projection.items() if not isinstance(value, dict)}
+    if any(value for field, value in flags.items() if field != "_id"):
+        projected = {}
+        if flags.get("_id", 1) and "_id" in document:
+            projected["_id"] = document["_id"]
+        for path, include in flags.items():
+            value = _get(document, path)
+            if include and path != "_id" and value is not _MISSING:
+                _set(projected, path, _copy(value))
+    else:
+        projected = _copy(document)
+        for path, include in flags.items():
+            if not include:
+                _unset(projected, path)
+    for field in meta:
+        if projection[field] != {"$meta": "textScore"}:
+            raise _unsupported(f"Projection {projection[field]}")
+        projected[field] = score
+    return projected
+
+
+def _evaluate(document: dict, expression):
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get(document, expression[1:])
+        return None if value is _MISSING else value
+    if _is_operators(expression):
+        [(name, argument)] = expression.items()
+        if name == "$literal":
+            return argument
+        if name == "$convert":
+            return _convert(document, argument)
+        raise _unsupported(f"Expression {name}")
+    if isinstance(expression, dict):
+        return {key: _evaluate(document, value) for key, value in expression.items()}
+    if isinstance(expression, list):
+        return [_evaluate(document, value) for value in expression]
+    return expression
+
+
+def _convert(document: dict, spec: dict):
+    value = _evaluate(document, spec["input"])
+    if value is None:
+        return spec.get("onNull")
+    if spec["to"] not in CONVERSIONS:
+        raise _unsupported(f"$convert to {spec['to']}")
+    try:
+        return CONVERSIONS[spec["to"]](value)
+    except (InvalidId, TypeError, ValueError):
+        if "onError" in spec:
+            return spec["onError"]
+        raise OperationFailure(f"Failed to convert {value!r} to {spec['to']}", 241)
+
+
+def _project_stage(document: dict, spec: dict) -> dict:
+    flags = {field: value for field, value in spec.items() if isinstance(value, (bool, int))}
+    computed = {field: value for field, value in spec.items() if field not in flags}
+    if not computed and not any(value for field, value in flags.items() if field != "_id"):
+        return _project(document, flags)
+    projected = {}
+    if flags.get("_id", 1) and "_id" in document:
+        projected["_id"] = document["_id"]
+    for path, include in flags.items():
+        value = _get(document, path)
+        if include and path != "_id" and value is not _MISSING:
+            _set(projected, path, value)
+    for path, expression in computed.items():
+        _set(projected, path, _evaluate(document, expression))
+    return projected
+
+
+def _numbers(values) -> list:
+    return [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+
+
+def _accumulate(name: str, values: list):
+    if name == "$sum":
+        return sum(_numbers(values))
+    if name == "$avg":
+        numbers = _numbers(values)
+        return sum(numbers) / len(numbers) if numbers else None
+    if name in ("$min", "$max"):
+        present = [value for value in values if value is not None]
+        if not present:
+            return None
+        return (min if name == "$min" else max)(present, key=_sort_key)
+    if name == "$first":
+        return values[0] if values else None
+    if name == "$last":
+        return values[-1] if values else None
+    if name == "$push":
+        return values
+    raise _unsupported(f"Accumulator {name}")
+
+
+def _group(documents: Iterable[dict], spec: dict) -> List[dict]:
+    groups: Dict[Hashable, Tuple[object, List[dict]]] = {}
+    for document in documents:
+        key = _evaluate(document, spec["_id"])
+        groups.setdefault(_group_key(key), (key, []))[1].append(document)
+    rows = []
+    for key, members in groups.values():
+        row = {"_id": key}
+        for field, accumulator in spec.items():
+            if field != "_id":
+                [(name, expression)] = accumulator.items()
+                row[field] = _accumulate(name, [_evaluate(member, expression) for member in members])
+        rows.append(row)
+    return rows
+
+
+def _sorted(documents: Iterable[dict], sort: List[tuple], scores: Optional[dict] = None) -> List[dict]:
+    documents = list(documents)
+    # Stable sorts from the last key to the first give the compound order
+    for field, direction in reversed(sort):
+        if isinstance(direction, dict):
+            if direction != {"$meta": "textScore"} or scores is None:
+                raise _unsupported(f"Sort {direction}")
+            documents.sort(key=lambda document: scores.get(document["_id"], 0), reverse=True)
+        else:
+            documents.sort(key=lambda document: _sort_key(_get(document, field)), reverse=direction == -1)
+    return documents
+
+
+def _sort_spec(key_or_list, direction=None) -> List[tuple]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [tuple(item) for item in key_or_list]
+
+
+def _words(text) -> List[str]:
+    return re.findall(r"\w+", text.lower()) if isinstance(text, str) else []
+
+
+def _lookup_keys(condition) -> Optional[list]:
+    """Values a condition matches by equality, if that is all it does"""
+    if _is_operators(condition):
+        if set(condition) == {"$eq"}:
+            condition = condition["$eq"]
+        elif set(condition) == {"$in"}:
+            keys = list(condition["$in"])
+            return keys if all(_hash_key(key) is not _UNHASHABLE for key in keys) else None
+        else:
+            return None
+    if isinstance(condition, (dict, list)) or _hash_key(condition) is _UNHASHABLE:
+        return None
+    return [condition]
+
+
+class MemoryCursor:
+    """The part of a Motor cursor the app uses, over a list produced on first read"""
+
+    def __init__(self, produce):
+        self._produce = produce
+        self._results: Optional[List[dict]] = None
+        self._position = 0
+
+    def batch_size(self, batch_size: int) -> "MemoryCursor":
+        return self
+
+    def max_time_ms(self, max_time_ms: Optional[int]) -> "MemoryCursor":
+        return self
+
+    def _fetch(self) -> List[dict]:
+        if self._results is None:
+            self._results = self._produce()
+        return self._results
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = self._fetch()
+        end = len(results) if length is None else min(self._position + length, len(results))
+        batch, self._position = results[self._position:end], end
+        return batch
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        results = self._fetch()
+        if self._position >= len(results):
+            raise StopAsyncIteration
+        self._position += 1
+        return results[self._position - 1]
+
+
+class MemoryFindCursor(MemoryCursor):
+    def __init__(self, collection: "MemoryCollection", filter: dict, projection: Optional[dict]):
+        super().__init__(self._execute)
+        self._collection = collection
+        self._filter = filter
+        self._projection = projection
+        self._sort: List[tuple] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction: Optional[int] = None) -> "MemoryFindCursor":
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int) -> "MemoryFindCursor":
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> "MemoryFindCursor":
+        self._limit = limit
+        return self
+
+    def _execute(self) -> List[dict]:
+        scores = {} if "$text" in self._filter else None
+        documents = self._collection._matching(self._filter, scores)
+        if self._sort:
+            documents = _sorted(documents, self._sort, scores)
+        # Without a sort, a limit stops the scan early
+        end = self._skip + abs(self._limit) if self._limit else None
+        return [
+            _project(document, self._projection, scores.get(document["_id"]) if scores else None)
+            for document in itertools.islice(documents, self._skip, end)
+        ]
+
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        # _id -> document, in insertion order
+        self._documents: Dict[Hashable, dict] = {}
+        # field -> value -> ids (a dict used as an ordered set)
+        self._hashed: Dict[str, Dict[Hashable, Dict[Hashable, None]]] = {}
+        # index name -> (fields, key -> id)
+        self._unique: Dict[str, Tuple[Tuple[str, ...], Dict[tuple, Hashable]]] = {}
+        self._text_weights: Dict[str, int] = {}
+        self._indexes: Dict[str, dict] = {"_id_": {"v": 2, "key": [("_id", 1)]}}
+
+    # Indexes
+
+    def _create_index(self, model) -> str:
+        spec = dict(model.document)
+        name = spec.pop("name")
+        key = list(spec["key"].items())
+        if any(direction == "text" for _, direction in key):
+            weights = spec.get("weights", {})
+            self._text_weights = {field: weights.get(field, 1) for field, direction in key if direction == "text"}
+        else:
+            field = key[0][0]
+            if field != "_id" and field not in self._hashed:
+                self._hashed[field] = {}
+                for document in self._documents.values():
+                    self._hash_add(field, document)
+        if spec.get("unique"):
+            fields = tuple(field for field, _ in key)
+            keys = {}
+            for document in self._documents.values():
+                unique_key = self._unique_key(document, fields)
+                if unique_key is not None and unique_key in keys:
+                    raise DuplicateKeyError(f"E11000 duplicate key error building index {name}", 11000)
+                keys[unique_key] = document["_id"]
+            self._unique[name] = (fields, keys)
+        self._indexes[name] = {"v": 2, **spec, "key": key}
+        return name
+
+    async def create_indexes(self, indexes: list) -> List[str]:
+        return [self._create_index(model) for model in indexes]
+
+    async def index_information(self) -> dict:
+        return _copy(self._indexes)
+
+    def _hash_add(self, field: str, document: dict):
+        self._hashed[field].setdefault(_hash_key(_get(document, field)), {})[document["_id"]] = None
+
+    @staticmethod
+    def _unique_key(document: dict, fields: Tuple[str, ...]) -> Optional[tuple]:
+        key = tuple(_hash_key(_get(document, field)) for field in fields)
+        return None if _UNHASHABLE in key else key
+
+    def _index(self, document: dict):
+        for field in self._hashed:
+            self._hash_add(field, document)
+        for fields, keys in self._unique.values():
+            unique_key = self._unique_key(document, fields)
+            if unique_key is not None:
+                keys[unique_key] = document["_id"]
+
+    def _unindex(self, document: dict):
+        for field, buckets in self._hashed.items():
+            key = _hash_key(_get(document, field))
+            bucket = buckets.get(key)
+            if bucket is not None:
+                bucket.pop(document["_id"], None)
+                if not bucket:
+                    del buckets[key]
+        for fields, keys in self._unique.values():
+            unique_key = self._unique_key(document, fields)
+            if unique_key is not None and keys.get(unique_key) == document["_id"]:
+                del keys[unique_key]
+
+    def _check_unique(self, document: dict):
+        for name, (fields, keys) in self._unique.items():
+            unique_key = self._unique_key(document, fields)
+            existing = keys.get(unique_key, _MISSING) if unique_key is not None else _MISSING
+            if existing is not _MISSING and existing != document["_id"]:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.database.name}.{self.name} "
+                    f"index: {name} dup key: {dict(zip(fields, unique_key))}",
+                    11000,
+                )
+
+    # Reads
+
+    def _candidates(self, query: dict) -> Optional[Iterable[Hashable]]:
+        """Ids narrowed down by the most selective indexed condition, or ``None`` to scan"""
+        best = None
+        for field, condition in query.items():
+            ids = None
+            if field == "$and":
+                for clause in condition:
+                    clause_ids = self._candidates(clause)
+                    if clause_ids is not None and (ids is None or len(clause_ids) < len(ids)):
+                        ids = clause_ids
+            elif field == "_id" or field in self._hashed:
+                keys = _lookup_keys(condition)
+                if keys is None:
+                    continue
+                if field == "_id":
+                    ids = [key for key in keys if key in self._documents]
+                else:
+                    buckets = self._hashed[field]
+                    if len(keys) == 1 and _UNHASHABLE not in buckets:
+                        ids = buckets.get(keys[0], {})
+                    else:
+                        ids = {}
+                        for key in [*keys, _UNHASHABLE]:
+                            ids.update(buckets.get(key, {}))
+            if ids is not None and (best is None or len(ids) < len(best)):
+                best = ids
+        return best
+
+    def _text_score(self, document: dict, terms: set) -> float:
+        score = 0
+        for field, weight in self._text_weights.items():
+            value = _get(document, field)
+            words = set(_words(value)) if isinstance(value, str) else {
+                word for item in _candidates_of(value)[1:] for word in _words(item)
+            }
+            score += weight * len(terms & words)
+        return score
+
+    def _matching(self, query: Optional[dict], scores: Optional[dict] = None) -> Iterator[dict]:
+        """Stored documents matching ``query``; ``$text`` scores are added to ``scores``"""
+        query = query or {}
+        text = query.get("$text")
+        if text is not None:
+            if not self._text_weights:
+                raise OperationFailure("text index required for $text query", 27)
+            terms = set(_words(text.get("$search", "")))
+        ids = self._candidates(query)
+        documents = self._documents.values() if ids is None else [self._documents[i] for i in ids]
+        for document in documents:
+            if not _matches(document, query):
+                continue
+            if text is not None:
+                score = self._text_score(document, terms)
+                if not score:
+                    continue
+                if scores is not None:
+                    scores[document["_id"]] = score
+            yield document
+
+    def _first(self, query: dict, sort=None) -> Optional[dict]:
+        documents = self._matching(query)
+        if sort:
+            documents = iter(_sorted(documents, _sort_spec(sort)))
+        return next(documents, None)
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None) -> MemoryFindCursor:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        return MemoryFindCursor(self, filter or {}, projection)
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None) -> Optional[dict]:
+        [document] = await self.find(filter, projection).limit(1).to_list(None) or [None]
+        return document
+
+    async def count_documents(self, filter: dict) -> int:
+        return sum(1 for _ in self._matching(filter))
+
+    def aggregate(self, pipeline: List[dict]) -> MemoryCursor:
+        return MemoryCursor(lambda: [_copy(document) for document in self._aggregate(pipeline)])
+
+    def _aggregate(self, pipeline: List[dict]) -> List[dict]:
+        stages = list(pipeline)
+        # A leading $match can use the indexes
+        if stages and "$match" in stages[0]:
+            documents = list(self._matching(stages.pop(0)["$match"]))
+        else:
+            documents = list(self._documents.values())
+        return self.database._run_pipeline(documents, stages)
+
+    # Writes
+
+    def _insert(self, document: dict):
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        stored = _stored(document)
+        if _hash_key(stored["_id"]) is _UNHASHABLE:
+            raise _unsupported("An array or subdocument _id")
+        if stored["_id"] in self._documents:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.database.name}.{self.name} "
+                f"index: _id_ dup key: {{ _id: {stored['_id']!r} }}",
+                11000,
+            )
+        self._check_unique(stored)
+        self._documents[stored["_id"]] = stored
+        self._index(stored)
+        return stored["_id"]
+
+    def _replace(self, current: dict, update: dict) -> dict:
+        if not _is_operators(update):
+            raise _unsupported("A replacement document")
+        updated = _copy(current)
+        for name, fields in update.items():
+            for path, value in fields.items():
+                if path == "_id" or path.startswith("_id."):
+                    raise OperationFailure("The _id field cannot be updated", 66)
+                if name == "$set":
+                    _set(updated, path, _stored(value))
+                elif name == "$unset":
+                    _unset(updated, path)
+                elif name == "$inc":
+                    present = _get(updated, path)
+                    present = 0 if present is _MISSING else present
+                    if len(_numbers([present, value])) != 2:
+                        raise OperationFailure("Cannot apply $inc to a value of non-numeric type", 14)
+                    _set(updated, path, present + _stored(value))
+                else:
+                    raise _unsupported(f"Update operator {name}")
+        self._check_unique(updated)
+        self._unindex(current)
+        self._documents[updated["_id"]] = updated
+        self._index(updated)
+        return updated
+
+    def _delete(self, document: dict):
+        self._unindex(document)
+        del self._documents[document["_id"]]
+
+    def _update(self, filter: dict, update: dict, multi: bool, upsert: bool) -> dict:
+        if upsert:
+            raise _unsupported("Upsert")
+        documents = list(itertools.islice(self._matching(filter), None if multi else 1))
+        modified = 0
+        for document in documents:
+            modified += self._replace(document, update) != document
+        return {"n": len(documents), "nModified": modified, "ok": 1.0}
+
+    async def insert_one(self, document: dict) -> InsertOneResult:
+        return InsertOneResult(self._insert(document), True)
+
+    async def insert_many(self, documents: Iterable[dict], ordered: bool = True) -> InsertManyResult:
+        documents = list(documents)
+        if not documents:
+            raise TypeError("documents must be a non-empty list")
+        self._bulk([InsertOne(document) for document in documents], ordered)
+        return InsertManyResult([document["_id"] for document in documents], True)
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        return UpdateResult(self._update(filter, update, False, upsert), True)
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        return UpdateResult(self._update(filter, update, True, upsert), True)
+
+    async def find_one_and_update(
+        self, filter: dict, update: dict, projection: Optional[dict] = None,
+        sort=None, upsert: bool = False, return_document: bool = False,
+    ) -> Optional[dict]:
+        if upsert:
+            raise _unsupported("Upsert")
+        current = self._first(filter, sort)
+        if current is None:
+            return None
+        updated = self._replace(current, update)
+        return _project(updated if return_document else current, projection)
+
+    async def find_one_and_delete(self, filter: dict, projection: Optional[dict] = None, sort=None) -> Optional[dict]:
+        current = self._first(filter, sort)
+        if current is None:
+            return None
+        self._delete(current)
+        return _project(current, projection)
+
+    async def delete_one(self, filter: dict) -> DeleteResult:
+        current = self._first(filter)
+        if current is not None:
+            self._delete(current)
+        return DeleteResult({"n": int(current is not None), "ok": 1.0}, True)
+
+    async def delete_many(self, filter: dict) -> DeleteResult:
+        documents = list(self._matching(filter))
+        for document in documents:
+            self._delete(document)
+        return DeleteResult({"n": len(documents), "ok": 1.0}, True)
+
+    def _bulk(self, requests: list, ordered: bool) -> dict:
+        result = {
+            "writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+            "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+        }
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    result["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany)):
+                    multi = isinstance(request, UpdateMany)
+                    updated = self._update(request._filter, request._doc, multi, request._upsert)
+                    result["nMatched"] += updated["n"]
+                    result["nModified"] += updated["nModified"]
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    limit = 1 if isinstance(request, DeleteOne) else None
+                    for document in list(itertools.islice(self._matching(request._filter), limit)):
+                        self._delete(document)
+                        result["nRemoved"] += 1
+                else:
+                    raise _unsupported(f"Bulk operation {type(request).__name__}")
+            except DuplicateKeyError as e:
+                result["writeErrors"].append({"index": index, "code": e.code, "errmsg": str(e), "op": request._doc})
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return result
+
+    async def bulk_write(self, requests: list, ordered: bool = True) -> BulkWriteResult:
+        return BulkWriteResult(self._bulk(list(requests), ordered), True)
+
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(self, name)
+            # Planned indexes exist from the start, as if reconciled
+            for model in INDEXES.get(name, []):
+                collection._create_index(model)
+        return collection
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def list_collection_names(self) -> List[str]:
+        return [name for name, collection in self._collections.items() if collection._documents]
+
+    async def drop_collection(self, name: str):
+        self._collections.pop(name, None)
+
+    async def command(self, command, **kwargs) -> dict:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name == "ping":
+            return {"ok": 1.0}
+        raise _unsupported(f"Command {name}")
+
+    def watch(self, pipeline: Optional[List[dict]] = None, **kwargs):
+        raise _unsupported("Change streams")
+
+    def _run_pipeline(self, documents: List[dict], stages: List[dict]) -> List[dict]:
+        for stage in stages:
+            if len(stage) != 1:
+                raise OperationFailure("A pipeline stage specification object must contain exactly one field.", 40323)
+            [(name, spec)] = stage.items()
+            if name == "$match":
+                if "$text" in spec:
+                    raise _unsupported("$text after the first stage")
+                documents = [document for document in documents if _matches(document, spec)]
+            elif name == "$project":
+                documents = [_project_stage(document, spec) for document in documents]
+            elif name == "$group":
+                documents = _group(documents, spec)
+            elif name == "$sort":
+                documents = _sorted(documents, list(spec.items()))
+            elif name == "$skip":
+                documents = documents[spec:]
+            elif name == "$limit":
+                documents = documents[:spec]
+            elif name == "$count":
+                documents = [{spec: len(documents)}] if documents else []
+            elif name == "$facet":
+                documents = [{field: self._run_pipeline(documents, pipeline) for field, pipeline in spec.items()}]
+            elif name == "$lookup":
+                if "localField" not in spec:
+                    raise _unsupported("$lookup without localField")
+                foreign = self[spec["from"]]
+                joined = []
+                for document in documents:
+                    value = _get(document, spec["localField"])
+                    keys = value if isinstance(value, list) else [None if value is _MISSING else value]
+                    matches = list(foreign._matching({spec["foreignField"]: {"$in": keys}}))
+                    joined.append({**document, spec["as"]: self._run_pipeline(matches, spec.get("pipeline", []))})
+                documents = joined
+            elif name == "$unionWith":
+                spec = {"coll": spec} if isinstance(spec, str) else spec
+                documents = documents + self[spec["coll"]]._aggregate(spec.get("pipeline", []))
+            else:
+                raise _unsupported(f"Aggregation stage {name}")
+        return documents
+
+
+class MemoryClient:
+    """Stands in for ``AsyncIOMotorClient``; databases are created on first use"""
+
+    def __init__(self):
+        self._databases: Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = MemoryDatabase(self, name)
+        return database
+
+    def __getattr__(self, name: str) -> MemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def drop_database(self, name_or_database):
+        # Handles to the database stay usable, as with the server
+        database = self._databases.get(getattr(name_or_database, "name", name_or_database))
+        if database is not None:
+            database._collections.clear()
+
+    def close(self):
+        pass
@@ -0,0 +1,298 @@
+"""Check that every query the read routes issue is backed by an index.
+
+Seeds a scratch database (see ``benchmarks.seed``), reconciles the index
+plan, then calls each case in ``CASES`` through the app in-process while a
+command listener records what it sends to MongoDB. Every recorded query is
+run through ``explain`` and fails the check when its plan scans the whole
+collection, sorts in memory, or examines more than ``--max-ratio`` documents
+per document returned. Paged cases follow the next-page cursor, so the
+keyset filter of ``after`` is explained as well as the first page.
+
+Every filter parameter of every GET route that queries MongoDB must be used
+by at least one case: a new filter without a case fails the check too, so it
+cannot be added without also showing its query is indexed. ``explain`` needs
+a real ``mongod``; exits non-zero on any failure.
+
+    python -m benchmarks.plan_check --customers 2000 --assets 1000000
+    python -m benchmarks.plan_check --no-seed --database asset_management_seed
+"""
+import argparse
+import asyncio
+import json
+import sys
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from benchmarks.seed import add_arguments, seed
+from src import database
+from src.config import settings
+from src.indexes import reconcile_indexes
+from src.pagination import NEXT_CURSOR_HEADER
+from src.query_debug import EXPLAINABLE, Query, explain_document, plan_summary, shape_key
+
+# Query parameters that shape the response rather than select documents
+PRESENTATION_PARAMS = {"limit", "after", "sort", "fields", "expand", "format", "batch_size"}
+
+# GET routes that stream from the in-process event bus and issue no queries
+UNQUERIED_PATHS = {"/events"}
+
+
+class Case(NamedTuple):
+    path: str  # OpenAPI path template
+    params: Dict[str, str] = {}
+    allow_collscan: bool = False
+    # Off for counts and relevance-sorted search, which examine every match
+    check_ratio: bool = True
+    # Relevance and job listings sort in memory by design
+    allow_sort: bool = False
+    # Pages to read, each after the previous one's cursor
+    pages: int = 1
+
+
+# Values in braces are filled in from documents sampled out of the dataset
+CASES: List[Case] = [
+    Case("/assets", {"customer_id": "{customer_id}"}),
+    Case("/assets", {"customer_id": "{customer_id}", "asset_type": "host"}),
+    Case("/assets", {"customer_id": "{customer_id}", "cidr": "{cidr}"}),
+    Case("/assets", {"cidr": "{cidr}"}),
+    Case("/assets", {"customer_id": "{customer_id}", "expand": "customer,site,infrastructure"}),
+    Case("/assets", {"customer_id": "{customer_id}", "limit": "50"}, pages=2),
+    Case("/assets", {"customer_id": "{customer_id}", "asset_type": "host", "limit": "50"}, pages=2),
+    Case("/assets", {"customer_id": "{customer_id}", "sort": "hostname", "limit": "50"}, pages=2),
+    Case("/assets", {"customer_id": "{customer_id}", "sort": "-ip_address", "limit": "50"}, pages=2),
+    Case("/assets", {"customer_id": "{customer_id}", "sort": "asset_type", "limit": "50"}, pages=2),
+    # The asset type is filtered on the customer's hostname-ordered entries
+    Case("/assets", {"customer_id": "{customer_id}", "asset_type": "host", "sort": "hostname", "limit": "50"},
+         check_ratio=False, pages=2),
+    # Addresses are handed out in sequence, so a customer has few in any /24
+    Case("/assets", {"customer_id": "{customer_id}", "cidr": "{wide_cidr}", "limit": "10"}, pages=2),
+    Case("/assets", {"cidr": "{cidr}", "limit": "50"}, pages=2),
+    Case("/assets", {"sort": "hostname", "limit": "50"}, pages=2),
+    Case("/assets", {"sort": "ip_address", "limit": "50"}, pages=2),
+    Case("/assets", {"sort": "-customer_id", "limit": "50"}, pages=2),
+    Case("/assets", {"sort": "site_id", "limit": "50"}, pages=2),
+    Case("/assets", {"asset_type": "vm", "sort": "asset_type", "limit": "50"}, pages=2),
+    Case("/assets", {"as_of": "{as_of}", "limit": "100"}, pages=2),
+    Case("/assets", {"as_of": "{as_of}", "customer_id": "{customer_id}", "limit": "50"}, pages=2),
+    # Type and address are matched on the rebuilt assets, after the customer's history is read
+    Case("/assets", {"as_of": "{as_of}", "customer_id": "{customer_id}", "asset_type": "host", "limit": "20"},
+         check_ratio=False, pages=2),
+    Case("/assets", {"as_of": "{as_of}", "customer_id": "{customer_id}", "cidr": "{wide_cidr}", "limit": "10"},
+         check_ratio=False),
+    Case("/assets/{asset_id}"),
+    Case("/assets/{asset_id}", {"as_of": "{as_of}"}),
+    Case("/assets/{asset_id}/history"),
+    Case("/assets/{asset_id}/history", {"sort": "ts", "limit": "1"}),
+    Case("/assets/site/{site_id}", {"expand": "customer,site"}),
+    Case("/assets/site/{site_id}", {"limit": "5"}, pages=2),
+    Case("/assets/subnets/utilization", {"cidr": "{cidr}"}, check_ratio=False),
+    Case("/assets/subnets/utilization", {"cidr": "{cidr}", "customer_id": "{customer_id}"}, check_ratio=False),
+    Case("/assets/search", {"q": "web-ub", "mode": "prefix"}),
+    Case("/assets/search", {"q": "web", "mode": "prefix", "customer_id": "{customer_id}", "asset_type": "host"}),
+    # Few assets of a /24 share a hostname prefix, so most index entries are filtered out
+    Case("/assets/search", {"q": "web", "mode": "prefix", "cidr": "{cidr}"}, check_ratio=False),
+    Case("/assets/search", {"q": "ubuntu", "mode": "text"}, check_ratio=False, allow_sort=True),
+    # Listing every customer is a full scan by definition
+    Case("/customers/", {"limit": "100"}, allow_collscan=True),
+    Case("/customers/", {"sort": "name", "limit": "100"}, pages=2),
+    Case("/customers/{customer_id}"),
+    Case("/customers/{customer_id}/summary", check_ratio=False),
+    Case("/customers/{customer_id}/topology"),
+    Case("/sites/", {"customer_id": "{customer_id}"}),
+    Case("/sites/", {"customer_id": "{customer_id}", "limit": "1"}, pages=2),
+    Case("/sites/", {"customer_id": "{customer_id}", "sort": "-name", "limit": "1"}, pages=2),
+    Case("/sites/", {"sort": "customer_id", "limit": "50"}, pages=2),
+    Case("/infrastructure/", {"customer_id": "{customer_id}"}),
+    Case("/infrastructure/", {"customer_id": "{customer_id}", "location_type": "aws"}),
+    Case("/infrastructure/", {"site_id": "{infrastructure_site_id}"}),
+    Case("/infrastructure/", {"location_type": "datacenter", "expand": "site"}),
+    Case("/infrastructure/", {"customer_id": "{customer_id}", "sort": "type", "limit": "1"}, pages=2),
+    Case("/infrastructure/", {"site_id": "{infrastructure_site_id}", "limit": "1"}),
+    Case("/infrastructure/", {"location_type": "aws", "limit": "50"}, pages=2),
+    Case("/infrastructure/", {"sort": "site_id", "limit": "50"}, pages=2),
+    Case("/infrastructure/", {"sort": "-customer_id", "limit": "50"}, pages=2),
+    Case("/infrastructure/{infrastructure_id}/impact"),
+    Case("/export/assets", {"customer_id": "{customer_id}", "asset_type": "vm", "format": "ndjson"}),
+    Case("/export/assets", {"site_id": "{site_id}", "format": "ndjson"}),
+    Case("/export/assets", {"cidr": "{cidr}", "format": "csv"}),
+    Case("/export/sites", {"customer_id": "{customer_id}", "format": "ndjson"}),
+    Case("/export/infrastructure", {"customer_id": "{customer_id}", "location_type": "azure"}),
+    Case("/export/infrastructure", {"site_id": "{infrastructure_site_id}"}),
+    Case("/export/customers", {"format": "ndjson"}, allow_collscan=True),
+    Case("/jobs", {"status": "queued"}),
+    # Jobs are few and short-lived; filtering them by kind alone may scan
+    Case("/jobs", {"kind": "delete_customer"}, allow_collscan=True, allow_sort=True),
+]
+
+_captured: ContextVar[Optional[List[Query]]] = ContextVar("plan_check_captured", default=None)
+
+
+class CaptureQueries(monitoring.CommandListener):
+    """Keep the explainable commands issued while a case runs"""
+
+    def started(self, event):
+        captured = _captured.get()
+        if captured is not None and event.command_name in EXPLAINABLE:
+            collection = event.command.get(event.command_name)
+            captured.append(Query(event.command_name, collection, event.database_name, event.command, 0.0))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def uncovered_filters(openapi: dict, cases: List[Case] = CASES) -> List[str]:
+    """GET filter parameters that no case exercises"""
+    used: Dict[str, set] = {}
+    for case in cases:
+        used.setdefault(case.path, set()).update(case.params)
+    missing = []
+    for path, operations in openapi["paths"].items():
+        operation = operations.get("get")
+        if operation is None or path in UNQUERIED_PATHS:
+            continue
+        for parameter in operation.get("parameters", []):
+            name = parameter["name"]
+            if parameter["in"] == "query" and name not in PRESENTATION_PARAMS and name not in used.get(path, ()):
+                missing.append(f"{path}?{name}")
+    return missing
+
+
+def _execution_stats(value, found: List[dict]):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "executionStats" and isinstance(item, dict):
+                found.append(item)
+            else:
+                _execution_stats(item, found)
+    elif isinstance(value, list):
+        for item in value:
+            _execution_stats(item, found)
+
+
+async def sample(db) -> Dict[str, str]:
+    """Ids to fill the cases with, taken from the seeded data"""
+    asset = await db.assets.find_one({"site_id": {"$ne": None}})
+    location = await db.infrastructure.find_one({"site_id": {"$ne": None}})
+    vm = await db.assets.find_one({"specs.infrastructure_location_id": {"$ne": None}})
+    if asset is None or location is None or vm is None:
+        raise SystemExit("The database has no assets at a site, on-premise infrastructure or hosted VMs to sample")
+    return {
+        "customer_id": asset["customer_id"],
+        "site_id": asset["site_id"],
+        "asset_id": str(asset["_id"]),
+        "infrastructure_site_id": location["site_id"],
+        "infrastructure_id": vm["specs"]["infrastructure_location_id"],
+        "cidr": asset["ip_address"].rsplit(".", 1)[0] + ".0/24",
+        "wide_cidr": ".".join(asset["ip_address"].split(".")[:2]) + ".0.0/16",
+        "as_of": datetime.now().isoformat(),
+    }
+
+
+async def check_case(http, db, case: Case, samples: Dict[str, str], max_ratio: float) -> dict:
+    url = case.path.format(**samples)
+    params = {name: value.format(**samples) for name, value in case.params.items()}
+    result = {"path": case.path, "params": dict(params), "status": None, "queries": [], "problems": []}
+    captured: List[Query] = []
+    for number in range(case.pages):
+        token = _captured.set(captured)
+        try:
+            response = await http.get(url, params=params)
+        finally:
+            _captured.reset(token)
+        result["status"] = response.status_code
+        if response.status_code != 200:
+            result["problems"].append(f"HTTP {response.status_code}: {response.text[:200]}")
+            break
+        after = response.headers.get(NEXT_CURSOR_HEADER)
+        if number + 1 < case.pages:
+            if after is None:
+                result["problems"].append(f"no page {number + 2} to read; the sampled data is too small")
+                break
+            params["after"] = after
+
+    seen = set()
+    for query in captured:
+        key = shape_key(query)
+        document = explain_document(query)
+        if document is None or key in seen:
+            continue
+        seen.add(key)
+        explain = await db.client[query.database].command({"explain": document, "verbosity": "executionStats"})
+        summary = plan_summary(explain)
+        stats: List[dict] = []
+        _execution_stats(explain, stats)
+        examined = sum(s.get("totalDocsExamined", 0) for s in stats)
+        returned = sum(s.get("nReturned", 0) for s in stats)
+        ratio = examined / max(returned, 1)
+        result["queries"].append({
+            "shape": key, **summary, "docs_examined": examined, "returned": returned, "ratio": round(ratio, 2),
+        })
+        if summary["collscan"] and not case.allow_collscan:
+            result["problems"].append(f"collection scan: {key}")
+        if "SORT" in summary["stages"] and not case.allow_sort:
+            result["problems"].append(f"in-memory sort: {key}")
+        if case.check_ratio and ratio > max_ratio:
+            result["problems"].append(f"examined {examined} documents for {returned}: {key}")
+    return result
+
+
+async def run(args) -> dict:
+    from src.main import app
+
+    client = AsyncIOMotorClient(settings.mongodb_url, event_listeners=[CaptureQueries()])
+    db = client[args.database]
+    # Route the app to the scratch database, bypassing the response cache
+    database.db.client = client
+    settings.database_name = args.database
+    settings.cache_enabled = False
+    settings.access_log = False
+    try:
+        if args.seed_data:
+            await seed(db, args.customers, args.assets, args.sites, args.infrastructure,
+                       args.seed, args.batch_size, args.concurrency)
+        indexes = await reconcile_indexes(db)
+        samples = await sample(db)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://plan-check", timeout=None) as http:
+            cases = [await check_case(http, db, case, samples, args.max_ratio) for case in CASES]
+        uncovered = uncovered_filters(app.openapi())
+        return {
+            "failed": [case for case in cases if case["problems"]],
+            "uncovered_filters": uncovered,
+            "indexes_failed": indexes["failed"],
+            "cases": len(cases),
+            "queries": sum(len(case["queries"]) for case in cases),
+            "passed": [f"{case['path']} {case['params']}" for case in cases if not case["problems"]],
+        }
+    finally:
+        if args.seed_data and not args.keep:
+            await client.drop_database(args.database)
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--database", default=f"{settings.database_name}_plancheck")
+    parser.add_argument("--max-ratio", type=float, default=2.0,
+                        help="documents examined per document returned")
+    parser.add_argument("--no-seed", dest="seed_data", action="store_false",
+                        help="check an already seeded database")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database")
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2, default=str))
+    if report["failed"] or report["uncovered_filters"] or report["indexes_failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""Seed a database with a large synthetic dataset.
+
+Customers each get a main site plus extra sites, a mix of infrastructure
+locations and assets spread over them: VMs hosted on the customer's
+infrastructure, hosts and network devices placed at its sites. Documents are
+shaped like the ones the routes write (counters, versions, the internal
+IP and hostname fields and the insert entry of each asset's history), and
+are inserted with concurrent unordered ``insert_many`` batches. The database
+is dropped first.
+
+    python -m benchmarks.seed --customers 2000 --assets 1000000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from src import history
+from src.config import settings
+from src.counters import initial_counts
+from src.documents import asset_document
+from src.indexes import reconcile_indexes
+from src.updates import INITIAL_VERSION
+
+COUNTRIES = ["NO", "SE", "DK", "DE", "NL", "GB"]
+CITIES = ["Oslo", "Bergen", "Stockholm", "Copenhagen", "Hamburg", "Amsterdam", "London"]
+REGIONS = ["westeurope", "northeurope", "eu-west-1", "eu-north-1", "eu-central-1"]
+ROLES = ["web", "db", "cache", "proxy", "mail", "build", "backup", "monitor", "app", "dc"]
+OS = [("ubuntu", "22.04"), ("debian", "12"), ("rhel", "9"), ("windows", "2022"), ("freebsd", "14")]
+VENDORS = {
+    "host": ["dell", "hpe", "lenovo", "supermicro"],
+    "switch": ["cisco", "juniper", "aruba"],
+    "firewall": ["fortinet", "paloalto", "juniper"],
+}
+MODELS = {
+    "switch": ["catalyst-9300", "nexus-93180", "ex4300", "cx-6300"],
+    "firewall": ["fortigate-100f", "pa-440", "srx345"],
+}
+# Share of each asset type among the assets
+ASSET_TYPES = [("vm", 0.55), ("host", 0.2), ("switch", 0.15), ("firewall", 0.1)]
+NOTES = ["primary", "replica", "decommission", "legacy", "staging", "production", "spare"]
+
+
+def _address(rng: random.Random) -> dict:
+    return {
+        "country": rng.choice(COUNTRIES),
+        "city": rng.choice(CITIES),
+        "street_address": f"{rng.randint(1, 200)} Main Street",
+        "postal_code": f"{rng.randint(1000, 9999)}",
+    }
+
+
+def _config(kind: str, name: str, rng: random.Random) -> dict:
+    if kind == "azure":
+        return {"subscription_id": str(ObjectId()), "resource_group": f"rg-{name}", "region": rng.choice(REGIONS)}
+    if kind == "aws":
+        return {"region": rng.choice(REGIONS), "vpc_id": f"vpc-{rng.getrandbits(32):08x}"}
+    if kind == "datacenter":
+        return {"name": f"dc-{name}"}
+    return {"location": f"server room {rng.randint(1, 9)}"}
+
+
+def _specs(asset_type: str, infrastructure_id: str, rng: random.Random) -> dict:
+    if asset_type == "vm":
+        os, version = rng.choice(OS)
+        return {
+            "cpu_cores": rng.choice([1, 2, 4, 8, 16]),
+            "ram_gb": rng.choice([2, 4, 8, 16, 32, 64]),
+            "os": os,
+            "os_version": version,
+            "infrastructure_location_id": infrastructure_id,
+            "vm_id": f"vm-{rng.getrandbits(40):010x}",
+        }
+    if asset_type == "host":
+        return {
+            "manufacturer": rng.choice(VENDORS["host"]),
+            "cpu_cores": rng.choice([16, 32, 64, 128]),
+            "ram_gb": rng.choice([128, 256, 512, 1024]),
+        }
+    return {"manufacturer": rng.choice(VENDORS[asset_type]), "model": rng.choice(MODELS[asset_type])}
+
+
+def _ip(i: int) -> str:
+    return f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+
+
+def make_owners(customers: int, sites: int, infrastructure: int, rng: random.Random):
+    """Customers with their sites and infrastructure; counts are filled in later"""
+    now = datetime.now()
+    customer_docs, site_docs, infrastructure_docs = [], [], []
+    for c in range(customers):
+        customer_id = ObjectId()
+        name = f"Customer {c:05d}"
+        address = _address(rng)
+        customer_docs.append({
+            "_id": customer_id,
+            "name": name,
+            "contact_email": f"contact{c}@customer{c}.example",
+            "contact_phone": f"+47 {rng.randint(10000000, 99999999)}",
+            "address": address,
+            "counts": initial_counts(),
+            "version": INITIAL_VERSION,
+        })
+        for s in range(sites):
+            site_docs.append({
+                "_id": ObjectId(),
+                "name": f"{name} - Main Site" if s == 0 else f"{name} - Site {s}",
+                "address": address if s == 0 else _address(rng),
+                "customer_id": str(customer_id),
+                "added": now - timedelta(days=rng.randint(0, 1000)),
+                "is_primary": s == 0,
+                "version": INITIAL_VERSION,
+            })
+        customer_sites = site_docs[len(site_docs) - sites:]
+        for i in range(infrastructure):
+            kind = rng.choice(["azure", "aws", "datacenter", "on_premise"])
+            infrastructure_docs.append({
+                "_id": ObjectId(),
+                "name": f"{name} {kind} {i}",
+                "type": kind,
+                "customer_id": str(customer_id),
+                "site_id": str(rng.choice(customer_sites)["_id"]) if kind == "on_premise" and sites else None,
+                "description": None,
+                "config": _config(kind, f"{c}-{i}", rng),
+                "is_active": rng.random() > 0.1,
+                "version": INITIAL_VERSION,
+            })
+    return customer_docs, site_docs, infrastructure_docs
+
+
+def make_assets(start: int, count: int, owners, rng: random.Random):
+    """Assets ``start`` to ``start + count``, each owned by a random customer"""
+    customer_docs, sites_by_customer, infrastructure_by_customer = owners
+    types, weights = zip(*ASSET_TYPES)
+    now = datetime.now()
+    batch = []
+    for i in range(start, start + count):
+        customer_id = str(rng.choice(customer_docs)["_id"])
+        asset_type = rng.choices(types, weights)[0]
+        infrastructure = infrastructure_by_customer.get(customer_id)
+        if asset_type == "vm" and not infrastructure:
+            asset_type = "host"
+        sites = sites_by_customer.get(customer_id)
+        os = rng.choice(OS)[0]
+        batch.append(asset_document({
+            "hostname": f"{rng.choice(ROLES)}-{os}-{i:07d}",
+            "ip_address": _ip(i),
+            "asset_type": asset_type,
+            "customer_id": customer_id,
+            "notes": " ".join(rng.sample(NOTES, 2)),
+            "site_id": None if asset_type == "vm" or not sites else rng.choice(sites),
+            "specs": _specs(asset_type, rng.choice(infrastructure) if infrastructure else "", rng),
+            "added": now - timedelta(days=rng.randint(0, 1000)),
+            "modified": None,
+            "version": INITIAL_VERSION,
+        }))
+    return batch
+
+
+async def _insert(collection, documents: list, batch_size: int, limit: asyncio.Semaphore):
+    async def insert(batch):
+        async with limit:
+            await collection.insert_many(batch, ordered=False)
+
+    await asyncio.gather(*(
+        insert(documents[start:start + batch_size]) for start in range(0, len(documents), batch_size)
+    ))
+
+
+async def _insert_assets(db, batch: list):
+    await db.assets.insert_many(batch, ordered=False)
+    await db.asset_history.insert_many([history.inserted(asset) for asset in batch], ordered=False)
+
+
+async def seed(
+    db,
+    customers: int,
+    assets: int,
+    sites: int = 2,
+    infrastructure: int = 2,
+    random_seed: int = 0,
+    batch_size: int = 10000,
+    concurrency: int = 8,
+) -> dict:
+    """Drop ``db`` and fill it; returns the number of documents per collection"""
+    rng = random.Random(random_seed)
+    await db.client.drop_database(db.name)
+    limit = asyncio.Semaphore(concurrency)
+
+    customer_docs, site_docs, infrastructure_docs = make_owners(customers, sites, infrastructure, rng)
+    sites_by_customer, infrastructure_by_customer = {}, {}
+    for site in site_docs:
+        sites_by_customer.setdefault(site["customer_id"], []).append(str(site["_id"]))
+    for location in infrastructure_docs:
+        infrastructure_by_customer.setdefault(location["customer_id"], []).append(str(location["_id"]))
+    owners = (customer_docs, sites_by_customer, infrastructure_by_customer)
+
+    counts = {str(customer["_id"]): customer["counts"] for customer in customer_docs}
+    for site in site_docs:
+        counts[site["customer_id"]]["sites"] += 1
+    for location in infrastructure_docs:
+        counts[location["customer_id"]]["infrastructure"] += 1
+
+    # Assets are generated a batch at a time while earlier batches are
+    # being written, so at most ``concurrency`` batches are held in memory
+    writes = []
+    for start in range(0, assets, batch_size):
+        batch = make_assets(start, min(batch_size, assets - start), owners, rng)
+        for asset in batch:
+            counts[asset["customer_id"]]["assets"] += 1
+        await limit.acquire()
+        write = asyncio.create_task(_insert_assets(db, batch))
+        write.add_done_callback(lambda _: limit.release())
+        writes.append(write)
+
+    await asyncio.gather(
+        _insert(db.customers, customer_docs, batch_size, limit),
+        _insert(db.sites, site_docs, batch_size, limit),
+        _insert(db.infrastructure, infrastructure_docs, batch_size, limit),
+        *writes,
+    )
+    return {
+        "customers": len(customer_docs),
+        "sites": len(site_docs),
+        "infrastructure": len(infrastructure_docs),
+        "assets": assets,
+        "asset_history": assets,
+    }
+
+
+async def run(args) -> dict:
+    client = AsyncIOMotorClient(settings.mongodb_url)
+    try:
+        db = client[args.database]
+        start = time.perf_counter()
+        counts = await seed(
+            db, args.customers, args.assets, args.sites, args.infrastructure,
+            args.seed, args.batch_size, args.concurrency,
+        )
+        seeded = time.perf_counter() - start
+        indexes = await reconcile_indexes(db)
+        return {
+            "database": args.database,
+            "documents": counts,
+            "seed_seconds": round(seeded, 2),
+            "index_seconds": round(time.perf_counter() - start - seeded, 2),
+            "indexes_failed": indexes["failed"],
+        }
+    finally:
+        client.close()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--assets", type=int, default=1000000)
+    parser.add_argument("--sites", type=int, default=2, help="sites per customer")
+    parser.add_argument("--infrastructure", type=int, default=2, help="locations per customer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=8, help="insert_many calls in flight")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--database", default=f"{settings.database_name}_seed")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
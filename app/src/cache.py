@@ -0,0 +1,234 @@
+import hashlib
+import re
+import secrets
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Pattern, Tuple
+from urllib.parse import parse_qs
+
+from .config import settings
+from .expand import ASSET_REFERENCES, INFRASTRUCTURE_REFERENCES
+
+# Collections each cached GET path reads from; the first match wins.
+READS: List[Tuple[Pattern, Tuple[str, ...]]] = [
+    (re.compile(r"^/customers/[^/]+/(summary|topology)$"), ("customers", "sites", "infrastructure", "assets")),
+    (re.compile(r"^/infrastructure/[^/]+/impact$"), ("infrastructure", "sites", "assets")),
+    (re.compile(r"^/customers"), ("customers",)),
+    (re.compile(r"^/sites"), ("sites",)),
+    (re.compile(r"^/infrastructure"), ("infrastructure",)),
+    (re.compile(r"^/assets"), ("assets",)),
+]
+
+# Collections a write under each path can modify; the first match wins.
+# Creating a customer also creates its main site and deleting one cascades;
+# the other writes update the counters stored on the customer.
+WRITES: List[Tuple[Pattern, Tuple[str, ...]]] = [
+    (re.compile(r"^/customers"), ("customers", "sites", "infrastructure", "assets")),
+    (re.compile(r"^/sites"), ("sites", "customers")),
+    (re.compile(r"^/infrastructure"), ("infrastructure", "customers")),
+    (re.compile(r"^/assets"), ("assets", "customers")),
+]
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# Collections embedded by each ?expand= name, on top of the path's own
+EXPANDED: Dict[str, str] = {
+    name: reference.collection
+    for references in (ASSET_REFERENCES, INFRASTRUCTURE_REFERENCES)
+    for name, reference in references.items()
+}
+
+
+def _match(rules, path: str) -> Tuple[str, ...]:
+    for pattern, collections in rules:
+        if pattern.match(path):
+            return collections
+    return ()
+
+
+def _read_collections(path: str, query: str) -> Tuple[str, ...]:
+    collections = _match(READS, path)
+    if collections and "expand=" in query:
+        for value in parse_qs(query).get("expand", []):
+            for name in value.split(","):
+                collection = EXPANDED.get(name.strip())
+                if collection and collection not in collections:
+                    collections += (collection,)
+    return collections
+
+
+class CacheEntry(NamedTuple):
+    etag: str
+    collections: Tuple[str, ...]
+    expires: float
+    status: int
+    headers: list
+    body: bytes
+
+
+class ResponseCache:
+    """In-process LRU/TTL cache of encoded GET responses.
+
+    Every collection has a version counter that is bumped by writes. ETags are
+    derived from the versions of the collections a response reads from, so a
+    conditional request can be answered with a 304 without touching Mongo.
+    The epoch keeps ETags from colliding across restarts. Each worker process
+    has its own cache and counters.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.epoch = secrets.token_hex(4)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._versions: Dict[str, int] = defaultdict(int)
+
+    def etag(self, key: str, collections: Iterable[str]) -> str:
+        versions = ".".join(str(self._versions[c]) for c in collections)
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return f'"{self.epoch}-{versions}-{digest}"'
+
+    def get(self, key: str, etag: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None or entry.etag != etag or entry.expires < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, key: str, etag: str, collections, status: int, headers: list, body: bytes):
+        self._entries[key] = CacheEntry(
+            etag, tuple(collections), time.monotonic() + self.ttl, status, headers, body
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *collections: str):
+        for collection in collections:
+            self._versions[collection] += 1
+        stale = [
+            key for key, entry in self._entries.items()
+            if any(c in entry.collections for c in collections)
+        ]
+        for key in stale:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "versions": dict(self._versions),
+        }
+
+
+response_cache = ResponseCache(settings.cache_max_entries, settings.cache_ttl_seconds)
+
+
+class ResponseCacheMiddleware:
+    """Serve cached GET responses and invalidate them on writes.
+
+    Keys are the path plus the sorted query string. Writes bump the version of
+    every collection they can touch before the response is sent, so a client
+    that has seen its write acknowledged never reads the old data back.
+    """
+
+    def __init__(self, app, cache: ResponseCache = response_cache):
+        self.app = app
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.cache_enabled:
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        if method in WRITE_METHODS:
+            return await self._write(scope, receive, send)
+        query_string = scope["query_string"].decode("latin-1")
+        collections = _read_collections(scope["path"], query_string) if method == "GET" else ()
+        if not collections:
+            return await self.app(scope, receive, send)
+
+        query = "&".join(sorted(query_string.split("&")))
+        key = f"{scope['path']}?{query}"
+        etag = self.cache.etag(key, collections)
+        etag_header = (b"etag", etag.encode())
+
+        if etag in _if_none_match(scope):
+            self.cache.not_modified += 1
+            await send({"type": "http.response.start", "status": 304, "headers": [etag_header]})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        entry = self.cache.get(key, etag)
+        if entry is not None:
+            await send({"type": "http.response.start", "status": entry.status, "headers": entry.headers})
+            await send({"type": "http.response.body", "body": entry.body})
+            return
+
+        start = {}
+        chunks = []
+        size = 0
+        cacheable = True
+
+        async def capture(message):
+            nonlocal size, cacheable
+            if message["type"] == "http.response.start":
+                cacheable = message["status"] == 200
+                if cacheable:
+                    message["headers"] = list(message.get("headers", [])) + [etag_header]
+                start.update(message)
+            elif message["type"] == "http.response.body" and cacheable:
+                body = message.get("body", b"")
+                size += len(body)
+                chunks.append(body)
+                if size > settings.cache_max_entry_bytes:
+                    cacheable = False
+                    chunks.clear()
+                elif not message.get("more_body"):
+                    self.cache.set(key, etag, collections, 200, start["headers"], b"".join(chunks))
+            await send(message)
+
+        await self.app(scope, receive, capture)
+
+    async def _write(self, scope, receive, send):
+        collections = _match(WRITES, scope["path"])
+        if not collections:
+            return await self.app(scope, receive, send)
+        invalidated = False
+
+        async def invalidate(message):
+            nonlocal invalidated
+            if message["type"] == "http.response.start" and not invalidated:
+                self.cache.invalidate(*collections)
+                invalidated = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, invalidate)
+        finally:
+            # A failed write may still have modified data
+            if not invalidated:
+                self.cache.invalidate(*collections)
+
+
+def _if_none_match(scope) -> List[str]:
+    for name, value in scope["headers"]:
+        if name == b"if-none-match":
+            return [tag.strip() for tag in value.decode("latin-1").split(",")]
+    return []
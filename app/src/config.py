@@ -1,8 +1,43 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     mongodb_url: str = "mongodb://localhost:27017"
     database_name: str = "asset_management"
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 10
+    mongo_max_idle_time_ms: Optional[int] = None
+    mongo_wait_queue_timeout_ms: Optional[int] = None
+    mongo_server_selection_timeout_ms: int = 30000
+    mongo_connect_timeout_ms: int = 20000
+    mongo_socket_timeout_ms: Optional[int] = None
+    mongo_compressors: str = ""  # e.g. "zstd,snappy,zlib"
+    max_page_size: int = 1000
+    manage_indexes: bool = True
+    export_batch_size: int = 1000
+    bulk_batch_size: int = 1000
+    history_snapshot_interval: int = 20  # asset updates between full snapshots
+    cache_enabled: bool = True
+    cache_max_entries: int = 1024
+    cache_ttl_seconds: float = 300
+    cache_max_entry_bytes: int = 5_000_000
+    search_max_results: int = 100
+    search_time_budget_ms: int = 200
+    job_workers: int = 2
+    job_batch_size: int = 1000
+    job_stale_seconds: float = 300
+    log_level: str = "INFO"
+    log_json: bool = True
+    access_log: bool = True
+    slow_query_ms: float = 100  # 0 disables slow query logging
+    query_debug: bool = False
+    query_debug_round_trips: int = 3
+    query_debug_explain_rate: float = 0.1
+    query_debug_max_findings: int = 200
+    events_max_queued: int = 256
+    events_heartbeat_seconds: float = 15
+    events_change_streams: bool = False
 
 settings = Settings()
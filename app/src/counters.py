@@ -0,0 +1,99 @@
+"""Denormalised per-customer document counts.
+
+Each customer document carries ``counts: {sites, assets, infrastructure}``,
+kept current with ``$inc`` by the routes that create or delete those
+documents. The increments are not transactional with the writes they follow,
+so ``recount`` exists to repair any drift:
+
+    python -m src.counters [--customer-id ID]
+"""
+import argparse
+import asyncio
+import json
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+COUNTED_COLLECTIONS = ("sites", "assets", "infrastructure")
+
+
+def initial_counts(**counts: int) -> Dict[str, int]:
+    return {collection: counts.get(collection, 0) for collection in COUNTED_COLLECTIONS}
+
+
+async def increment(db, customer_id: str, collection: str, amount: int = 1):
+    await db.customers.update_one(
+        {"_id": ObjectId(customer_id)},
+        {"$inc": {f"counts.{collection}": amount}}
+    )
+
+
+async def increment_many(db, collection: str, customer_ids: Iterable[str]):
+    """Add one per occurrence of each customer id, in a single bulk write."""
+    amounts = Counter(customer_ids)
+    if not amounts:
+        return
+    await db.customers.bulk_write([
+        UpdateOne({"_id": ObjectId(customer_id)}, {"$inc": {f"counts.{collection}": amount}})
+        for customer_id, amount in amounts.items()
+    ], ordered=False)
+
+
+async def move(db, collection: str, from_customer_id: str, to_customer_id: str):
+    """Account for a document being reassigned to another customer."""
+    if from_customer_id == to_customer_id:
+        return
+    await increment_many(db, collection, [to_customer_id])
+    await db.customers.update_one(
+        {"_id": ObjectId(from_customer_id)},
+        {"$inc": {f"counts.{collection}": -1}}
+    )
+
+
+async def recount(db, customer_id: Optional[str] = None) -> dict:
+    """Recompute the counters from the collections and fix any that drifted.
+
+    Returns the customers whose stored counts were wrong, with the stored and
+    recomputed values.
+    """
+    match = {"customer_id": customer_id} if customer_id else {}
+    actual: Dict[str, Dict[str, int]] = {}
+    for collection in COUNTED_COLLECTIONS:
+        pipeline = [{"$match": match}, {"$group": {"_id": "$customer_id", "n": {"$sum": 1}}}]
+        async for row in db[collection].aggregate(pipeline):
+            actual.setdefault(row["_id"], initial_counts())[collection] = row["n"]
+
+    query = {"_id": ObjectId(customer_id)} if customer_id else {}
+    drifted = {}
+    updates = []
+    async for customer in db.customers.find(query, {"counts": 1}):
+        key = str(customer["_id"])
+        counts = actual.get(key, initial_counts())
+        if customer.get("counts") != counts:
+            drifted[key] = {"stored": customer.get("counts"), "actual": counts}
+            updates.append(UpdateOne({"_id": customer["_id"]}, {"$set": {"counts": counts}}))
+    if updates:
+        await db.customers.bulk_write(updates, ordered=False)
+    return drifted
+
+
+async def _main(customer_id: Optional[str]):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from .config import settings
+
+    client = AsyncIOMotorClient(settings.mongodb_url)
+    try:
+        drifted = await recount(client[settings.database_name], customer_id)
+    finally:
+        client.close()
+    print(json.dumps({"repaired": len(drifted), "customers": drifted}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recount per-customer document counters")
+    parser.add_argument("--customer-id", help="only recount this customer")
+    args = parser.parse_args()
+    asyncio.run(_main(args.customer_id))
@@ -1,6 +1,15 @@
+import asyncio
+import logging
+
+from fastapi import Depends
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from src.config import settings
+from src.loaders import ReferenceLoaders
+from src.metrics import command_metrics
+from src.pool import pool_monitor
+
+logger = logging.getLogger(__name__)
 
 
 class Database:
@@ -11,8 +20,44 @@ db = Database()
 async def get_database() -> AsyncIOMotorClient:
     return db.client[settings.database_name]
 
+async def get_loaders(database=Depends(get_database)) -> ReferenceLoaders:
+    """Request-scoped loaders that batch and memoise reference lookups"""
+    return ReferenceLoaders(database)
+
+def client_options() -> dict:
+    """Pool, timeout and compression options from the settings"""
+    options = {
+        "maxPoolSize": settings.mongo_max_pool_size,
+        "minPoolSize": settings.mongo_min_pool_size,
+        "maxIdleTimeMS": settings.mongo_max_idle_time_ms,
+        "waitQueueTimeoutMS": settings.mongo_wait_queue_timeout_ms,
+        "serverSelectionTimeoutMS": settings.mongo_server_selection_timeout_ms,
+        "connectTimeoutMS": settings.mongo_connect_timeout_ms,
+        "socketTimeoutMS": settings.mongo_socket_timeout_ms,
+        "compressors": settings.mongo_compressors or None,
+    }
+    return {name: value for name, value in options.items() if value is not None}
+
 async def connect_to_mongo():
-    db.client = AsyncIOMotorClient(settings.mongodb_url)
-    
+    db.client = AsyncIOMotorClient(
+        settings.mongodb_url, event_listeners=[pool_monitor, command_metrics], **client_options()
+    )
+    await prewarm_pool(settings.mongo_min_pool_size)
+
+async def prewarm_pool(connections: int):
+    """Open ``connections`` pooled connections before the first request.
+
+    Concurrent pings each need their own connection, so the pool grows to
+    ``connections`` right away instead of as the background maintenance
+    thread gets to it. A failure is logged, not raised: the app still starts
+    and connects lazily.
+    """
+    if connections <= 0:
+        return
+    try:
+        await asyncio.gather(*(db.client.admin.command("ping") for _ in range(connections)))
+    except Exception as e:
+        logger.warning("Could not pre-warm the MongoDB pool: %s", e)
+
 async def close_mongo_connection():
     db.client.close()
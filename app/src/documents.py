@@ -0,0 +1,84 @@
+"""Derived fields stored on documents for indexing.
+
+They are computed at write time and never returned by the API. Run the module
+to backfill documents written before a derived field existed:
+
+    python -m src.documents
+"""
+import asyncio
+import hashlib
+
+import orjson
+from pymongo import UpdateOne
+
+from .ipaddr import ip_fields
+
+ASSET_INTERNAL_FIELDS = ("ip_numeric", "hostname_lc", "fingerprint")
+
+# A customer marked ``deleting`` is kept until its dependents are gone, but
+# is no longer listed or referred to
+LIVE_CUSTOMERS = {"deleting": {"$ne": True}}
+
+# The fields a client sets; fingerprints cover these and nothing derived
+ASSET_CONTENT_FIELDS = ("hostname", "ip_address", "asset_type", "customer_id", "notes", "site_id", "specs")
+
+
+def hidden(fields) -> dict:
+    """Projection that leaves internal fields out of a find."""
+    return {field: 0 for field in fields}
+
+
+def asset_document(asset: dict) -> dict:
+    """Add the derived fields to an asset dict in place and return it."""
+    if "ip_address" in asset:
+        asset.update(ip_fields(asset["ip_address"]))
+    if "hostname" in asset:
+        asset["hostname_lc"] = asset["hostname"].strip().lower()
+    return asset
+
+
+def fingerprint(asset: dict) -> str:
+    """Hash of an asset's content fields, to tell cheaply whether it changed.
+
+    Only writes that know every content field store one; a partial update
+    stores ``None`` instead, which matches no fingerprint.
+    """
+    content = {field: asset.get(field) for field in ASSET_CONTENT_FIELDS}
+    return hashlib.blake2b(orjson.dumps(content, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+
+async def backfill_assets(db, batch_size: int = 1000) -> int:
+    """Recompute the derived fields of every asset, one bulk write per batch."""
+    updated = 0
+    updates = []
+    async for asset in db.assets.find({}, {"ip_address": 1, "hostname": 1}):
+        derived = asset_document({
+            field: asset[field] for field in ("ip_address", "hostname")
+            if isinstance(asset.get(field), str)
+        })
+        if not derived:
+            continue
+        updates.append(UpdateOne({"_id": asset["_id"]}, {"$set": derived}))
+        if len(updates) >= batch_size:
+            updated += (await db.assets.bulk_write(updates, ordered=False)).modified_count
+            updates = []
+    if updates:
+        updated += (await db.assets.bulk_write(updates, ordered=False)).modified_count
+    return updated
+
+
+async def _main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from .config import settings
+
+    client = AsyncIOMotorClient(settings.mongodb_url)
+    try:
+        updated = await backfill_assets(client[settings.database_name])
+    finally:
+        client.close()
+    print(f"Updated {updated} assets")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
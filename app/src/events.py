@@ -0,0 +1,166 @@
+"""Change events for clients that would otherwise poll the list endpoints.
+
+The write routes publish a compact event per created, updated or deleted
+document: its id, collection, operation, owning customer and the changed
+fields. ``EventBus`` fans events out to subscribers, each with a bounded
+queue; a subscriber that falls behind loses its oldest events and is told
+how many it missed, so it can refetch instead of slowing everyone down.
+
+Events published by the routes only reach subscribers of the same process.
+With ``events_change_streams`` the bus is fed from a MongoDB change stream
+instead, which also carries writes from other processes; deployments
+without change streams (a standalone mongod) fall back to the routes.
+Deletes seen through a change stream only carry the document id, so they
+go to every subscriber of the collection.
+"""
+import asyncio
+import itertools
+import logging
+from datetime import datetime
+from typing import Iterable, Optional
+
+from pymongo.errors import PyMongoError
+
+from .config import settings
+from .documents import ASSET_INTERNAL_FIELDS
+from .serialization import encode
+
+logger = logging.getLogger(__name__)
+
+COLLECTIONS = ("customers", "sites", "infrastructure", "assets")
+
+# Change stream operation -> event operation
+OPERATIONS = {"insert": "insert", "update": "update", "replace": "update", "delete": "delete"}
+
+
+def _fields(fields: Optional[dict]) -> Optional[dict]:
+    if fields is None:
+        return None
+    return {
+        key: value for key, value in fields.items()
+        if key not in ("_id", "id") and key not in ASSET_INTERNAL_FIELDS
+    }
+
+
+class Subscription:
+    def __init__(self, customer_id: Optional[str], collections: Iterable[str], max_queued: int):
+        self.customer_id = customer_id
+        self.collections = set(collections)
+        self.dropped = 0
+        self._queue: "asyncio.Queue[bytes]" = asyncio.Queue(max_queued)
+
+    def wants(self, collection: str, customer_id: Optional[str]) -> bool:
+        if collection not in self.collections:
+            return False
+        return self.customer_id is None or customer_id is None or customer_id == self.customer_id
+
+    def put(self, payload: bytes):
+        if self._queue.full():
+            # Drop the oldest event rather than block the publisher
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(payload)
+
+    async def get(self) -> bytes:
+        return await self._queue.get()
+
+
+class EventBus:
+    def __init__(self, max_queued: int):
+        self.max_queued = max_queued
+        # Whether the routes publish; off while a change stream feeds the bus
+        self.local = True
+        self._subscribers = set()
+        self._sequence = itertools.count(1)
+        self._watcher: Optional[asyncio.Task] = None
+
+    def subscribe(self, customer_id: Optional[str] = None, collections: Iterable[str] = COLLECTIONS) -> Subscription:
+        subscription = Subscription(customer_id, collections, self.max_queued)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def emit(self, collection: str, operation: str, document_id, customer_id, fields: Optional[dict] = None):
+        """Send an event to every matching subscriber"""
+        customer_id = str(customer_id) if customer_id is not None else None
+        subscribers = [s for s in self._subscribers if s.wants(collection, customer_id)]
+        if not subscribers:
+            return
+        payload = encode({
+            "id": next(self._sequence),
+            "collection": collection,
+            "operation": operation,
+            "document_id": str(document_id) if document_id is not None else None,
+            "customer_id": customer_id,
+            "fields": _fields(fields),
+            "time": datetime.now(),
+        })
+        for subscription in subscribers:
+            subscription.put(payload)
+
+    def publish(self, collection: str, operation: str, document: dict, fields: Optional[dict] = None):
+        """Publish a write made by a route.
+
+        ``document`` needs the id and, except for customers, the
+        ``customer_id``; ``fields`` are the inserted document or the changes.
+        """
+        if not self.local:
+            return
+        document_id = document.get("_id", document.get("id"))
+        customer_id = document_id if collection == "customers" else document.get("customer_id")
+        self.emit(collection, operation, document_id, customer_id, fields)
+
+    async def start(self, db):
+        if settings.events_change_streams:
+            self._watcher = asyncio.create_task(self._watch(db))
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+        self.local = True
+
+    async def _watch(self, db):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(COLLECTIONS)},
+            "operationType": {"$in": list(OPERATIONS)},
+        }}]
+        try:
+            async with db.watch(pipeline, full_document="updateLookup") as stream:
+                # Opens the stream, so an unsupported deployment fails here
+                change = await stream.try_next()
+                self.local = False
+                logger.info("Publishing change events from a change stream")
+                while True:
+                    if change is not None:
+                        self._emit_change(change)
+                    change = await stream.next()
+        except PyMongoError as e:
+            logger.warning("Change stream unavailable, publishing events from the routes: %s", e)
+        finally:
+            self.local = True
+
+    def _emit_change(self, change: dict):
+        operation = OPERATIONS[change["operationType"]]
+        collection = change["ns"]["coll"]
+        document_id = change["documentKey"]["_id"]
+        document = change.get("fullDocument") or {}
+        if collection == "customers":
+            customer_id = document_id
+        else:
+            customer_id = document.get("customer_id")
+        if operation == "insert" or change["operationType"] == "replace":
+            fields = document
+        elif operation == "update":
+            description = change.get("updateDescription", {})
+            fields = dict(description.get("updatedFields", {}))
+            fields.update({field: None for field in description.get("removedFields", [])})
+        else:
+            fields = None
+        self.emit(collection, operation, document_id, customer_id, fields)
+
+
+event_bus = EventBus(settings.events_max_queued)
@@ -0,0 +1,121 @@
+"""``?expand=`` support: embed referenced documents in list responses.
+
+Every expandable name maps to the reference field that holds the id and the
+loader that resolves it. All expansions of a page are requested before any
+is awaited, so the loaders issue one ``$in`` query per referenced collection,
+and each referenced document is fetched and serialised once however many
+rows point at it.
+"""
+import asyncio
+from typing import Dict, List, NamedTuple, Optional, Type
+
+from bson import ObjectId
+from fastapi import HTTPException, Query
+from pydantic import BaseModel
+
+from .schemas.customer import CustomerResponse
+from .schemas.infrastructure import InfrastructureInDB
+from .pagination import covered, split_fields
+from .schemas.site import SiteInDB
+from .serialization import to_response
+
+
+class Reference(NamedTuple):
+    path: str        # dotted path of the id in the referring document
+    loader: str      # ReferenceLoaders attribute
+    collection: str  # collection read, for cache invalidation
+    model: Type[BaseModel]  # schema of the embedded document
+
+
+ASSET_REFERENCES: Dict[str, Reference] = {
+    "customer": Reference("customer_id", "customers", "customers", CustomerResponse),
+    "site": Reference("site_id", "sites", "sites", SiteInDB),
+    "infrastructure": Reference(
+        "specs.infrastructure_location_id", "infrastructure", "infrastructure", InfrastructureInDB
+    ),
+}
+
+INFRASTRUCTURE_REFERENCES: Dict[str, Reference] = {
+    "site": Reference("site_id", "sites", "sites", SiteInDB),
+}
+
+
+def expand_param(references: Dict[str, Reference]):
+    """Dependency parsing a comma-separated ``expand`` query parameter"""
+    description = f"Comma-separated references to embed: {', '.join(references)}"
+
+    def parse(expand: Optional[str] = Query(None, description=description)) -> List[str]:
+        names = [name.strip() for name in (expand or "").split(",") if name.strip()]
+        unknown = [name for name in names if name not in references]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Cannot expand: {', '.join(unknown)}")
+        return list(dict.fromkeys(names))
+
+    return parse
+
+
+def reference_paths(names: List[str], references: Dict[str, Reference]) -> List[str]:
+    """Paths a page has to read to expand ``names``, for ``fetch_page(include=...)``"""
+    return [references[name].path for name in names]
+
+
+def _get(doc: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def _drop(doc: dict, path: str):
+    """Remove ``path`` from ``doc``, and the parents it leaves empty"""
+    part, _, rest = path.partition(".")
+    if not rest:
+        doc.pop(part, None)
+    elif isinstance(doc.get(part), dict):
+        _drop(doc[part], rest)
+        if not doc[part]:
+            del doc[part]
+
+
+async def expand(
+    docs: List[dict], names: List[str], references: Dict[str, Reference], loaders, fields: Optional[str] = None
+):
+    """Embed the referenced documents of ``docs`` under each expanded name.
+
+    References that are missing, invalid or point at a deleted document
+    expand to ``None``. ``fields`` is the page's ``?fields=`` projection;
+    the reference paths it leaves out were read only for the expansion and
+    are dropped again.
+    """
+    if not names or not docs:
+        return docs
+
+    lookups = {}
+    for name in names:
+        reference = references[name]
+        loader = getattr(loaders, reference.loader)
+        ids = list({
+            value for value in (_get(doc, reference.path) for doc in docs)
+            if isinstance(value, str) and ObjectId.is_valid(value)
+        })
+        lookups[name] = (reference, ids, loader.load_many(ids))
+
+    resolved = await asyncio.gather(*(lookup for _, _, lookup in lookups.values()))
+
+    for (name, (reference, ids, _)), found in zip(lookups.items(), resolved):
+        # Loader results are memoised for the request, so serialise copies
+        by_id = {
+            key: to_response(dict(value), reference.model.model_fields) if value else None
+            for key, value in zip(ids, found)
+        }
+        for doc in docs:
+            doc[name] = by_id.get(_get(doc, reference.path))
+
+    requested = split_fields(fields)
+    if requested is not None:
+        for path in {references[name].path for name in names}:
+            if not covered(path, requested):
+                for doc in docs:
+                    _drop(doc, path)
+    return docs
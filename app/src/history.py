@@ -0,0 +1,302 @@
+"""Append-only revision history of assets, and the inventory as it was at a point in time.
+
+Every asset write appends one entry to ``asset_history``::
+
+    {asset_id, ts, op, version, customer_id, changes, snapshot}
+
+``op`` is ``insert``, ``update``, ``delete`` or ``snapshot``. An update
+stores only its ``changes``, the ``$set`` paths whose value it changed, and
+an update that changed nothing stores no entry. Inserts, and
+updates that bring the version to a multiple of
+``history_snapshot_interval``, also store the whole asset as ``snapshot``.
+Rebuilding a revision therefore replays at most that many deltas onto the
+nearest earlier snapshot, read newest first from the
+``(asset_id, ts, version)`` index; entries of the same millisecond are
+ordered by version. Internal fields are left out of both.
+
+Entries are written after the asset, like the counters, and are not
+transactional with it. Assets written before history was recorded cannot be
+rebuilt until they have a snapshot. Run the module to take one for every
+asset that has no history yet:
+
+    python -m src.history
+"""
+import asyncio
+import copy
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+from .config import settings
+from .documents import ASSET_INTERNAL_FIELDS
+from .ipaddr import ip_fields
+from .pagination import PageParams, decode_cursor, encode_cursor
+
+# Timestamps are kept to the millisecond, so entries of the same millisecond
+# are ordered by version, then by id for a delete and the update before it
+REPLAY_TIEBREAK = ("version",)
+NEWEST_FIRST = [("ts", -1), ("version", -1), ("_id", -1)]
+
+
+def _public(document: dict) -> dict:
+    return {
+        field: value for field, value in document.items()
+        if field != "_id" and field not in ASSET_INTERNAL_FIELDS
+    }
+
+
+def _entry(asset_id, op: str, customer_id, version, **fields) -> dict:
+    return {
+        "asset_id": ObjectId(asset_id), "ts": datetime.now(), "op": op,
+        "version": version, "customer_id": customer_id, **fields,
+    }
+
+
+def inserted(asset: dict) -> dict:
+    return _entry(asset["_id"], "insert", asset["customer_id"], asset.get("version"), snapshot=_public(asset))
+
+
+def updated(asset: dict, changes: dict) -> Optional[dict]:
+    """Entry of an update, from the asset after it and the fields it changed.
+
+    ``None`` when it changed no public field and no snapshot is due.
+    """
+    changes = _public(changes)
+    snapshot = not asset.get("version") or asset["version"] % settings.history_snapshot_interval == 0
+    if not changes and not snapshot:
+        return None
+    entry = _entry(asset["_id"], "update", asset["customer_id"], asset.get("version"), changes=changes)
+    if snapshot:
+        entry["snapshot"] = _public(asset)
+    return entry
+
+
+def _stored(value):
+    # MongoDB keeps datetimes to the millisecond
+    if isinstance(value, datetime):
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+
+def _get(document: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+
+def changed(before: dict, changes: dict) -> dict:
+    """The ``$set`` paths of ``changes`` that give ``before`` a new value"""
+    return {path: value for path, value in changes.items() if _stored(value) != _get(before, path)}
+
+
+def applied(before: dict, changes: dict) -> dict:
+    """The asset after ``changes`` and the version bump were applied to ``before``.
+
+    Internal fields are left as they were, like ``before`` was projected.
+    """
+    asset = copy.deepcopy(before)
+    _apply(asset, {path: _stored(value) for path, value in _public(changes).items()})
+    asset["version"] = (before.get("version") or 0) + 1
+    return asset
+
+
+def deleted(asset: dict) -> dict:
+    return _entry(asset["_id"], "delete", asset.get("customer_id"), asset.get("version"))
+
+
+async def record(db, entries: List[dict]):
+    if entries:
+        await db.asset_history.insert_many(entries, ordered=False)
+
+
+def local_time(ts: datetime) -> datetime:
+    """``ts`` as a naive local time, comparable with the stored timestamps"""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone().replace(tzinfo=None)
+    return ts
+
+
+def _apply(asset: dict, changes: dict):
+    for path, value in changes.items():
+        *parents, leaf = path.split(".")
+        target = asset
+        for part in parents:
+            if not isinstance(target.get(part), dict):
+                target[part] = {}
+            target = target[part]
+        target[leaf] = value
+
+
+def rebuild(entries: List[dict]) -> Optional[dict]:
+    """The asset after the newest of ``entries``, given newest first back to a base.
+
+    ``None`` when the asset was deleted by then or no base was reached.
+    """
+    if not entries or entries[0]["op"] == "delete":
+        return None
+    base = entries[-1]
+    if "snapshot" not in base:
+        return None
+    asset = {"_id": base["asset_id"], **base["snapshot"], "version": base["version"]}
+    for entry in reversed(entries[:-1]):
+        _apply(asset, entry.get("changes") or {})
+        asset["version"] = entry["version"]
+    return asset
+
+
+def _is_base(entry: dict) -> bool:
+    return "snapshot" in entry or entry["op"] == "delete"
+
+
+async def asset_as_of(db, asset_id: ObjectId, as_of: datetime) -> Optional[dict]:
+    """Rebuild one asset as it was at ``as_of``"""
+    entries = []
+    cursor = db.asset_history.find({"asset_id": asset_id, "ts": {"$lte": local_time(as_of)}}).sort(NEWEST_FIRST)
+    async for entry in cursor.batch_size(settings.history_snapshot_interval + 1):
+        entries.append(entry)
+        if _is_base(entry):
+            break
+    return rebuild(entries)
+
+
+def _by_asset(entries: List[dict]) -> List[Tuple[ObjectId, List[dict], bool]]:
+    """Group entries sorted by asset then newest first, down to each asset's base.
+
+    The flag tells whether the base was reached.
+    """
+    groups = []
+    for entry in entries:
+        if not groups or groups[-1][0] != entry["asset_id"]:
+            groups.append((entry["asset_id"], [], False))
+        asset_id, revisions, complete = groups[-1]
+        if not complete:
+            revisions.append(entry)
+            groups[-1] = (asset_id, revisions, _is_base(entry))
+    return groups
+
+
+async def _rebuilt(
+    db, scope: dict, as_of: datetime, after: Optional[ObjectId], chunk: int
+) -> AsyncIterator[dict]:
+    """The assets of ``scope`` as they were at ``as_of``, in id order.
+
+    The history is read ``chunk`` entries at a time, and each read starts
+    after the last asset whose base it reached, so older entries of an asset
+    are only read as far as the chunk they fall in. Entries are stamped with
+    the customer at the time, so an asset that was with another customer
+    before ``as_of`` is rebuilt from its whole history instead.
+    """
+    ts = local_time(as_of)
+    while True:
+        match = {**scope, "ts": {"$lte": ts}}
+        if after is not None:
+            match["asset_id"] = {"$gt": after}
+        cursor = db.asset_history.find(match).sort([("asset_id", 1), *NEWEST_FIRST]).limit(chunk)
+        entries = await cursor.to_list(None)
+        groups = _by_asset(entries)
+        exhausted = len(entries) < chunk
+        if not exhausted and len(groups) > 1 and not groups[-1][2]:
+            groups.pop()  # read again from its newest entry
+        moved = set()
+        if "customer_id" in scope and groups:
+            moved = {row["asset_id"] async for row in db.asset_history.find({
+                "asset_id": {"$in": [asset_id for asset_id, _, _ in groups]},
+                "customer_id": {"$ne": scope["customer_id"]},
+                "ts": {"$lte": ts},
+            }, {"asset_id": 1})}
+        for asset_id, revisions, _ in groups:
+            asset = await asset_as_of(db, asset_id, as_of) if asset_id in moved else rebuild(revisions)
+            if asset is not None:
+                yield asset
+        if exhausted:
+            return
+        after = groups[-1][0]
+
+
+def _matches(asset: dict, query: dict) -> bool:
+    """Whether a rebuilt asset passes the ``asset_filters`` query"""
+    for field, condition in query.items():
+        if field == "ip_numeric":
+            value = ip_fields(asset.get("ip_address") or "")["ip_numeric"]
+        else:
+            value = asset.get(field)
+        if isinstance(condition, dict):
+            if value is None or not condition["$gte"] <= value <= condition["$lte"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+async def page_as_of(db, query: dict, page: PageParams, as_of: datetime):
+    """``fetch_page`` over the assets as they were at ``as_of``, in id order.
+
+    The history is read in ``(customer_id, asset_id, ts, version)`` index
+    order when a customer is given, each asset is rebuilt from its newest
+    entries back to the nearest snapshot, and the remaining filters are
+    applied to the rebuilt assets: updates only store what they changed, so
+    the type and address of an entry are not known before rebuilding.
+    """
+    if page.sort or page.fields:
+        raise HTTPException(
+            status_code=400, detail="as_of lists whole assets in id order; sort and fields are not supported"
+        )
+    after = None
+    if page.after:
+        cursor = decode_cursor(page.after)
+        if cursor.get("s") != "_id" or cursor.get("d") != 1:
+            raise HTTPException(status_code=400, detail="Cursor does not match the requested sort")
+        after = cursor["id"]
+
+    scope = {"customer_id": query["customer_id"]} if "customer_id" in query else {}
+    chunk = (page.limit or settings.max_page_size) + settings.history_snapshot_interval + 1
+    assets = []
+    async for asset in _rebuilt(db, scope, as_of, after, chunk):
+        if _matches(asset, query):
+            assets.append(asset)
+            if page.limit is not None and len(assets) > page.limit:
+                break
+
+    next_cursor = None
+    if page.limit is not None and len(assets) > page.limit:
+        assets = assets[:page.limit]
+        next_cursor = encode_cursor("_id", 1, None, assets[-1]["_id"])
+    return assets, next_cursor
+
+
+async def snapshot_untracked(db, batch_size: int = 1000) -> int:
+    """Take a snapshot of every asset without history, so it can be rebuilt"""
+    tracked = {row["_id"] async for row in db.asset_history.aggregate([{"$group": {"_id": "$asset_id"}}])}
+    taken = 0
+    entries = []
+    async for asset in db.assets.find({}):
+        if asset["_id"] in tracked:
+            continue
+        entries.append(_entry(
+            asset["_id"], "snapshot", asset.get("customer_id"), asset.get("version"), snapshot=_public(asset)
+        ))
+        if len(entries) >= batch_size:
+            await record(db, entries)
+            taken += len(entries)
+            entries = []
+    await record(db, entries)
+    return taken + len(entries)
+
+
+async def _main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(settings.mongodb_url)
+    try:
+        taken = await snapshot_untracked(client[settings.database_name])
+    finally:
+        client.close()
+    print(f"Took {taken} snapshots")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
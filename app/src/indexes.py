@@ -0,0 +1,190 @@
+import logging
+from collections.abc import Mapping
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Declarative index plan, one entry per query shape issued by the routes.
+# Every index is named so it can be reconciled against what the server has.
+# List indexes end in the sort field and ``_id``, so keyset pages are read off
+# the index in order; ``pagination.indexed`` rejects sorts that have none.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "customers": [
+        # create_customer / update_customer duplicate check
+        IndexModel(
+            [("name", ASCENDING), ("contact_email", ASCENDING)],
+            name="name_contact_email_unique",
+            unique=True,
+        ),
+        # get_customers?sort=name
+        IndexModel([("name", ASCENDING), ("_id", ASCENDING)], name="name_id"),
+    ],
+    "sites": [
+        # site counts and the per-customer name check
+        IndexModel(
+            [("customer_id", ASCENDING), ("name", ASCENDING)],
+            name="customer_id_name_unique",
+            unique=True,
+        ),
+        # get_sites?customer_id=, and ?sort=customer_id
+        IndexModel([("customer_id", ASCENDING), ("_id", ASCENDING)], name="customer_id_id"),
+        # get_sites?customer_id=&sort=name
+        IndexModel(
+            [("customer_id", ASCENDING), ("name", ASCENDING), ("_id", ASCENDING)], name="customer_id_name_id"
+        ),
+    ],
+    "infrastructure": [
+        # get_infrastructure?customer_id=, and ?sort=customer_id
+        IndexModel([("customer_id", ASCENDING), ("_id", ASCENDING)], name="customer_id_id"),
+        # get_infrastructure?customer_id=&location_type=, and ?customer_id=&sort=type
+        IndexModel(
+            [("customer_id", ASCENDING), ("type", ASCENDING), ("_id", ASCENDING)], name="customer_id_type_id"
+        ),
+        # get_infrastructure?site_id=, and ?sort=site_id
+        IndexModel([("site_id", ASCENDING), ("_id", ASCENDING)], name="site_id_id"),
+        # get_infrastructure?location_type=, and ?sort=type
+        IndexModel([("type", ASCENDING), ("_id", ASCENDING)], name="type_id"),
+    ],
+    "assets": [
+        # get_assets?customer_id=, and ?sort=customer_id
+        IndexModel([("customer_id", ASCENDING), ("_id", ASCENDING)], name="customer_id_id"),
+        # get_assets?customer_id=&asset_type=, and ?customer_id=&sort=asset_type
+        IndexModel(
+            [("customer_id", ASCENDING), ("asset_type", ASCENDING), ("_id", ASCENDING)],
+            name="customer_id_asset_type_id",
+        ),
+        # get_assets?asset_type=, and ?sort=asset_type
+        IndexModel([("asset_type", ASCENDING), ("_id", ASCENDING)], name="asset_type_id"),
+        # get_assets_by_site, and get_assets?sort=site_id
+        IndexModel([("site_id", ASCENDING), ("_id", ASCENDING)], name="site_id_id"),
+        # get_assets?customer_id=&cidr=, ?customer_id=&sort=ip_address, subnet
+        # utilisation and the per-customer duplicate IP check
+        IndexModel(
+            [("customer_id", ASCENDING), ("ip_numeric", ASCENDING), ("_id", ASCENDING)],
+            name="customer_id_ip_numeric_id",
+        ),
+        # get_infrastructure_impact
+        IndexModel([("specs.infrastructure_location_id", ASCENDING)], name="infrastructure_location_id"),
+        # get_assets?cidr=, and ?sort=ip_address
+        IndexModel([("ip_numeric", ASCENDING), ("_id", ASCENDING)], name="ip_numeric_id"),
+        # search_assets?mode=text
+        IndexModel(
+            [("hostname", TEXT), ("notes", TEXT), ("specs.model", TEXT), ("specs.os", TEXT)],
+            name="search_text",
+            weights={"hostname": 10, "specs.model": 3, "specs.os": 3, "notes": 1},
+        ),
+        # search_assets?mode=prefix&customer_id=, and get_assets?customer_id=&sort=hostname
+        IndexModel(
+            [("customer_id", ASCENDING), ("hostname_lc", ASCENDING), ("_id", ASCENDING)],
+            name="customer_id_hostname_lc_id",
+        ),
+        # search_assets?mode=prefix, and get_assets?sort=hostname
+        IndexModel([("hostname_lc", ASCENDING), ("_id", ASCENDING)], name="hostname_lc_id"),
+    ],
+    "asset_history": [
+        # get_asset_history and the as_of rebuilds, newest entry first
+        IndexModel(
+            [("asset_id", ASCENDING), ("ts", DESCENDING), ("version", DESCENDING), ("_id", DESCENDING)],
+            name="asset_id_ts_version_id",
+        ),
+        # get_assets?as_of=&customer_id=
+        IndexModel(
+            [("customer_id", ASCENDING), ("asset_id", ASCENDING), ("ts", DESCENDING), ("version", DESCENDING),
+             ("_id", DESCENDING)],
+            name="customer_id_asset_id_ts_version_id",
+        ),
+    ],
+    "jobs": [
+        # JobRunner.start resume scan and get_jobs?status=
+        IndexModel([("status", ASCENDING), ("created", ASCENDING)], name="status_created"),
+    ],
+}
+
+# Options that make two indexes with the same name different.
+COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+def _describe(spec: dict) -> dict:
+    key = spec["key"]
+    key = list(key.items()) if isinstance(key, Mapping) else [tuple(k) for k in key]
+    if any(direction == "text" for _, direction in key):
+        # The server reports a text index as _fts/_ftsx plus its weights,
+        # so compare the weighted fields instead of the key
+        weights = spec.get("weights", {})
+        fields = [field for field, direction in key if direction == "text" and field != "_fts"]
+        key = {field: weights.get(field, 1) for field in fields} or dict(weights)
+    described = {"key": key}
+    for option in COMPARED_OPTIONS:
+        if spec.get(option):
+            described[option] = spec[option]
+    return described
+
+
+async def reconcile_indexes(database, plan: Dict[str, List[IndexModel]] = INDEXES) -> dict:
+    """Create missing indexes and report extra or outdated ones.
+
+    Extra and outdated indexes are only reported, never dropped: removing an
+    index is left to an operator so a bad deploy cannot drop one in use.
+    """
+    report = {"created": [], "extra": [], "outdated": [], "failed": []}
+    for collection_name, models in plan.items():
+        collection = database[collection_name]
+        existing = await collection.index_information()
+
+        missing = []
+        for model in models:
+            wanted = _describe(model.document)
+            name = model.document["name"]
+            if name not in existing:
+                missing.append(model)
+            elif _describe(existing[name]) != wanted:
+                report["outdated"].append(f"{collection_name}.{name}")
+
+        # Create one at a time so a single failure (for example duplicate
+        # data blocking a unique index) does not prevent the others.
+        for model in missing:
+            name = model.document["name"]
+            try:
+                await collection.create_indexes([model])
+                report["created"].append(f"{collection_name}.{name}")
+            except OperationFailure as e:
+                report["failed"].append(f"{collection_name}.{name}: {e}")
+
+        planned = {model.document["name"] for model in models}
+        report["extra"].extend(
+            f"{collection_name}.{name}" for name in existing
+            if name != "_id_" and name not in planned
+        )
+
+    for name in report["created"]:
+        logger.info("Created index %s", name)
+    for name in report["extra"]:
+        logger.warning("Index %s is not in the index plan", name)
+    for name in report["outdated"]:
+        logger.warning("Index %s differs from the index plan", name)
+    for failure in report["failed"]:
+        logger.error("Could not create index %s", failure)
+    return report
+
+
+async def check_unique_indexes(database, plan: Dict[str, List[IndexModel]] = INDEXES):
+    """Raise unless every unique index of the plan exists as planned.
+
+    The routes rely on unique indexes alone to reject duplicates, so the app
+    must not start without them, whether or not it manages the indexes.
+    """
+    missing = []
+    for collection_name, models in plan.items():
+        unique = [model for model in models if model.document.get("unique")]
+        if not unique:
+            continue
+        existing = await database[collection_name].index_information()
+        for model in unique:
+            name = model.document["name"]
+            if name not in existing or _describe(existing[name]) != _describe(model.document):
+                missing.append(f"{collection_name}.{name}")
+    if missing:
+        raise RuntimeError(f"Unique indexes missing or different from the index plan: {', '.join(missing)}")
@@ -0,0 +1,63 @@
+import ipaddress
+from typing import Tuple
+
+# IPv4 addresses are stored as IPv4-mapped IPv6 (::ffff:a.b.c.d) so that both
+# families share one fixed-width, byte-comparable key and one index.
+_V4_MAPPED = 0xFFFF << 32
+
+
+def _key(value: int) -> bytes:
+    return value.to_bytes(16, "big")
+
+
+def _as_int(ip) -> int:
+    return _V4_MAPPED | int(ip) if ip.version == 4 else int(ip)
+
+
+def parse_ip(address: str):
+    try:
+        return ipaddress.ip_address(address.strip())
+    except (ValueError, AttributeError):
+        return None
+
+
+def ip_fields(address: str) -> dict:
+    """Canonical address plus the sortable key stored next to it.
+
+    Free-form values that are not IP addresses are kept as they are and get a
+    ``None`` key, so they are simply invisible to range and conflict queries.
+    """
+    ip = parse_ip(address)
+    if ip is None:
+        return {"ip_numeric": None}
+    return {"ip_address": str(ip), "ip_numeric": _key(_as_int(ip))}
+
+
+def parse_network(cidr: str):
+    try:
+        return ipaddress.ip_network(cidr.strip(), strict=False)
+    except (ValueError, AttributeError):
+        return None
+
+
+def _has_broadcast(network) -> bool:
+    return network.version == 4 and network.prefixlen < 31
+
+
+def network_range(network, usable: bool = False) -> Tuple[bytes, bytes]:
+    """Inclusive key range covering every address of ``network``.
+
+    With ``usable`` the IPv4 network and broadcast addresses are left out,
+    as ``usable_addresses`` counts them.
+    """
+    low, high = _as_int(network.network_address), _as_int(network.broadcast_address)
+    if usable and _has_broadcast(network):
+        low, high = low + 1, high - 1
+    return _key(low), _key(high)
+
+
+def usable_addresses(network) -> int:
+    """Host addresses in ``network``, excluding IPv4 network/broadcast."""
+    if _has_broadcast(network):
+        return network.num_addresses - 2
+    return network.num_addresses
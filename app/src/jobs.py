@@ -0,0 +1,190 @@
+"""In-process background jobs persisted in the ``jobs`` collection.
+
+A job is a document with a ``kind``, its ``params``, a ``status`` and the
+``progress`` counters its handler reports. ``JobRunner`` runs queued jobs on
+a fixed number of asyncio workers. Jobs are claimed with a conditional update
+so several processes can share the collection. Running jobs heartbeat; at
+startup, and periodically after, every job that is still queued or has been
+running without a heartbeat for ``job_stale_seconds`` (its process died) is
+queued again. Failed jobs are only queued again on request, with ``retry``.
+Handlers therefore have to be safe to run more than once.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Awaitable, Callable, Dict, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+# kind -> async handler(db, params, report) returning the job result
+HANDLERS: Dict[str, Callable[..., Awaitable[Optional[dict]]]] = {}
+
+
+def handler(kind: str):
+    """Register the function that runs jobs of ``kind``"""
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+async def delete_in_batches(collection, query: dict, batch_size: int, report=None, on_delete=None) -> int:
+    """Delete the documents matching ``query`` ``batch_size`` at a time.
+
+    Small deletes keep each write short, so other requests are not stuck
+    behind one huge ``delete_many``. ``on_delete(documents)`` is awaited with
+    the ``_id`` and ``version`` of each deleted batch, and ``report(deleted)``
+    after every batch with the running total.
+    """
+    deleted = 0
+    while True:
+        docs = await collection.find(query, {"_id": 1, "version": 1}).limit(batch_size).to_list(None)
+        if not docs:
+            return deleted
+        result = await collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        deleted += result.deleted_count
+        if on_delete is not None:
+            await on_delete(docs)
+        if report is not None:
+            await report(deleted)
+
+
+class JobRunner:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.db = None
+        self._queue: "asyncio.Queue[ObjectId]" = asyncio.Queue()
+        self._tasks = []
+
+    async def start(self, db):
+        self.db = db
+        await self._resume(include_queued=True)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep()))
+
+    async def stop(self):
+        # Interrupted jobs stay "running" and are resumed once stale
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _resume(self, include_queued: bool):
+        stale = datetime.now() - timedelta(seconds=settings.job_stale_seconds)
+        resumable = [{"status": JobStatus.RUNNING.value, "heartbeat": {"$lt": stale}}]
+        if include_queued:
+            resumable.append({"status": JobStatus.QUEUED.value})
+        async for job in self.db.jobs.find({"$or": resumable}, {"_id": 1, "status": 1}).sort("created", 1):
+            if job["status"] == JobStatus.RUNNING.value:
+                requeued = await self.db.jobs.update_one(
+                    {"_id": job["_id"], "status": JobStatus.RUNNING.value, "heartbeat": {"$lt": stale}},
+                    {"$set": {"status": JobStatus.QUEUED.value}}
+                )
+                if not requeued.modified_count:
+                    continue
+                logger.info("Resuming job %s", job["_id"])
+            self._queue.put_nowait(job["_id"])
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(settings.job_stale_seconds / 2)
+            try:
+                await self._resume(include_queued=False)
+            except Exception:
+                logger.exception("Could not resume stale jobs")
+
+    async def _heartbeat(self, job_id: ObjectId):
+        while True:
+            await asyncio.sleep(settings.job_stale_seconds / 3)
+            await self.db.jobs.update_one({"_id": job_id}, {"$set": {"heartbeat": datetime.now()}})
+
+    async def submit(self, kind: str, params: dict) -> dict:
+        if kind not in HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = datetime.now()
+        job = {
+            "kind": kind,
+            "params": params,
+            "status": JobStatus.QUEUED.value,
+            "progress": {},
+            "result": None,
+            "error": None,
+            "created": now,
+            "started": None,
+            "finished": None,
+            "heartbeat": now,
+        }
+        await self.db.jobs.insert_one(job)
+        self._queue.put_nowait(job["_id"])
+        return job
+
+    async def retry(self, job_id: ObjectId) -> Optional[dict]:
+        """Queue a failed job again; ``None`` if there is no failed job ``job_id``"""
+        job = await self.db.jobs.find_one_and_update(
+            {"_id": job_id, "status": JobStatus.FAILED.value},
+            {"$set": {
+                "status": JobStatus.QUEUED.value, "error": None, "finished": None, "heartbeat": datetime.now()
+            }},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is not None:
+            self._queue.put_nowait(job_id)
+        return job
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                logger.exception("Job %s could not be run", job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: ObjectId):
+        now = datetime.now()
+        job = await self.db.jobs.find_one_and_update(
+            {"_id": job_id, "status": JobStatus.QUEUED.value},
+            {"$set": {"status": JobStatus.RUNNING.value, "started": now, "heartbeat": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            return  # claimed by another worker or process
+
+        async def report(name: str, value: int):
+            await self.db.jobs.update_one(
+                {"_id": job_id},
+                {"$set": {f"progress.{name}": value, "heartbeat": datetime.now()}}
+            )
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            result = await HANDLERS[job["kind"]](self.db, job["params"], report)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job_id, job["kind"])
+            update = {"status": JobStatus.FAILED.value, "error": str(e)}
+        else:
+            update = {"status": JobStatus.SUCCEEDED.value, "result": result}
+        finally:
+            heartbeat.cancel()
+        update["finished"] = datetime.now()
+        await self.db.jobs.update_one({"_id": job_id}, {"$set": update})
+
+
+job_runner = JobRunner(settings.job_workers)
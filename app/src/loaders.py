@@ -0,0 +1,107 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
+
+from bson import ObjectId
+
+from .documents import LIVE_CUSTOMERS
+
+
+class DataLoader:
+    """Coalesce ``load`` calls made within one event-loop tick into a single batch.
+
+    ``batch_fn`` receives the distinct keys requested since the last dispatch
+    and returns a mapping of key to value; keys missing from the mapping
+    resolve to ``None``. Results are memoised for the lifetime of the loader,
+    which is one request.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Hashable]], Awaitable[Dict]]):
+        self._batch_fn = batch_fn
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+        self._queue: List[Hashable] = []
+        # Dispatches in flight; the loop only keeps weak references to tasks
+        self._tasks = set()
+
+    def load(self, key: Hashable) -> asyncio.Future:
+        if key in self._futures:
+            return self._futures[key]
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._futures[key] = future
+        self._queue.append(key)
+        if len(self._queue) == 1:
+            loop.call_soon(self._start_dispatch)
+        return future
+
+    def _start_dispatch(self):
+        task = asyncio.ensure_future(self._dispatch())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def load_many(self, keys: Iterable[Hashable]) -> list:
+        return await asyncio.gather(*(self.load(key) for key in keys))
+
+    def prime(self, key: Hashable, value) -> None:
+        """Seed the cache, e.g. with a document the request just wrote."""
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(value)
+        self._futures[key] = future
+
+    def clear(self, key: Hashable) -> None:
+        self._futures.pop(key, None)
+
+    async def _dispatch(self):
+        """Resolve the queued keys; every failure ends up on their futures"""
+        keys, self._queue = self._queue, []
+        try:
+            values = await self._batch_fn(keys)
+            results = [(key, values.get(key)) for key in keys]
+        except asyncio.CancelledError:
+            for key in keys:
+                future = self._futures.pop(key, None)
+                if future is not None:
+                    future.cancel()
+            raise
+        except Exception as e:
+            for key in keys:
+                future = self._futures.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+        for key, value in results:
+            future = self._futures.get(key)
+            if future is not None and not future.done():
+                future.set_result(value)
+
+
+class DocumentLoader(DataLoader):
+    """Load documents of one collection by their string ``_id``.
+
+    ``load`` validates the id eagerly, so an invalid one raises
+    ``InvalidId`` at the call site just like ``ObjectId(...)`` did.
+    Documents not matching ``query`` load as missing.
+    """
+
+    def __init__(self, collection, query: Optional[dict] = None):
+        self.collection = collection
+        self.query = query or {}
+        super().__init__(self._fetch)
+
+    def load(self, key: str) -> asyncio.Future:
+        ObjectId(key)
+        return super().load(str(key))
+
+    async def _fetch(self, keys: List[str]) -> Dict[str, dict]:
+        query = {**self.query, "_id": {"$in": [ObjectId(key) for key in keys]}}
+        return {str(doc["_id"]): doc for doc in await self.collection.find(query).to_list(None)}
+
+
+class ReferenceLoaders:
+    """Per-request loaders for the documents other documents refer to."""
+
+    def __init__(self, database):
+        # A customer being deleted can no longer be referred to
+        self.customers = DocumentLoader(database.customers, LIVE_CUSTOMERS)
+        self.sites = DocumentLoader(database.sites)
+        self.infrastructure = DocumentLoader(database.infrastructure)
+
@@ -1,28 +1,51 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from src.database import close_mongo_connection, connect_to_mongo
-from src.routes import assets, customers, infrastructure, sites
+from src.cache import ResponseCacheMiddleware
+from src.config import settings
+from src.database import close_mongo_connection, connect_to_mongo, get_database
+from src.events import event_bus
+from src.indexes import check_unique_indexes, reconcile_indexes
+from src.jobs import job_runner
+from src.logs import configure_logging, stop_logging
+from src.metrics import MetricsMiddleware
+from src.pagination import NEXT_CURSOR_HEADER
+from src.routes import (assets, customers, events, export, infrastructure,
+                        jobs, sites, sync, system)
 
 app = FastAPI(title="Asset Management System")
 
 @app.on_event("startup")
 async def startup_db_client():
+    configure_logging()
     await connect_to_mongo()
+    if settings.manage_indexes:
+        await reconcile_indexes(await get_database())
+    await check_unique_indexes(await get_database())
+    await job_runner.start(await get_database())
+    await event_bus.start(await get_database())
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await event_bus.stop()
+    await job_runner.stop()
     await close_mongo_connection()
+    stop_logging()
 
+app.add_middleware(ResponseCacheMiddleware)
+# Outside the cache, so cached responses are measured too
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],  # React app URL
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "X-Request-ID"],
 )
 
 app.include_router(assets.router, tags=["assets"])
+app.include_router(sync.router, tags=["assets"])
 app.include_router(customers.router, prefix="/customers", tags=["customers"])
 app.include_router(sites.router, prefix="/sites", tags=["sites"])
 app.include_router(
@@ -30,4 +53,7 @@ app.include_router(
     prefix="/infrastructure",
     tags=["infrastructure"]
 )
-
+app.include_router(export.router, tags=["export"])
+app.include_router(jobs.router, tags=["jobs"])
+app.include_router(events.router, tags=["events"])
+app.include_router(system.router, tags=["system"])
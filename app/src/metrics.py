@@ -0,0 +1,308 @@
+"""Request and MongoDB command metrics, exposed in Prometheus text format.
+
+``MetricsMiddleware`` times every request and records it under its route
+template. While a request runs, ``current_request`` holds its
+``RequestStats``; Motor runs pymongo in executor threads with a copy of the
+caller's context, so ``CommandMetrics`` can attribute each command to the
+request that issued it. Commands issued outside a request (background jobs,
+startup) are only counted globally.
+"""
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+from .config import settings
+from .query_debug import Query, query_debugger
+
+access_logger = logging.getLogger("src.access")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {series[-1]}")
+                lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "Request latency", ("method", "route", "status")))
+REQUEST_BYTES = registry.register(Histogram(
+    "http_request_size_bytes", "Request body size", ("method", "route"), SIZE_BUCKETS))
+RESPONSE_BYTES = registry.register(Histogram(
+    "http_response_size_bytes", "Response body size", ("method", "route"), SIZE_BUCKETS))
+REQUEST_COMMANDS = registry.register(Histogram(
+    "http_request_mongo_commands", "MongoDB commands issued per request", ("method", "route"),
+    COUNT_BUCKETS))
+REQUEST_MONGO_SECONDS = registry.register(Histogram(
+    "http_request_mongo_seconds", "Time spent in MongoDB commands per request", ("method", "route")))
+REQUEST_DOCUMENTS = registry.register(Counter(
+    "http_request_mongo_documents_total", "Documents returned or written by MongoDB per route",
+    ("method", "route")))
+COMMAND_SECONDS = registry.register(Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("command", "collection")))
+COMMAND_FAILURES = registry.register(Counter(
+    "mongo_command_failures_total", "Failed MongoDB commands", ("command", "collection")))
+
+
+class RequestStats:
+    """MongoDB work attributed to one request"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.commands = 0
+        self.mongo_seconds = 0.0
+        self.documents = 0
+        # Commands kept for the query debugger
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float, documents: int):
+        with self._lock:
+            self.commands += 1
+            self.mongo_seconds += seconds
+            self.documents += documents
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def _documents(reply) -> int:
+    """Documents a command returned or wrote, from its reply"""
+    if not isinstance(reply, dict):
+        return 0
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or ())
+    if "value" in reply:  # findAndModify
+        return 1 if reply["value"] else 0
+    n = reply.get("n")
+    return n if isinstance(n, int) else 0
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Time MongoDB commands and attribute them to the current request"""
+
+    # Commands issued by the driver itself or by the query debugger
+    IGNORED = {"hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue", "endSessions",
+               "explain"}
+
+    def __init__(self):
+        # (connection, request id) -> collection, command, database
+        self._started: Dict[Tuple, Tuple[str, dict, str]] = {}
+
+    def started(self, event):
+        if event.command_name in self.IGNORED:
+            return
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        self._started[(event.connection_id, event.request_id)] = (
+            collection if isinstance(collection, str) else "", event.command, event.database_name
+        )
+
+    def _finish(self, event, reply=None):
+        started = self._started.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return None
+        collection, command, database = started
+        seconds = event.duration_micros / 1e6
+        COMMAND_SECONDS.observe(seconds, event.command_name, collection)
+        stats = current_request.get()
+        if stats is not None:
+            stats.add(seconds, _documents(reply))
+        query_debugger.observe(Query(event.command_name, collection, database, command, seconds), stats)
+        return collection
+
+    def succeeded(self, event):
+        self._finish(event, event.reply)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        if collection is not None:
+            COMMAND_FAILURES.inc(event.command_name, collection)
+
+
+command_metrics = CommandMetrics()
+
+
+def _prefix(route, path: str) -> str:
+    """The part of ``path`` in front of what ``route`` matches.
+
+    Depending on the FastAPI version the route of an included router is
+    either a copy with the router prefix in its path or the route as declared.
+    """
+    if route.path_regex.match(path):
+        return ""
+    for start, char in enumerate(path):
+        if char == "/" and start and route.path_regex.match(path[start:]):
+            return path[:start]
+    return ""
+
+
+class MetricsMiddleware:
+    """Record latency, sizes and MongoDB work of every HTTP request.
+
+    Requests are labelled with their route template (``/assets/{asset_id}``)
+    to keep the number of series bounded. Responses carry an ``X-Request-ID``
+    header, taken from the request when the client sent one.
+    """
+
+    def __init__(self, app, max_paths: int = settings.cache_max_entries):
+        self.app = app
+        self.max_paths = max_paths
+        # path -> route template of recently routed requests
+        self._templates: Dict[str, str] = {}
+
+    def _route(self, scope) -> str:
+        """Route template of the request, e.g. ``/assets/{asset_id}``.
+
+        The path of the matched route, behind the prefix of its router.
+        Responses served before routing, by the response cache, reuse the
+        template of the request that filled the cache.
+        """
+        path = scope["path"]
+        route = scope.get("route")
+        if route is None:
+            return self._templates.get(path, "unmatched")
+        template = _prefix(route, path) + route.path
+        if path not in self._templates:
+            if len(self._templates) >= self.max_paths:
+                del self._templates[next(iter(self._templates))]
+            self._templates[path] = template
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        request_bytes = 0
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+            elif name == b"content-length" and value.isdigit():
+                request_bytes = int(value)
+        stats = RequestStats(request_id or uuid.uuid4().hex)
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        status = 500
+        response_bytes = 0
+
+        async def instrument(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", stats.request_id.encode("latin-1"))
+                ]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, instrument)
+        finally:
+            current_request.reset(token)
+            seconds = time.perf_counter() - start
+            method, route = scope["method"], self._route(scope)
+            REQUEST_SECONDS.observe(seconds, method, route, str(status))
+            REQUEST_BYTES.observe(request_bytes, method, route)
+            RESPONSE_BYTES.observe(response_bytes, method, route)
+            REQUEST_COMMANDS.observe(stats.commands, method, route)
+            REQUEST_MONGO_SECONDS.observe(stats.mongo_seconds, method, route)
+            REQUEST_DOCUMENTS.inc(method, route, amount=stats.documents)
+            query_debugger.finish_request(method, route, stats)
+            if settings.access_log:
+                access_logger.info("%s %s %s", method, scope["path"], status, extra={"fields": {
+                    "request_id": stats.request_id,
+                    "method": method,
+                    "route": route,
+                    "status": status,
+                    "duration_ms": round(seconds * 1000, 3),
+                    "response_bytes": response_bytes,
+                    "mongo_commands": stats.commands,
+                    "mongo_ms": round(stats.mongo_seconds * 1000, 3),
+                }})
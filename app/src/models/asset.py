@@ -28,3 +28,11 @@ class HostSpecs(BaseModel):
     manufacturer: str
     cpu_cores: int
     ram_gb: int
+
+# The specs model each asset type carries
+SPECS_BY_TYPE = {
+    AssetType.VM: VmSpecs,
+    AssetType.HOST: HostSpecs,
+    AssetType.SWITCH: NetworkDeviceSpecs,
+    AssetType.FIREWALL: NetworkDeviceSpecs,
+}
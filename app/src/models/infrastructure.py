@@ -24,6 +24,14 @@ class DatacenterConfig(BaseModel):
 class OnPremiseConfig(BaseModel):
     location: str
 
+# The config model each location type carries
+CONFIG_BY_TYPE = {
+    LocationType.AZURE: AzureConfig,
+    LocationType.AWS: AwsConfig,
+    LocationType.ON_PREMISE: OnPremiseConfig,
+    LocationType.DATACENTER: DatacenterConfig,
+}
+
 class InfrastructureLocation(BaseModel):
     name: str
     type: LocationType
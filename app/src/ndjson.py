@@ -0,0 +1,28 @@
+import json
+
+
+async def iter_ndjson(chunks):
+    """Parse newline-delimited JSON from an async iterator of byte chunks.
+
+    Yields ``(line_number, record, error)`` tuples so callers can report
+    malformed lines without aborting the rest of the stream. Only the current
+    partial line is buffered.
+    """
+    pending = b""
+    line_number = 0
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield _parse(line_number, line)
+    if pending.strip():
+        yield _parse(line_number + 1, pending)
+
+
+def _parse(line_number: int, line: bytes):
+    try:
+        return line_number, json.loads(line), None
+    except ValueError as e:
+        return line_number, None, f"Invalid JSON: {e}"
@@ -0,0 +1,235 @@
+import base64
+import binascii
+from collections.abc import Mapping
+from typing import Iterable, List, Optional, Tuple
+
+from bson import ObjectId, json_util
+from fastapi import HTTPException, Query
+
+from .config import settings
+from .indexes import INDEXES
+from .serialization import ORJSONResponse
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class PageParams:
+    """Query parameters shared by every list endpoint.
+
+    ``sort`` takes a field name, prefixed with ``-`` for descending order.
+    ``fields`` is a comma separated projection pushed down to Mongo.
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=settings.max_page_size),
+        after: Optional[str] = None,
+        sort: Optional[str] = None,
+        fields: Optional[str] = None,
+    ):
+        self.limit = limit
+        self.after = after
+        self.sort = sort
+        self.fields = fields
+
+
+def encode_cursor(sort_field: str, direction: int, value, doc_id: ObjectId, tiebreak: list = ()) -> str:
+    payload = {"s": sort_field, "d": direction, "v": value, "id": doc_id}
+    if tiebreak:
+        payload["t"] = list(tiebreak)
+    payload = json_util.dumps(payload)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if not isinstance(payload, dict) or not isinstance(payload.get("id"), ObjectId):
+            raise ValueError(cursor)
+        return payload
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+
+def parse_sort(sort: Optional[str], sortable: Iterable[str]) -> Tuple[str, int]:
+    """The stored field and direction to sort by.
+
+    ``sortable`` may map a public field name to the stored field it is sorted
+    by, such as an address to its numeric key.
+    """
+    if not sort:
+        return "_id", 1
+    direction = -1 if sort.startswith("-") else 1
+    field = sort.lstrip("-+")
+    if field == "id":
+        field = "_id"
+    if field != "_id" and field not in sortable:
+        raise HTTPException(status_code=400, detail=f"Cannot sort by '{field}'")
+    if isinstance(sortable, Mapping) and field in sortable:
+        field = sortable[field]
+    return field, direction
+
+
+def default_sort(query: dict, sortable: Iterable[str] = ()) -> str:
+    """The field a query is sorted by when none is asked for.
+
+    Queries over a range of a sortable field are returned in that field's
+    order, which the index bounding the range also provides; everything else
+    in id order.
+    """
+    stored = set(sortable.values()) if isinstance(sortable, Mapping) else set(sortable)
+    for field, condition in query.items():
+        if field in stored and isinstance(condition, dict):
+            return field
+    return "_id"
+
+
+def _index_keys(collection_name: str) -> List[List[str]]:
+    keys = [["_id"]]
+    for model in INDEXES.get(collection_name, ()):
+        key = list(model.document["key"].items())
+        if all(direction in (1, -1) for _, direction in key):
+            keys.append([field for field, _ in key])
+    return keys
+
+
+def indexed(collection_name: str, query: dict, sort_field: str, tiebreak=()) -> bool:
+    """Whether an index of the plan returns ``query`` in keyset order.
+
+    That is an index on some of the equality-filtered fields, then the sort
+    field and its ``tiebreak`` fields, then ``_id``, so pages are read off the
+    index without a blocking sort. When the query has equality filters the index must start with one
+    of them, or it would walk the whole collection for them.
+    """
+    equal = {
+        field for field, condition in query.items()
+        if not field.startswith("$") and not isinstance(condition, dict)
+    }
+    order = [field for field in dict.fromkeys([sort_field, *tiebreak, "_id"]) if field not in equal]
+    for keys in _index_keys(collection_name):
+        start = 0
+        while start < len(keys) and keys[start] in equal:
+            start += 1
+        if keys[start:start + len(order)] == order and (start or not equal):
+            return True
+    return False
+
+
+def split_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """The paths named in a ``fields`` parameter, ``None`` when it is not given."""
+    if not fields:
+        return None
+    return [f.strip() for f in fields.split(",") if f.strip() and f.strip() != "id"]
+
+
+def parse_fields(fields: Optional[str], projectable: Iterable[str]) -> Optional[List[str]]:
+    """Split a ``fields`` parameter, accepting dotted paths into known fields."""
+    requested = split_fields(fields)
+    if requested is None:
+        return None
+    allowed = set(projectable)
+    unknown = [f for f in requested if f.split(".", 1)[0] not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+
+def covered(path: str, fields: Iterable[str]) -> bool:
+    """Whether projecting ``fields`` returns ``path``"""
+    return any(path == field or path.startswith(field + ".") for field in fields)
+
+
+def _after(field: str, direction: int, value) -> List[dict]:
+    # Null and missing values sort before every other value, and comparison
+    # operators never match them, so they need their own clauses
+    if direction == 1:
+        return [{field: {"$ne": None}}] if value is None else [{field: {"$gt": value}}]
+    return [] if value is None else [{field: {"$lt": value}}, {field: None}]
+
+
+def keyset_filter(keys: List[Tuple[str, object]], direction: int, doc_id: ObjectId) -> dict:
+    """Filter for the rows after ``(*values, doc_id)`` in the sort order.
+
+    ``keys`` are the sort fields before ``_id`` with the values of the last
+    row; a row comes after it when it equals it on a prefix of them and sorts
+    after it on the next one.
+    """
+    op = "$gt" if direction == 1 else "$lt"
+    clauses = []
+    for position, (field, value) in enumerate(keys):
+        equal = dict(keys[:position])
+        clauses.extend({**equal, **clause} for clause in _after(field, direction, value))
+    clauses.append({**dict(keys), "_id": {op: doc_id}})
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+async def fetch_page(
+    collection, query: dict, page: PageParams, sortable=(), projectable=(), hidden=(), include=(), tiebreak=()
+):
+    """Run ``query`` as a keyset-paginated find.
+
+    ``hidden`` fields are internal to the stored documents and are left out
+    of the results unless explicitly projected. ``include`` paths are read
+    even when ``fields`` leaves them out, for the caller to use and drop.
+    ``tiebreak`` fields order rows that share a sort value before ``_id`` does.
+
+    Returns the raw documents and the cursor for the next page, which is
+    ``None`` once the last page has been reached or when no limit was given.
+    """
+    if page.sort:
+        sort_field, direction = parse_sort(page.sort, sortable)
+    else:
+        sort_field, direction = default_sort(query, sortable), 1
+    keys = [sort_field, *tiebreak] if sort_field != "_id" else []
+    if not indexed(collection.name, query, sort_field, keys[1:]):
+        raise HTTPException(status_code=400, detail=f"Cannot sort by '{page.sort or 'id'}' with these filters")
+    fields = parse_fields(page.fields, projectable)
+
+    if page.after:
+        cursor = decode_cursor(page.after)
+        if cursor.get("s") != sort_field or cursor.get("d") != direction:
+            raise HTTPException(status_code=400, detail="Cursor does not match the requested sort")
+        values = [cursor.get("v"), *cursor.get("t", [])] if keys else []
+        if len(values) != len(keys):
+            raise HTTPException(status_code=400, detail="Cursor does not match the requested sort")
+        keyset = keyset_filter(list(zip(keys, values)), direction, cursor["id"])
+        query = {"$and": [query, keyset]} if query else keyset
+
+    projection = {f: 0 for f in hidden if f not in keys} or None
+    if fields is not None:
+        projection = {f: 1 for f in fields}
+        projection.update({key: 1 for key in keys})
+        projection.update({path: 1 for path in include if not covered(path, fields)})
+
+    sort = [(key, direction) for key in keys] + [("_id", direction)]
+
+    find = collection.find(query, projection).sort(sort)
+    if page.limit is None:
+        docs = await find.to_list(None)
+        next_cursor = None
+    else:
+        docs = await find.limit(page.limit + 1).to_list(None)
+        next_cursor = None
+        if len(docs) > page.limit:
+            docs = docs[:page.limit]
+            last = docs[-1]
+            values = [last.get(key) for key in keys] or [None]
+            next_cursor = encode_cursor(sort_field, direction, values[0], last["_id"], values[1:])
+
+    dropped = [key for key in keys if key in hidden or (fields is not None and key not in fields)]
+    for doc in docs:
+        for key in dropped:
+            doc.pop(key, None)
+    return docs, next_cursor
+
+
+def page_response(items: list, next_cursor: Optional[str]):
+    """Return a page of items, advertising the next cursor in a header.
+
+    Pages are encoded directly instead of being revalidated against the
+    route's ``response_model``; stored documents were validated on write and
+    projected pages would not match the model anyway.
+    """
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return ORJSONResponse(items, headers=headers)
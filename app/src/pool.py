@@ -0,0 +1,98 @@
+"""Connection pool monitoring for the Motor client.
+
+pymongo publishes pool events from the threads that run the operations, so
+``PoolMonitor`` only keeps counters under a lock; ``/health/db`` reads a
+snapshot of them.
+"""
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from pymongo import monitoring
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Counts connections, check-outs and pool clears for every server"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures: Counter = Counter()
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.clears = 0
+        self.last_cleared: Optional[float] = None
+
+    def _waited(self, duration: Optional[float]):
+        if duration is not None:
+            self.wait_total += duration
+            self.wait_max = max(self.wait_max, duration)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self._waited(getattr(event, "duration", None))
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures[event.reason] += 1
+            self._waited(getattr(event, "duration", None))
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.clears += 1
+            self.last_cleared = time.time()
+
+    # Required by the listener interface, nothing to count
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            attempts = self.checkouts + sum(self.checkout_failures.values())
+            return {
+                "open_connections": self.open,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": dict(self.checkout_failures),
+                "wait_queue_ms": {
+                    "mean": round(self.wait_total / attempts * 1000, 3) if attempts else 0.0,
+                    "max": round(self.wait_max * 1000, 3),
+                },
+                "pool_clears": self.clears,
+                "last_cleared": self.last_cleared,
+            }
+
+
+pool_monitor = PoolMonitor()
@@ -0,0 +1,243 @@
+"""Slow query and N+1 detection, with sampled explain plans.
+
+Every MongoDB command slower than ``slow_query_ms`` is logged. With
+``query_debug`` on, the commands of each request are also kept until it
+finishes: a request issuing more than ``query_debug_round_trips`` commands is
+flagged with the shapes of what it ran, and a ``query_debug_explain_rate``
+sample of query shapes (plus every slow one) is explained once, so plans
+that scan the whole collection show up. Findings are listed at
+``/debug/queries``.
+
+Shapes are the command's filter with every value replaced by ``"?"``, so
+queries that only differ in their values are grouped and no data is kept.
+"""
+import asyncio
+import json
+import logging
+import random
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Commands whose plan ``explain`` can report
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+
+# Fields the driver adds to a command, which ``explain`` does not accept
+DRIVER_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+
+# Keys under which explain output nests plan stages
+PLAN_CHILDREN = ("inputStage", "inputStages", "queryPlan", "outerStage", "innerStage",
+                 "thenStage", "elseStage")
+
+
+class Query(NamedTuple):
+    command: str
+    collection: str
+    database: str
+    document: dict
+    seconds: float
+
+    @property
+    def slow(self) -> bool:
+        return settings.slow_query_ms > 0 and self.seconds * 1000 >= settings.slow_query_ms
+
+
+def _strip(value):
+    if isinstance(value, dict):
+        return {key: _strip(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = []
+        for item in value:
+            item = _strip(item)
+            if item not in items:
+                items.append(item)
+        return items
+    return "?"
+
+
+def query_shape(command: str, document: dict) -> dict:
+    """What a command filters on and how, without the values"""
+    if command == "find":
+        return {"filter": _strip(document.get("filter", {})), "sort": document.get("sort")}
+    if command == "aggregate":
+        return {"pipeline": [_strip(stage) for stage in document.get("pipeline", [])]}
+    if command in ("count", "distinct"):
+        return {"query": _strip(document.get("query", {})), "key": document.get("key")}
+    if command == "findAndModify":
+        return {"query": _strip(document.get("query", {})), "sort": document.get("sort")}
+    if command in ("update", "delete"):
+        return {"q": _strip([statement.get("q", {}) for statement in document.get(f"{command}s", [])])}
+    return {}
+
+
+def shape_key(query: Query) -> str:
+    shape = json.dumps(query_shape(query.command, query.document), sort_keys=True, default=str)
+    return f"{query.collection}.{query.command} {shape}"
+
+
+def explain_document(query: Query) -> Optional[dict]:
+    """The command to pass to ``explain``, or None when it has no plan"""
+    if query.command not in EXPLAINABLE:
+        return None
+    if query.command == "aggregate" and any(
+        "$out" in stage or "$merge" in stage for stage in query.document.get("pipeline", [])
+    ):
+        return None
+    return {
+        key: value for key, value in query.document.items()
+        if not key.startswith("$") and key not in DRIVER_FIELDS
+    }
+
+
+def _walk_plan(stage: dict, stages: List[str], indexes: List[str]):
+    stages.append(stage.get("stage", "?"))
+    if "indexName" in stage:
+        indexes.append(stage["indexName"])
+    for key in PLAN_CHILDREN:
+        child = stage.get(key)
+        for child in child if isinstance(child, list) else [child]:
+            if isinstance(child, dict):
+                _walk_plan(child, stages, indexes)
+
+
+def _winning_plans(value, plans: List[dict]):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "winningPlan" and isinstance(item, dict):
+                plans.append(item)
+            else:
+                _winning_plans(item, plans)
+    elif isinstance(value, list):
+        for item in value:
+            _winning_plans(item, plans)
+
+
+def plan_summary(explain: dict) -> dict:
+    """Stages and indexes of the winning plans in ``explain`` output"""
+    plans: List[dict] = []
+    _winning_plans(explain, plans)
+    stages: List[str] = []
+    indexes: List[str] = []
+    for plan in plans:
+        _walk_plan(plan, stages, indexes)
+    return {"stages": stages, "indexes": indexes, "collscan": "COLLSCAN" in stages}
+
+
+class QueryDebugger:
+    def __init__(self, max_findings: int):
+        self.max_findings = max_findings
+        self._findings: deque = deque(maxlen=max_findings)
+        # shape key -> plan summary, oldest first
+        self._plans: "OrderedDict[str, dict]" = OrderedDict()
+        self._explaining = set()
+        self._tasks = set()
+
+    def observe(self, query: Query, stats=None):
+        """Record a finished command, issued by the request behind ``stats``"""
+        if stats is not None:
+            if settings.query_debug or query.slow:
+                stats.queries.append(query)
+        elif query.slow:
+            self._slow(query, shape_key(query), {})
+
+    def finish_request(self, method: str, route: str, stats):
+        """Flag the request behind ``stats`` and sample its queries for explain"""
+        if not stats.queries:
+            return
+        context = {"method": method, "route": route, "request_id": stats.request_id}
+        keys = [shape_key(query) for query in stats.queries]
+        for query, key in zip(stats.queries, keys):
+            if query.slow:
+                self._slow(query, key, context)
+        if not settings.query_debug:
+            return
+        if stats.commands > settings.query_debug_round_trips:
+            self._round_trips(stats, keys, context)
+        for query, key in zip(stats.queries, keys):
+            if key in self._plans or key in self._explaining:
+                continue
+            if query.slow or random.random() < settings.query_debug_explain_rate:
+                document = explain_document(query)
+                if document is not None:
+                    self._explaining.add(key)
+                    task = asyncio.get_running_loop().create_task(self._explain(key, query.database, document))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+    def _record(self, finding: dict):
+        self._findings.append({"time": datetime.now(), **finding})
+
+    def _slow(self, query: Query, key: str, context: dict):
+        duration_ms = round(query.seconds * 1000, 3)
+        logger.warning(
+            "Slow %s on %s (%s ms)", query.command, query.collection, duration_ms,
+            extra={"fields": {**context, "shape": key, "duration_ms": duration_ms}},
+        )
+        self._record({
+            "kind": "slow_query",
+            "route": None,  # issued outside a request
+            **context,
+            "command": query.command,
+            "collection": query.collection,
+            "shape": key,
+            "duration_ms": duration_ms,
+        })
+
+    def _round_trips(self, stats, keys: List[str], context: dict):
+        repeated = Counter(keys)
+        logger.warning(
+            "%s %s made %s MongoDB round trips", context["method"], context["route"], stats.commands,
+            extra={"fields": {**context, "round_trips": stats.commands}},
+        )
+        self._record({
+            "kind": "round_trips",
+            **context,
+            "round_trips": stats.commands,
+            "queries": [{"shape": key, "count": count} for key, count in repeated.most_common()],
+        })
+
+    async def _explain(self, key: str, database: str, document: dict):
+        from .database import db
+
+        try:
+            explain = await db.client[database].command(
+                {"explain": document, "verbosity": "queryPlanner"}
+            )
+        except Exception as e:
+            logger.info("Could not explain %s: %s", key, e)
+            return
+        finally:
+            self._explaining.discard(key)
+        summary = plan_summary(explain)
+        self._plans[key] = summary
+        while len(self._plans) > self.max_findings:
+            self._plans.popitem(last=False)
+        if summary["collscan"]:
+            logger.warning("Collection scan for %s", key, extra={"fields": {"shape": key, **summary}})
+
+    def _with_plans(self, finding: dict) -> dict:
+        if "shape" in finding:
+            return {**finding, "plan": self._plans.get(finding["shape"])}
+        queries = [{**query, "plan": self._plans.get(query["shape"])} for query in finding["queries"]]
+        return {**finding, "queries": queries}
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.query_debug,
+            "slow_query_ms": settings.slow_query_ms,
+            "round_trips_threshold": settings.query_debug_round_trips,
+            "explain_rate": settings.query_debug_explain_rate,
+            "findings": [self._with_plans(finding) for finding in reversed(self._findings)],
+            "plans": [{"shape": key, **plan} for key, plan in reversed(self._plans.items())],
+        }
+
+    def clear(self):
+        self._findings.clear()
+        self._plans.clear()
+
+
+query_debugger = QueryDebugger(settings.query_debug_max_findings)
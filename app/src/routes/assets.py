@@ -1,102 +1,555 @@
+import asyncio
+import re
+from datetime import datetime
+from enum import Enum
 from typing import List, Optional
 
 from bson import ObjectId
 from bson.errors import InvalidId
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from pydantic import ValidationError
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, ExecutionTimeout
 
-from ..database import get_database
-from ..models.asset import AssetType
-from ..schemas.asset import AssetBase, AssetCreate, AssetInDB
+from .. import counters, history
+from ..config import settings
+from ..database import get_database, get_loaders
+from ..documents import (ASSET_INTERNAL_FIELDS, asset_document, fingerprint,
+                         hidden)
+from ..events import event_bus
+from ..expand import (ASSET_REFERENCES, expand, expand_param,
+                      reference_paths)
+from ..ipaddr import network_range, parse_network, usable_addresses
+from ..models.asset import SPECS_BY_TYPE, AssetType
+from ..ndjson import iter_ndjson
+from ..pagination import PageParams, fetch_page, page_response
+from ..schemas.asset import (SPECS_ADAPTERS, AssetBase, AssetCreate,
+                             AssetExpanded, AssetInDB, AssetPatch, AssetRevision,
+                             AssetSearchResult, BulkAssetResponse,
+                             BulkAssetResult, SubnetUtilization)
+from ..serialization import to_response
+from ..updates import (INITIAL_VERSION, patch_fields, set_paths,
+                       update_counted_document, validate_partial)
 
 router = APIRouter(prefix="/assets")
 
-@router.get("", response_model=List[AssetInDB])
-async def get_assets(
+# Public sort fields and the stored fields they sort by; ``indexes.INDEXES``
+# decides which of them each filter combination accepts
+SORTABLE_FIELDS = {
+    "hostname": "hostname_lc", "ip_address": "ip_numeric",
+    "asset_type": "asset_type", "customer_id": "customer_id", "site_id": "site_id",
+}
+
+SEARCH_PROJECTION = {
+    "hostname": 1, "ip_address": 1, "asset_type": 1, "customer_id": 1, "site_id": 1
+}
+
+class SearchMode(str, Enum):
+    TEXT = "text"
+    PREFIX = "prefix"
+
+def _network(cidr: str):
+    network = parse_network(cidr)
+    if network is None:
+        raise HTTPException(status_code=400, detail="Invalid CIDR")
+    return network
+
+def _ip_range(network, usable: bool = False) -> dict:
+    low, high = network_range(network, usable)
+    return {"$gte": low, "$lte": high}
+
+def asset_filters(
     customer_id: Optional[str] = None,
     asset_type: Optional[AssetType] = None,
-    db=Depends(get_database)
-):
-    """Get assets with optional filtering"""
+    cidr: Optional[str] = None,
+) -> dict:
+    """Build the Mongo filter shared by the asset list and export routes"""
     query = {}
     if customer_id:
         query["customer_id"] = customer_id
     if asset_type:
         query["asset_type"] = asset_type.value
-    
-    print(f"Query: {query}")  # Debug print
-    
-    assets = await db.assets.find(query).to_list(None)
-    return [{"id": str(asset["_id"]), **{k:v for k,v in asset.items() if k != "_id"}} 
-            for asset in assets]
+    if cidr:
+        query["ip_numeric"] = _ip_range(_network(cidr))
+    return query
+
+async def _ip_conflict(db, asset: dict, exclude_id: Optional[ObjectId] = None):
+    """Raise 409 if another asset of the customer already uses the IP"""
+    if asset.get("ip_numeric") is None:
+        return
+    query = {"customer_id": asset["customer_id"], "ip_numeric": asset["ip_numeric"]}
+    if exclude_id is not None:
+        query["_id"] = {"$ne": exclude_id}
+    existing = await db.assets.find_one(query, {"hostname": 1})
+    if existing:
+        raise HTTPException(
+            status_code=409,
+            detail=f"IP address {asset['ip_address']} is already used by asset {existing['_id']}"
+        )
+
+@router.get("", response_model=List[AssetExpanded])
+async def get_assets(
+    query: dict = Depends(asset_filters),
+    page: PageParams = Depends(),
+    names: List[str] = Depends(expand_param(ASSET_REFERENCES)),
+    as_of: Optional[datetime] = None,
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
+):
+    """Get assets with optional filtering
+
+    With ``as_of`` the assets are rebuilt from their history as they were at
+    that time, in id order.
+    """
+    if as_of is not None:
+        assets, next_cursor = await history.page_as_of(db, query, page, as_of)
+    else:
+        assets, next_cursor = await fetch_page(
+            db.assets, query, page, SORTABLE_FIELDS, AssetBase.model_fields, ASSET_INTERNAL_FIELDS,
+            reference_paths(names, ASSET_REFERENCES)
+        )
+    items = [to_response(asset, AssetExpanded.model_fields) for asset in assets]
+    await expand(items, names, ASSET_REFERENCES, loaders, page.fields)
+    return page_response(items, next_cursor)
+
+@router.get("/subnets/utilization", response_model=SubnetUtilization)
+async def get_subnet_utilization(
+    cidr: str,
+    customer_id: Optional[str] = None,
+    db=Depends(get_database)
+):
+    """Count the addresses of a network that are assigned to assets"""
+    network = _network(cidr)
+    # Only usable addresses are counted, so an asset on the network or
+    # broadcast address does not take the place of a free host address
+    query = {"ip_numeric": _ip_range(network, usable=True)}
+    if customer_id:
+        query["customer_id"] = customer_id
+    # Assets of different customers may share an address, so count addresses, not assets
+    counted = await db.assets.aggregate([
+        {"$match": query},
+        {"$group": {"_id": "$ip_numeric"}},
+        {"$count": "used"},
+    ]).to_list(1)
+    used = counted[0]["used"] if counted else 0
+    usable = usable_addresses(network)
+    return {
+        "cidr": str(network),
+        "customer_id": customer_id,
+        "total_addresses": network.num_addresses,
+        "usable_addresses": usable,
+        "used": used,
+        "free": usable - used,
+        "utilization": used / usable if usable else 0.0,
+    }
+
+def search_find(q: str, mode: SearchMode, query: dict):
+    """Filter, projection and sort of an asset search"""
+    projection = dict(SEARCH_PROJECTION)
+    if mode == SearchMode.TEXT:
+        query["$text"] = {"$search": q}
+        projection["score"] = {"$meta": "textScore"}
+        sort = [("score", {"$meta": "textScore"})]
+    else:
+        query["hostname_lc"] = {"$regex": "^" + re.escape(q.strip().lower())}
+        sort = [("hostname_lc", 1)]
+    return query, projection, sort
+
+@router.get("/search", response_model=List[AssetSearchResult])
+async def search_assets(
+    q: str = Query(..., min_length=1),
+    mode: SearchMode = SearchMode.TEXT,
+    query: dict = Depends(asset_filters),
+    limit: int = Query(20, ge=1, le=settings.search_max_results),
+    db=Depends(get_database)
+):
+    """Search assets by hostname, notes and specs, or autocomplete a hostname prefix
+
+    Text mode ranks matches by relevance using the text index; prefix mode
+    is an anchored match on the lowercased hostname, in hostname order.
+    """
+    query, projection, sort = search_find(q, mode, query)
+    cursor = db.assets.find(query, projection).sort(sort).limit(limit)
+    try:
+        assets = await cursor.max_time_ms(settings.search_time_budget_ms).to_list(None)
+    except ExecutionTimeout:
+        raise HTTPException(status_code=504, detail="Search exceeded its time budget")
+    return [to_response(asset) for asset in assets]
 
 @router.get("/{asset_id}", response_model=AssetInDB)
-async def get_asset(asset_id: str, db=Depends(get_database)):
-    """Get a single asset by ID"""
+async def get_asset(asset_id: str, as_of: Optional[datetime] = None, db=Depends(get_database)):
+    """Get a single asset by ID, as it was at ``as_of`` if given"""
     try:
-        asset = await db.assets.find_one({"_id": ObjectId(asset_id)})
+        if as_of is not None:
+            asset = await history.asset_as_of(db, ObjectId(asset_id), as_of)
+        else:
+            asset = await db.assets.find_one({"_id": ObjectId(asset_id)})
         if not asset:
             raise HTTPException(status_code=404, detail="Asset not found")
-        return {"id": str(asset["_id"]), **{k:v for k,v in asset.items() if k != "_id"}}
+        return to_response(asset)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid asset ID format")
+
+@router.get("/{asset_id}/history", response_model=List[AssetRevision])
+async def get_asset_history(asset_id: str, page: PageParams = Depends(), db=Depends(get_database)):
+    """Revisions of an asset, newest first unless sorted by ``ts``"""
+    try:
+        object_id = ObjectId(asset_id)
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid asset ID format")
+    page.sort = page.sort or "-ts"
+    entries, next_cursor = await fetch_page(
+        db.asset_history, {"asset_id": object_id}, page, ("ts",), AssetRevision.model_fields,
+        tiebreak=history.REPLAY_TIEBREAK
+    )
+    if not entries and not page.after and not await db.assets.find_one({"_id": object_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Asset not found")
+    for entry in entries:
+        snapshot = entry.pop("snapshot", None)
+        if entry.get("op") in ("insert", "snapshot"):
+            entry["changes"] = snapshot
+    return page_response([to_response(entry, AssetRevision.model_fields) for entry in entries], next_cursor)
 
 @router.post("", response_model=AssetInDB)
-async def create_asset(asset: AssetCreate, db=Depends(get_database)):
+async def create_asset(
+    asset: AssetCreate,
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
+):
     """Create a new asset"""
     try:
+        # Both lookups are issued before either is awaited so they run together
+        customer_lookup = loaders.customers.load(asset.customer_id)
+        site_lookup = loaders.sites.load(asset.site_id) if asset.site_id else None
+
         # Verify customer exists
-        customer = await db.customers.find_one({"_id": ObjectId(asset.customer_id)})
+        customer = await customer_lookup
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
 
         # For physical hardware, verify site belongs to customer
-        if asset.site_id:
-            site = await db.sites.find_one({"_id": ObjectId(asset.site_id)})
+        if site_lookup is not None:
+            site = await site_lookup
             if not site or site["customer_id"] != asset.customer_id:
                 raise HTTPException(status_code=404, detail="Site not found or doesn't belong to customer")
 
         # Create asset
-        asset_dict = asset.model_dump()
-        result = await db.assets.insert_one(asset_dict)
-        return {"id": str(result.inserted_id), **asset_dict}
+        asset_dict = asset_document(asset.model_dump())
+        asset_dict["fingerprint"] = fingerprint(asset_dict)
+        asset_dict["version"] = INITIAL_VERSION
+        await _ip_conflict(db, asset_dict)
+        await db.assets.insert_one(asset_dict)
+        await counters.increment(db, asset.customer_id, "assets")
+        await history.record(db, [history.inserted(asset_dict)])
+        event_bus.publish("assets", "insert", asset_dict, asset_dict)
+        return to_response(asset_dict)
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid ID format")
 
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc']) or 'body'}: {err['msg']}"
+        for err in error.errors()
+    )
+
+async def _bulk_records(request: Request):
+    """Yield ``(index, record, error)`` from a JSON array or an NDJSON body"""
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type:
+        async for line_number, record, error in iter_ndjson(request.stream()):
+            yield line_number - 1, record, error
+        return
+
+    try:
+        records = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    if not isinstance(records, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    for index, record in enumerate(records):
+        yield index, record, None
+
+async def _ips_in_use(db, documents) -> set:
+    """``(customer_id, ip_numeric)`` pairs of a batch already stored, in one query"""
+    wanted = {}
+    for document in documents:
+        if document.get("ip_numeric") is not None:
+            wanted.setdefault(document["customer_id"], []).append(document["ip_numeric"])
+    if not wanted:
+        return set()
+    query = {"$or": [
+        {"customer_id": customer_id, "ip_numeric": {"$in": keys}}
+        for customer_id, keys in wanted.items()
+    ]}
+    cursor = db.assets.find(query, {"customer_id": 1, "ip_numeric": 1})
+    return {(doc["customer_id"], doc["ip_numeric"]) async for doc in cursor}
+
+async def _insert_batch(db, loaders, batch):
+    """Validate references and insert one batch of ``(index, AssetCreate)`` rows.
+
+    The reference loaders resolve every customer and site of the batch with a
+    single ``$in`` query per collection, IPs already in use are found with one
+    more, and the insert is unordered so one bad row does not stop the rest of
+    the batch.
+    """
+    results = {}
+    customer_ids, site_ids = set(), set()
+    for index, asset in batch:
+        if not ObjectId.is_valid(asset.customer_id) or \
+           (asset.site_id and not ObjectId.is_valid(asset.site_id)):
+            results[index] = BulkAssetResult(index=index, error="Invalid ID format")
+            continue
+        customer_ids.add(asset.customer_id)
+        if asset.site_id:
+            site_ids.add(asset.site_id)
+
+    customer_docs, site_docs = await asyncio.gather(
+        loaders.customers.load_many(customer_ids),
+        loaders.sites.load_many(site_ids),
+    )
+    customers = {str(doc["_id"]) for doc in customer_docs if doc}
+    sites = {str(doc["_id"]): doc["customer_id"] for doc in site_docs if doc}
+
+    candidates = {
+        index: asset_document({**asset.model_dump(), "version": INITIAL_VERSION})
+        for index, asset in batch if index not in results
+    }
+    for document in candidates.values():
+        document["fingerprint"] = fingerprint(document)
+    taken = await _ips_in_use(db, candidates.values())
+
+    rows, documents = [], []
+    for index, asset in batch:
+        if index in results:
+            continue
+        document = candidates[index]
+        ip_key = (document["customer_id"], document.get("ip_numeric"))
+        if asset.customer_id not in customers:
+            results[index] = BulkAssetResult(index=index, error="Customer not found")
+        elif asset.site_id and sites.get(asset.site_id) != asset.customer_id:
+            results[index] = BulkAssetResult(
+                index=index, error="Site not found or doesn't belong to customer"
+            )
+        elif ip_key[1] is not None and ip_key in taken:
+            results[index] = BulkAssetResult(
+                index=index, error=f"IP address {document['ip_address']} is already in use"
+            )
+        else:
+            if ip_key[1] is not None:
+                taken.add(ip_key)
+            rows.append(index)
+            documents.append(document)
+
+    failed = {}
+    if documents:
+        try:
+            await db.assets.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            failed = {err["index"]: err["errmsg"] for err in e.details["writeErrors"]}
+        await counters.increment_many(db, "assets", (
+            document["customer_id"] for position, document in enumerate(documents)
+            if position not in failed
+        ))
+    await history.record(db, [
+        history.inserted(document) for position, document in enumerate(documents)
+        if position not in failed
+    ])
+    for position, (index, document) in enumerate(zip(rows, documents)):
+        if position in failed:
+            results[index] = BulkAssetResult(index=index, error=failed[position])
+        else:
+            results[index] = BulkAssetResult(index=index, id=str(document["_id"]))
+            event_bus.publish("assets", "insert", document, document)
+    return [results[index] for index, _ in batch]
+
+@router.post("/bulk", response_model=BulkAssetResponse)
+async def bulk_create_assets(
+    request: Request,
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
+):
+    """Create many assets from a JSON array or an NDJSON stream of AssetCreate records.
+
+    Every row gets its own result; invalid rows are reported without
+    aborting the others.
+    """
+    results, batch = [], []
+    async for index, record, error in _bulk_records(request):
+        if error is None:
+            try:
+                batch.append((index, AssetCreate.model_validate(record)))
+            except ValidationError as e:
+                error = _validation_message(e)
+        if error is not None:
+            results.append(BulkAssetResult(index=index, error=error))
+        if len(batch) >= settings.bulk_batch_size:
+            results.extend(await _insert_batch(db, loaders, batch))
+            batch = []
+    if batch:
+        results.extend(await _insert_batch(db, loaders, batch))
+
+    results.sort(key=lambda result: result.index)
+    failed = sum(1 for result in results if result.error)
+    return {"inserted": len(results) - failed, "failed": failed, "results": results}
+
 @router.put("/{asset_id}", response_model=AssetInDB)
-async def update_asset(asset_id: str, asset: AssetBase, db=Depends(get_database)):
+async def update_asset(
+    asset_id: str,
+    asset: AssetBase,
+    version: Optional[int] = None,
+    db=Depends(get_database)
+):
     """Update an asset"""
     try:
-        result = await db.assets.update_one(
-            {"_id": ObjectId(asset_id)},
-            {"$set": asset.model_dump()}
-        )
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Asset not found")
-        
-        updated_asset = await db.assets.find_one({"_id": ObjectId(asset_id)})
-        return {"id": asset_id, **{k:v for k,v in updated_asset.items() if k != "_id"}}
+        asset_dict = asset_document(asset.model_dump())
+        asset_dict["fingerprint"] = fingerprint(asset_dict)
+        await _ip_conflict(db, asset_dict, exclude_id=ObjectId(asset_id))
+        updated_asset = await _update(db, asset_id, asset_dict, asset.customer_id, version)
+        return to_response(updated_asset)
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid asset ID format")
 
+@router.patch("/{asset_id}", response_model=AssetInDB)
+async def patch_asset(
+    asset_id: str,
+    asset: AssetPatch,
+    version: Optional[int] = None,
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
+):
+    """Change only the given fields, including single specs fields"""
+    try:
+        object_id = ObjectId(asset_id)
+        update_data = patch_fields(asset, AssetBase)
+        customer_id = update_data.get("customer_id")
+        conditions, conflicts = {}, []
+
+        # Queue the reference lookups before validating the rest
+        customer_lookup = loaders.customers.load(customer_id) if customer_id else None
+        site_id = update_data.get("site_id")
+        site_lookup = loaders.sites.load(site_id) if site_id else None
+
+        asset_type = update_data.get("asset_type")
+        nested = ("specs",)
+        if asset_type is not None:
+            # A new type needs complete specs of that type
+            if "specs" not in update_data:
+                raise HTTPException(status_code=422, detail="specs are required when changing asset_type")
+            try:
+                specs = SPECS_ADAPTERS[asset_type].validate_python(update_data["specs"])
+            except ValidationError as e:
+                raise HTTPException(status_code=422, detail=_validation_message(e))
+            update_data["specs"] = specs.model_dump()
+            nested = ()
+            if asset_type != AssetType.VM and "site_id" not in update_data:
+                if customer_id:
+                    raise HTTPException(status_code=422, detail=f"{asset_type.value} assets require site_id")
+                conditions["site_id"] = {"$ne": None}
+                conflicts.append(f"{asset_type.value} assets require site_id")
+        elif "specs" in update_data:
+            update_data["specs"], types = validate_partial("specs", update_data["specs"], SPECS_BY_TYPE)
+            conditions["asset_type"] = {"$in": [t.value for t in types]}
+            conflicts.append("specs fields do not match the asset type")
+        if "site_id" in update_data and site_id is None:
+            # Only VMs may have no site
+            if asset_type is not None and asset_type != AssetType.VM:
+                raise HTTPException(status_code=422, detail=f"{asset_type.value} assets require site_id")
+            if asset_type is None:
+                types = conditions.get("asset_type", {}).get("$in", [AssetType.VM.value])
+                conditions["asset_type"] = {"$in": [t for t in types if t == AssetType.VM.value]}
+                conflicts.append("Only vm assets may have no site_id")
+        if customer_id and "site_id" not in update_data and "site_id" not in conditions:
+            # The current site belongs to the current customer
+            conditions["site_id"] = None
+            conflicts.append("Assets with a site need a site_id of the new customer")
+
+        if customer_lookup is not None and not await customer_lookup:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        if site_lookup is not None:
+            site = await site_lookup
+            if not site or (customer_id and site["customer_id"] != customer_id):
+                raise HTTPException(status_code=404, detail="Site not found or doesn't belong to customer")
+            if not customer_id:
+                conditions["customer_id"] = site["customer_id"]
+                conflicts.append("Site not found or doesn't belong to customer")
+
+        asset_document(update_data)
+        await _patch_ip_conflict(db, object_id, update_data)
+        changes = set_paths(update_data, nested)
+        # Only some fields are known, so the stored fingerprint no longer applies
+        changes["fingerprint"] = None
+        updated_asset = await _update(
+            db, asset_id, changes, customer_id, version, conditions, "; ".join(conflicts)
+        )
+        return to_response(updated_asset)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid ID format")
+
+async def _patch_ip_conflict(db, asset_id: ObjectId, changes: dict):
+    """``_ip_conflict`` for a change of only the IP or only the customer"""
+    if "ip_address" not in changes and "customer_id" not in changes:
+        return
+    if "ip_address" in changes and "customer_id" in changes:
+        return await _ip_conflict(db, changes, exclude_id=asset_id)
+    current = await db.assets.find_one(
+        {"_id": asset_id}, {"customer_id": 1, "ip_address": 1, "ip_numeric": 1}
+    )
+    if current is not None:
+        await _ip_conflict(db, {**current, **changes}, exclude_id=asset_id)
+
+async def _update(
+    db, asset_id: str, changes: dict, customer_id: Optional[str], version: Optional[int],
+    conditions=None, conflict=None
+):
+    previous = await update_counted_document(
+        db, "assets", asset_id, changes, customer_id,
+        version=version,
+        conditions=conditions,
+        projection=hidden(ASSET_INTERNAL_FIELDS),
+        not_found="Asset not found",
+        conflict=conflict,
+        return_document=ReturnDocument.BEFORE,
+    )
+    # History keeps only the fields the update actually changed
+    updated = history.applied(previous, changes)
+    entry = history.updated(updated, history.changed(previous, changes))
+    await history.record(db, [entry] if entry else [])
+    event_bus.publish("assets", "update", updated, changes)
+    return updated
+
 @router.delete("/{asset_id}")
 async def delete_asset(asset_id: str, db=Depends(get_database)):
     """Delete an asset"""
     try:
-        result = await db.assets.delete_one({"_id": ObjectId(asset_id)})
-        if result.deleted_count == 0:
+        deleted = await db.assets.find_one_and_delete(
+            {"_id": ObjectId(asset_id)},
+            projection={"customer_id": 1, "version": 1}
+        )
+        if deleted is None:
             raise HTTPException(status_code=404, detail="Asset not found")
+        await counters.increment(db, deleted["customer_id"], "assets", -1)
+        await history.record(db, [history.deleted(deleted)])
+        event_bus.publish("assets", "delete", deleted)
         return {"message": "Asset deleted successfully"}
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid asset ID format")
 
-@router.get("/site/{site_id}", response_model=List[AssetInDB])
-async def get_assets_by_site(site_id: str, db=Depends(get_database)):
+@router.get("/site/{site_id}", response_model=List[AssetExpanded])
+async def get_assets_by_site(
+    site_id: str,
+    page: PageParams = Depends(),
+    names: List[str] = Depends(expand_param(ASSET_REFERENCES)),
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
+):
     """Get all assets for a specific site"""
     try:
-        assets = await db.assets.find({"site_id": site_id}).to_list(None)
-        return [{
-            "id": str(asset["_id"]), 
-            **{k:v for k,v in asset.items() if k != "_id"}
-        } for asset in assets]
+        assets, next_cursor = await fetch_page(
+            db.assets, {"site_id": site_id}, page, SORTABLE_FIELDS, AssetBase.model_fields,
+            ASSET_INTERNAL_FIELDS, reference_paths(names, ASSET_REFERENCES)
+        )
+        items = [to_response(asset, AssetExpanded.model_fields) for asset in assets]
+        await expand(items, names, ASSET_REFERENCES, loaders, page.fields)
+        return page_response(items, next_cursor)
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid site ID format")
@@ -1,35 +1,58 @@
+import asyncio
+import functools
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 from bson import ObjectId
 from bson.errors import InvalidId
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from pymongo.errors import DuplicateKeyError
 
-from ..database import get_database
-from ..schemas.customer import CustomerCreate, CustomerResponse, CustomerUpdate
+from .. import history, jobs
+from ..cache import response_cache
+from ..config import settings
+from ..counters import initial_counts
+from ..database import get_database, get_loaders
+from ..documents import LIVE_CUSTOMERS
+from ..events import event_bus
+from ..jobs import delete_in_batches
+from ..models.customer import AddressModel
+from ..pagination import PageParams, fetch_page, page_response
+from ..schemas.customer import (CustomerBase, CustomerCreate, CustomerPatch,
+                                CustomerResponse, CustomerSummary,
+                                CustomerTopology, CustomerUpdate)
+from ..schemas.job import JobResponse
+from ..serialization import ORJSONResponse, to_response
+from ..topology import build_topology, customer_branch, topology_pipeline
+from ..updates import (INITIAL_VERSION, is_complete, patch_fields,
+                       set_paths, update_document, validate_partial)
+from .jobs import accepted_once
 
 router = APIRouter()
 
+SORTABLE_FIELDS = ("name",)
+
 @router.post("/", response_model=CustomerResponse)
 async def create_customer(customer: CustomerCreate, db=Depends(get_database)):
     try:
-        # Check if customer already exists with same name and email
-        existing_customer = await db.customers.find_one({
-            "name": customer.name,
-            "contact_email": customer.contact_email
-        })
-
-        if existing_customer:
-            # Return existing customer if found
-            return {
-                "id": str(existing_customer["_id"]),
-                **{k:v for k,v in existing_customer.items() if k != "_id"}
-            }
-
-        # Create new customer if no match found
         customer_dict = customer.model_dump()
-        customer_result = await db.customers.insert_one(customer_dict)
+        customer_dict["counts"] = initial_counts(sites=1 if customer.address else 0)
+        customer_dict["version"] = INITIAL_VERSION
+        try:
+            customer_result = await db.customers.insert_one(customer_dict)
+        except DuplicateKeyError:
+            # The unique (name, contact_email) index matched an existing
+            # customer: return it instead of creating a duplicate
+            existing_customer = await db.customers.find_one({
+                "name": customer.name,
+                "contact_email": customer.contact_email
+            })
+            if existing_customer is not None:
+                return to_response(existing_customer)
+            # The clashing customer was deleted in the meantime
+            customer_result = await db.customers.insert_one(customer_dict)
         customer_id = str(customer_result.inserted_id)
+        event_bus.publish("customers", "insert", customer_dict, customer_dict)
 
         # If address exists, create initial site
         if customer.address:
@@ -40,13 +63,12 @@ async def create_customer(customer: CustomerCreate, db=Depends(get_database)):
                 "customer_id": customer_id,
                 "added": datetime.now(),
                 "is_primary": True,
+                "version": INITIAL_VERSION,
             }
             await db.sites.insert_one(site_data)
+            event_bus.publish("sites", "insert", site_data, site_data)
 
-        return {
-            "id": customer_id,
-            **customer_dict
-        }
+        return to_response(customer_dict)
     except Exception as e:
         # If there's an error, try to rollback by deleting the customer
         if 'customer_id' in locals():
@@ -58,77 +80,228 @@ async def create_customer(customer: CustomerCreate, db=Depends(get_database)):
         )
 
 @router.get("/", response_model=List[CustomerResponse])
-async def get_customers(db=Depends(get_database)):
-    customers = await db.customers.find().to_list(None)
-    return [{"id": str(customer["_id"]), **{k:v for k,v in customer.items() if k != "_id"}} 
-            for customer in customers]
+async def get_customers(
+    page: PageParams = Depends(),
+    db=Depends(get_database)
+):
+    customers, next_cursor = await fetch_page(
+        db.customers, dict(LIVE_CUSTOMERS), page, SORTABLE_FIELDS, CustomerCreate.model_fields
+    )
+    items = [to_response(customer, CustomerResponse.model_fields) for customer in customers]
+    return page_response(items, next_cursor)
 
 @router.get("/{customer_id}", response_model=CustomerResponse)
-async def get_customer(customer_id: str, db=Depends(get_database)):
+async def get_customer(customer_id: str, loaders=Depends(get_loaders)):
     try:
-        customer = await db.customers.find_one({"_id": ObjectId(customer_id)})
+        customer = await loaders.customers.load(customer_id)
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
-        return {"id": str(customer["_id"]), **{k:v for k,v in customer.items() if k != "_id"}}
+        return to_response(customer)
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid customer ID format")
 
-@router.put("/{customer_id}", response_model=CustomerResponse)
-async def update_customer(customer_id: str, customer: CustomerUpdate, db=Depends(get_database)):
+def _summary_pipeline(customer_id: str) -> list:
+    """One aggregation over the customer and everything that references it.
+
+    The customer's sites, assets and infrastructure are pulled in with
+    ``$unionWith`` (each branch matching on the indexed ``customer_id``),
+    tagged with their kind and then counted by a single ``$facet``.
+    """
+    def count_by(kind, key, match=None):
+        return [
+            {"$match": {"_kind": kind, **(match or {})}},
+            {"$group": {"_id": key, "count": {"$sum": 1}}},
+        ]
+
+    return [
+        {"$match": {"_id": ObjectId(customer_id), **LIVE_CUSTOMERS}},
+        {"$project": {"_kind": {"$literal": "customer"}, "name": 1}},
+        customer_branch("sites", "site", customer_id, ["name"]),
+        customer_branch("assets", "asset", customer_id, [
+            "asset_type", "site_id", "specs.infrastructure_location_id",
+            "specs.cpu_cores", "specs.ram_gb",
+        ]),
+        customer_branch("infrastructure", "infrastructure", customer_id, ["type", "is_active"]),
+        {"$facet": {
+            "customer": [{"$match": {"_kind": "customer"}}, {"$project": {"name": 1}}],
+            "sites": [{"$match": {"_kind": "site"}}, {"$project": {"name": 1}}],
+            "assets_by_type": count_by("asset", "$asset_type"),
+            "assets_by_site": count_by("asset", "$site_id", {"site_id": {"$ne": None}}),
+            "infrastructure_by_type": count_by("infrastructure", "$type"),
+            "infrastructure_by_status": count_by("infrastructure", "$is_active"),
+            "vm_capacity": [
+                {"$match": {"_kind": "asset", "asset_type": "vm"}},
+                {"$group": {
+                    "_id": "$specs.infrastructure_location_id",
+                    "vms": {"$sum": 1},
+                    "cpu_cores": {"$sum": "$specs.cpu_cores"},
+                    "ram_gb": {"$sum": "$specs.ram_gb"},
+                }},
+                {"$sort": {"_id": 1}},
+            ],
+        }},
+    ]
+
+@router.get("/{customer_id}/summary", response_model=CustomerSummary)
+async def get_customer_summary(customer_id: str, db=Depends(get_database)):
+    """Asset, site and infrastructure counts for one customer in a single round trip"""
     try:
-        # Check if another customer already exists with the same name and email
-        if customer.name is not None and customer.contact_email is not None:
-            existing_customer = await db.customers.find_one({
-                "_id": {"$ne": ObjectId(customer_id)},
-                "name": customer.name,
-                "contact_email": customer.contact_email
-            })
-            if existing_customer:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Another customer with the same name and email already exists"
-                )
+        pipeline = _summary_pipeline(customer_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid customer ID format")
+
+    [facets] = await db.customers.aggregate(pipeline).to_list(None)
+    if not facets["customer"]:
+        raise HTTPException(status_code=404, detail="Customer not found")
+
+    def counts(facet):
+        return {str(row["_id"]): row["count"] for row in facets[facet]}
+
+    assets_by_type = counts("assets_by_type")
+    infrastructure_by_type = counts("infrastructure_by_type")
+    status = {row["_id"]: row["count"] for row in facets["infrastructure_by_status"]}
+    site_names = {str(site["_id"]): site["name"] for site in facets["sites"]}
+    assets_by_site = counts("assets_by_site")
+    return {
+        "customer_id": customer_id,
+        "name": facets["customer"][0]["name"],
+        "sites_total": len(site_names),
+        "assets_total": sum(assets_by_type.values()),
+        "assets_by_type": assets_by_type,
+        "assets_by_site": [
+            {"site_id": site_id, "name": site_names.get(site_id), "assets": assets_by_site.get(site_id, 0)}
+            for site_id in {**site_names, **assets_by_site}
+        ],
+        "infrastructure_total": sum(infrastructure_by_type.values()),
+        "infrastructure_by_type": infrastructure_by_type,
+        "infrastructure_active": status.get(True, 0),
+        "infrastructure_inactive": status.get(False, 0),
+        "vm_capacity": [
+            {"infrastructure_location_id": row["_id"], "vms": row["vms"],
+             "cpu_cores": row["cpu_cores"], "ram_gb": row["ram_gb"]}
+            for row in facets["vm_capacity"]
+        ],
+    }
+
+@router.get("/{customer_id}/topology", response_model=CustomerTopology)
+async def get_customer_topology(customer_id: str, db=Depends(get_database)):
+    """Sites, infrastructure and assets of a customer as an adjacency list, in one aggregation"""
+    try:
+        pipeline = topology_pipeline(customer_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid customer ID format")
 
+    topology = build_topology(await db.customers.aggregate(pipeline).to_list(None))
+    if topology is None:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    # Built from validated documents; large customers have many nodes to revalidate
+    return ORJSONResponse(topology)
+
+@router.put("/{customer_id}", response_model=CustomerResponse)
+async def update_customer(
+    customer_id: str,
+    customer: CustomerUpdate,
+    version: Optional[int] = None,
+    db=Depends(get_database)
+):
+    try:
         update_data = {k: v for k, v in customer.dict().items() if v is not None}
-        result = await db.customers.update_one(
-            {"_id": ObjectId(customer_id)},
-            {"$set": update_data}
-        )
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Customer not found")
-        
-        updated_customer = await db.customers.find_one({"_id": ObjectId(customer_id)})
-        return {"id": str(updated_customer["_id"]), **{k:v for k,v in updated_customer.items() if k != "_id"}}
+        return to_response(await _update(db, customer_id, update_data, version))
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid customer ID format")
+
+@router.patch("/{customer_id}", response_model=CustomerResponse)
+async def patch_customer(
+    customer_id: str,
+    customer: CustomerPatch,
+    version: Optional[int] = None,
+    db=Depends(get_database)
+):
+    """Change only the given fields, including single address fields"""
+    try:
+        update_data = patch_fields(customer, CustomerBase)
+        conditions = {}
+        address = update_data.get("address")
+        if address is not None:
+            update_data["address"], _ = validate_partial("address", address, {None: AddressModel})
+            if not is_complete(address, AddressModel):
+                # Dotted paths into a missing address would create a partial one
+                conditions["address"] = {"$type": "object"}
+        return to_response(await _update(db, customer_id, set_paths(update_data, ("address",)), version, conditions))
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid customer ID format")
 
-@router.delete("/{customer_id}")
-async def delete_customer(customer_id: str, db=Depends(get_database)):
+async def _update(db, customer_id: str, changes: dict, version: Optional[int], conditions=None):
+    try:
+        updated = await update_document(
+            db.customers, customer_id, changes,
+            version=version,
+            conditions=conditions,
+            not_found="Customer not found",
+            conflict="Customer has no address yet, send the complete address",
+        )
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=400,
+            detail="Another customer with the same name and email already exists"
+        )
+    event_bus.publish("customers", "update", updated, changes)
+    return updated
+
+@jobs.handler("delete_customer")
+async def delete_customer_job(db, params: dict, report):
+    """Delete the assets, infrastructure and sites of a customer, then the customer.
+
+    The customer is first marked ``deleting``, so the loaders treat it as
+    missing and nothing new can be created for it; the dependent collections
+    are then emptied in batches, concurrently. It is removed last, so a job
+    that fails part way leaves it in place to be deleted again, and running
+    the job twice is harmless.
+    """
+    customer_id = params["customer_id"]
+    await db.customers.update_one({"_id": ObjectId(customer_id)}, {"$set": {"deleting": True}})
+    response_cache.invalidate("customers")
+
+    async def assets_deleted(assets):
+        await history.record(db, [history.deleted({**asset, "customer_id": customer_id}) for asset in assets])
+
+    collections = ("assets", "infrastructure", "sites")
+    deleted = await asyncio.gather(*(
+        delete_in_batches(
+            db[collection], {"customer_id": customer_id}, settings.job_batch_size,
+            report=functools.partial(report, collection),
+            on_delete=assets_deleted if collection == "assets" else None,
+        )
+        for collection in collections
+    ))
+    await db.customers.delete_one({"_id": ObjectId(customer_id)})
+    response_cache.invalidate("customers", *collections)
+    # One event for the cascade; subscribers drop the customer's documents
+    event_bus.publish("customers", "delete", {"_id": customer_id})
+    return dict(zip(collections, deleted))
+
+@router.delete("/{customer_id}", response_model=JobResponse, status_code=202)
+async def delete_customer(
+    customer_id: str,
+    response: Response,
+    db=Depends(get_database)
+):
     """
-    Delete a customer and all associated data (sites, infrastructure).
+    Delete a customer and all associated data (sites, infrastructure, assets).
+
+    The deletion runs as a background job; poll the returned status_url.
+    Deleting the customer again while it runs returns the same job, and a
+    customer whose deletion failed part way can be deleted again.
     """
     try:
-        # Check if customer exists
-        customer = await db.customers.find_one({"_id": ObjectId(customer_id)})
+        # Marked here, including one already being deleted, so the customer
+        # leaves the lists as soon as its deletion is accepted
+        customer = await db.customers.find_one_and_update(
+            {"_id": ObjectId(customer_id)}, {"$set": {"deleting": True}}, {"_id": 1}
+        )
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
-
-        # Delete all infrastructure associated with this customer
-        await db.infrastructure.delete_many({"customer_id": customer_id})
-        
-        # Delete all sites associated with this customer
-        await db.sites.delete_many({"customer_id": customer_id})
-        
-        # Finally delete the customer
-        result = await db.customers.delete_one({"_id": ObjectId(customer_id)})
-        
-        return {
-            "message": "Customer and all associated data deleted successfully",
-            "deleted": {
-                "customer": True,
-                "sites": True,
-                "infrastructure": True
-            }
-        }
+        response_cache.invalidate("customers")
+        return await accepted_once(db, response, "delete_customer", {"customer_id": customer_id})
     except InvalidId:
-        raise HTTPException(status_code=400, detail="Invalid customer ID")
\ No newline at end of file
+        raise HTTPException(status_code=400, detail="Invalid customer ID")
@@ -0,0 +1,85 @@
+import asyncio
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, WebSocket
+from fastapi.responses import StreamingResponse
+
+from ..config import settings
+from ..events import COLLECTIONS, event_bus
+
+router = APIRouter(prefix="/events")
+
+
+def _collections(collections: Optional[str]) -> Tuple[str, ...]:
+    if not collections:
+        return COLLECTIONS
+    names = tuple(name.strip() for name in collections.split(",") if name.strip())
+    unknown = [name for name in names if name not in COLLECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown collections: {', '.join(unknown)}")
+    return names
+
+
+@router.get("")
+async def stream_events(customer_id: Optional[str] = None, collections: Optional[str] = None):
+    """Server-sent change events, optionally for one customer and some collections.
+
+    Each ``change`` event's data is a JSON object with the document id,
+    collection, operation and changed fields. A ``dropped`` event tells a
+    client that fell behind how many events it missed, so it can refetch.
+    """
+    subscription = event_bus.subscribe(customer_id, _collections(collections))
+
+    async def events():
+        dropped = 0
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    payload = await asyncio.wait_for(subscription.get(), settings.events_heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield b": keepalive\n\n"
+                    continue
+                if subscription.dropped != dropped:
+                    yield f"event: dropped\ndata: {subscription.dropped - dropped}\n\n".encode()
+                    dropped = subscription.dropped
+                yield b"event: change\ndata: " + payload + b"\n\n"
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+async def websocket_events(websocket: WebSocket, customer_id: Optional[str] = None, collections: Optional[str] = None):
+    """The change events of ``GET /events`` as WebSocket text messages"""
+    try:
+        names = _collections(collections)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    await websocket.accept()
+    subscription = event_bus.subscribe(customer_id, names)
+
+    async def forward():
+        dropped = 0
+        while True:
+            payload = await subscription.get()
+            if subscription.dropped != dropped:
+                await websocket.send_json({"dropped": subscription.dropped - dropped})
+                dropped = subscription.dropped
+            await websocket.send_text(payload.decode())
+
+    sender = asyncio.create_task(forward())
+    try:
+        # Clients only listen; reading is how a disconnect is noticed
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        sender.cancel()
+        event_bus.unsubscribe(subscription)
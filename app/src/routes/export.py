@@ -0,0 +1,170 @@
+import csv
+import io
+from datetime import datetime
+from enum import Enum
+from typing import Optional, get_args
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from ..config import settings
+from ..database import get_database
+from ..documents import ASSET_INTERNAL_FIELDS, LIVE_CUSTOMERS, hidden
+from ..pagination import default_sort
+from ..schemas.asset import AssetBase
+from ..schemas.customer import CustomerBase
+from ..schemas.infrastructure import InfrastructureBase
+from ..schemas.site import SiteBase
+from ..serialization import encode, to_response
+from .assets import SORTABLE_FIELDS as ASSET_SORTABLE_FIELDS
+from .assets import asset_filters
+from .infrastructure import infrastructure_filters
+from .sites import site_filters
+
+router = APIRouter(prefix="/export")
+
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+
+def _nested_models(annotation):
+    """Yield the pydantic models referenced by a field annotation."""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        yield annotation
+        return
+    for arg in get_args(annotation):
+        yield from _nested_models(arg)
+
+
+def csv_columns(model, prefix: str = "") -> list:
+    """Flatten a schema into dotted column names, merging union members."""
+    columns = []
+    for name, field in model.model_fields.items():
+        nested = list(_nested_models(field.annotation))
+        if not nested:
+            columns.append(prefix + name)
+            continue
+        for nested_model in nested:
+            for column in csv_columns(nested_model, f"{prefix}{name}."):
+                if column not in columns:
+                    columns.append(column)
+    return columns
+
+
+def _flatten(doc: dict, prefix: str = "", out: Optional[dict] = None) -> dict:
+    out = {} if out is None else out
+    for key, value in doc.items():
+        if isinstance(value, dict):
+            _flatten(value, f"{prefix}{key}.", out)
+        elif isinstance(value, datetime):
+            out[prefix + key] = value.isoformat()
+        else:
+            out[prefix + key] = value
+    return out
+
+
+async def _stream(cursor, format: ExportFormat, model, batch_size: int):
+    """Encode documents one cursor batch at a time.
+
+    The Motor cursor fetches ``batch_size`` documents per round trip and each
+    batch is written out before the next is requested, so memory use does not
+    grow with the size of the export.
+    """
+    buffer = io.StringIO() if format == ExportFormat.CSV else io.BytesIO()
+    writer = None
+    if format == ExportFormat.CSV:
+        writer = csv.DictWriter(
+            buffer, fieldnames=["id"] + csv_columns(model), extrasaction="ignore"
+        )
+        writer.writeheader()
+
+    fields = {"id", *model.model_fields}
+    pending = 0
+    async for doc in cursor:
+        doc = to_response(doc, fields)
+        if writer:
+            writer.writerow(_flatten(doc))
+        else:
+            buffer.write(encode(doc))
+            buffer.write(b"\n")
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _export(collection, query: dict, format: ExportFormat, model, batch_size: int, projection=None, sortable=()):
+    # In the order a list page would use, so a range filter streams off its index
+    sort = [(field, 1) for field in dict.fromkeys([default_sort(query, sortable), "_id"])]
+    cursor = collection.find(query, projection).sort(sort).batch_size(batch_size)
+    filename = f"{collection.name}.{format.value}"
+    return StreamingResponse(
+        _stream(cursor, format, model, batch_size),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+batch_size_param = Query(settings.export_batch_size, ge=1, le=10000)
+
+
+@router.get("/assets")
+async def export_assets(
+    query: dict = Depends(asset_filters),
+    site_id: Optional[str] = None,
+    format: ExportFormat = ExportFormat.NDJSON,
+    batch_size: int = batch_size_param,
+    db=Depends(get_database)
+):
+    """Stream every asset matching the list filters"""
+    if site_id:
+        query["site_id"] = site_id
+    return _export(
+        db.assets, query, format, AssetBase, batch_size, hidden(ASSET_INTERNAL_FIELDS), ASSET_SORTABLE_FIELDS
+    )
+
+
+@router.get("/sites")
+async def export_sites(
+    query: dict = Depends(site_filters),
+    format: ExportFormat = ExportFormat.NDJSON,
+    batch_size: int = batch_size_param,
+    db=Depends(get_database)
+):
+    """Stream every site matching the list filters"""
+    return _export(db.sites, query, format, SiteBase, batch_size)
+
+
+@router.get("/infrastructure")
+async def export_infrastructure(
+    query: dict = Depends(infrastructure_filters),
+    format: ExportFormat = ExportFormat.NDJSON,
+    batch_size: int = batch_size_param,
+    db=Depends(get_database)
+):
+    """Stream every infrastructure location matching the list filters"""
+    return _export(db.infrastructure, query, format, InfrastructureBase, batch_size)
+
+
+@router.get("/customers")
+async def export_customers(
+    format: ExportFormat = ExportFormat.NDJSON,
+    batch_size: int = batch_size_param,
+    db=Depends(get_database)
+):
+    """Stream every customer"""
+    return _export(db.customers, dict(LIVE_CUSTOMERS), format, CustomerBase, batch_size)
@@ -3,146 +3,233 @@ from typing import List, Optional
 from bson import ObjectId
 from bson.errors import InvalidId
 from fastapi import APIRouter, Depends, HTTPException
+from pydantic import ValidationError
 
-from ..database import get_database
-from ..models.infrastructure import LocationType
-from ..schemas.infrastructure import (InfrastructureCreate, InfrastructureInDB,
-                                      InfrastructureUpdate)
+from .. import counters
+from ..database import get_database, get_loaders
+from ..events import event_bus
+from ..expand import (INFRASTRUCTURE_REFERENCES, expand, expand_param,
+                      reference_paths)
+from ..models.infrastructure import CONFIG_BY_TYPE, LocationType
+from ..pagination import PageParams, fetch_page, page_response
+from ..schemas.infrastructure import (CONFIG_ADAPTERS, InfrastructureBase,
+                                      InfrastructureCreate,
+                                      InfrastructureExpanded,
+                                      InfrastructureImpact, InfrastructureInDB,
+                                      InfrastructurePatch, InfrastructureUpdate)
+from ..serialization import ORJSONResponse, to_response
+from ..topology import build_impact, impact_pipeline
+from ..updates import (INITIAL_VERSION, patch_fields, set_paths,
+                       update_document, validate_partial)
 
 router = APIRouter()
 
+SORTABLE_FIELDS = ("type", "customer_id", "site_id")
+
 @router.post("/", response_model=InfrastructureInDB)
 async def create_infrastructure(
     infrastructure: InfrastructureCreate,
-    db=Depends(get_database)
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
 ):
     try:
+        # Queue the customer and site lookups together so they are batched
+        # into the same tick, then validate them in order
+        customer_lookup = loaders.customers.load(infrastructure.customer_id)
+
+        # Validate site_id for on-premise locations; the schema has already
+        # rejected on-premise locations without one
+        site_lookup = None
+        if infrastructure.type == LocationType.ON_PREMISE:
+            try:
+                site_lookup = loaders.sites.load(infrastructure.site_id)
+            except InvalidId:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid site_id format: {infrastructure.site_id}"
+                )
+
         # Validate customer exists
-        customer_id = ObjectId(infrastructure.customer_id)
-        customer = await db.customers.find_one({"_id": customer_id})
+        customer = await customer_lookup
         if not customer:
             raise HTTPException(
                 status_code=404,
                 detail=f"Customer with ID {infrastructure.customer_id} not found"
             )
 
-        # Validate site_id for on-premise locations
-        if infrastructure.type == LocationType.ON_PREMISE:
-            if not infrastructure.site_id:
+        if site_lookup is not None:
+            site = await site_lookup
+            if not site:
                 raise HTTPException(
-                    status_code=400,
-                    detail="site_id is required for on-premise locations"
+                    status_code=404,
+                    detail=f"Site with ID {infrastructure.site_id} not found"
                 )
-            try:
-                site_id = ObjectId(infrastructure.site_id)
-                site = await db.sites.find_one({"_id": site_id})
-                if not site:
-                    raise HTTPException(
-                        status_code=404,
-                        detail=f"Site with ID {infrastructure.site_id} not found"
-                    )
-                # Verify site belongs to the customer
-                if site.get('customer_id') != infrastructure.customer_id:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Site does not belong to the specified customer"
-                    )
-            except InvalidId:
+            # Verify site belongs to the customer
+            if site.get('customer_id') != infrastructure.customer_id:
                 raise HTTPException(
                     status_code=400,
-                    detail=f"Invalid site_id format: {infrastructure.site_id}"
+                    detail="Site does not belong to the specified customer"
                 )
 
         infra_dict = infrastructure.model_dump()
-        result = await db.infrastructure.insert_one(infra_dict)
-        return {"id": str(result.inserted_id), **infra_dict}
+        infra_dict["version"] = INITIAL_VERSION
+        await db.infrastructure.insert_one(infra_dict)
+        await counters.increment(db, infrastructure.customer_id, "infrastructure")
+        event_bus.publish("infrastructure", "insert", infra_dict, infra_dict)
+        return to_response(infra_dict)
     except InvalidId:
         raise HTTPException(
             status_code=400,
             detail=f"Invalid customer_id format: {infrastructure.customer_id}"
         )
 
-@router.get("/", response_model=List[InfrastructureInDB])
-async def get_infrastructure(
+def infrastructure_filters(
     customer_id: Optional[str] = None,
     site_id: Optional[str] = None,
     location_type: Optional[LocationType] = None,
-    db=Depends(get_database)
-):
+) -> dict:
+    """Build the Mongo filter shared by the infrastructure list and export routes"""
     query = {}
     if customer_id:
         query["customer_id"] = customer_id
     if site_id:
         query["site_id"] = site_id
     if location_type:
-        query["type"] = location_type
+        query["type"] = location_type.value
+    return query
+
+@router.get("/", response_model=List[InfrastructureExpanded])
+async def get_infrastructure(
+    query: dict = Depends(infrastructure_filters),
+    page: PageParams = Depends(),
+    names: List[str] = Depends(expand_param(INFRASTRUCTURE_REFERENCES)),
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
+):
+    infrastructure, next_cursor = await fetch_page(
+        db.infrastructure, query, page, SORTABLE_FIELDS, InfrastructureBase.model_fields,
+        include=reference_paths(names, INFRASTRUCTURE_REFERENCES)
+    )
+    items = [to_response(infra, InfrastructureExpanded.model_fields) for infra in infrastructure]
+    await expand(items, names, INFRASTRUCTURE_REFERENCES, loaders, page.fields)
+    return page_response(items, next_cursor)
+
+@router.get("/{infrastructure_id}/impact", response_model=InfrastructureImpact)
+async def get_infrastructure_impact(infrastructure_id: str, db=Depends(get_database)):
+    """The site of a location and every asset it hosts, in one aggregation"""
+    try:
+        pipeline = impact_pipeline(infrastructure_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid infrastructure ID format")
 
-    infrastructure = await db.infrastructure.find(query).to_list(None)
-    return [
-        {
-            "id": str(infra["_id"]), 
-            **{k:v for k,v in infra.items() if k != "_id"}
-        }
-        for infra in infrastructure
-    ]
+    impact = build_impact(await db.infrastructure.aggregate(pipeline).to_list(None))
+    if impact is None:
+        raise HTTPException(status_code=404, detail="Infrastructure location not found")
+    return ORJSONResponse(impact)
 
 @router.put("/{infrastructure_id}", response_model=InfrastructureInDB)
 async def update_infrastructure(
     infrastructure_id: str,
     infrastructure: InfrastructureUpdate,
-    db=Depends(get_database)
+    version: Optional[int] = None,
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
 ):
     try:
-        # First get the existing infrastructure
-        existing = await db.infrastructure.find_one({"_id": ObjectId(infrastructure_id)})
-        if not existing:
-            raise HTTPException(status_code=404, detail="Infrastructure location not found")
-
         update_data = {k: v for k, v in infrastructure.model_dump().items() if v is not None}
+        conditions = {}
 
-        # If updating site_id for on-premise location, validate it
-        if ('type' in update_data and update_data['type'] == LocationType.ON_PREMISE) or \
-           (existing['type'] == LocationType.ON_PREMISE):
-            if 'site_id' in update_data:
-                try:
-                    site_id = ObjectId(update_data['site_id'])
-                    site = await db.sites.find_one({"_id": site_id})
-                    if not site:
-                        raise HTTPException(
-                            status_code=404,
-                            detail=f"Site with ID {update_data['site_id']} not found"
-                        )
-                    # Verify site belongs to the customer
-                    if site.get('customer_id') != existing['customer_id']:
-                        raise HTTPException(
-                            status_code=400,
-                            detail="Site does not belong to the specified customer"
-                        )
-                except InvalidId:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"Invalid site_id format: {update_data['site_id']}"
-                    )
-
-        result = await db.infrastructure.update_one(
-            {"_id": ObjectId(infrastructure_id)},
-            {"$set": update_data}
+        # The update carries no type, so require the stored one to be a type
+        # the config is valid for instead of reading it first
+        if 'config' in update_data:
+            conditions['type'] = {'$in': [
+                location_type.value for location_type, adapter in CONFIG_ADAPTERS.items()
+                if _accepts(adapter, update_data['config'])
+            ]}
+        if 'site_id' in update_data:
+            conditions.update(await _site_condition(loaders, update_data['site_id']))
+
+        return to_response(await _update(db, infrastructure_id, update_data, version, conditions))
+    except InvalidId:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid infrastructure_id format: {infrastructure_id}"
         )
-        
-        updated = await db.infrastructure.find_one({"_id": ObjectId(infrastructure_id)})
-        return {"id": str(updated["_id"]), **{k:v for k,v in updated.items() if k != "_id"}}
+
+@router.patch("/{infrastructure_id}", response_model=InfrastructureInDB)
+async def patch_infrastructure(
+    infrastructure_id: str,
+    infrastructure: InfrastructurePatch,
+    version: Optional[int] = None,
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
+):
+    """Change only the given fields, including single config fields"""
+    try:
+        update_data = patch_fields(infrastructure, InfrastructureBase)
+        conditions = {}
+        if 'config' in update_data:
+            update_data['config'], types = validate_partial('config', update_data['config'], CONFIG_BY_TYPE)
+            conditions['type'] = {'$in': [location_type.value for location_type in types]}
+        if update_data.get('site_id') is not None:
+            conditions.update(await _site_condition(loaders, update_data['site_id']))
+        elif 'site_id' in update_data:
+            # On-premise locations keep their site
+            types = conditions.get('type', {}).get('$in', [location_type.value for location_type in LocationType])
+            conditions['type'] = {'$in': [t for t in types if t != LocationType.ON_PREMISE.value]}
+
+        changes = set_paths(update_data, ('config',))
+        return to_response(await _update(db, infrastructure_id, changes, version, conditions))
     except InvalidId:
         raise HTTPException(
             status_code=400,
             detail=f"Invalid infrastructure_id format: {infrastructure_id}"
         )
 
+def _accepts(adapter, value) -> bool:
+    try:
+        adapter.validate_python(value)
+        return True
+    except ValidationError:
+        return False
+
+async def _site_condition(loaders, site_id: str) -> dict:
+    """Filter condition tying the location to the customer of ``site_id``"""
+    try:
+        site = await loaders.sites.load(site_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail=f"Invalid site_id format: {site_id}")
+    if not site:
+        raise HTTPException(status_code=404, detail=f"Site with ID {site_id} not found")
+    return {'customer_id': site['customer_id']}
+
+CONFLICTS = {
+    'type': "config or a cleared site_id does not match the location type",
+    'customer_id': "Site does not belong to the location's customer",
+}
+
+async def _update(db, infrastructure_id: str, changes: dict, version: Optional[int], conditions: dict):
+    updated = await update_document(
+        db.infrastructure, infrastructure_id, changes,
+        version=version,
+        conditions=conditions,
+        not_found="Infrastructure location not found",
+        conflict="; ".join(CONFLICTS[field] for field in conditions),
+    )
+    event_bus.publish("infrastructure", "update", updated, changes)
+    return updated
+
 @router.delete("/{infrastructure_id}")
 async def delete_infrastructure(infrastructure_id: str, db=Depends(get_database)):
     try:
-        result = await db.infrastructure.delete_one({"_id": ObjectId(infrastructure_id)})
-        if result.deleted_count == 0:
+        deleted = await db.infrastructure.find_one_and_delete(
+            {"_id": ObjectId(infrastructure_id)},
+            projection={"customer_id": 1}
+        )
+        if deleted is None:
             raise HTTPException(status_code=404, detail="Infrastructure location not found")
+        await counters.increment(db, deleted["customer_id"], "infrastructure", -1)
+        event_bus.publish("infrastructure", "delete", deleted)
         return {"message": "Infrastructure location deleted successfully"}
     except InvalidId:
         raise HTTPException(
@@ -0,0 +1,114 @@
+from typing import List, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+
+from .. import counters, jobs
+from ..cache import response_cache
+from ..database import get_database
+from ..documents import backfill_assets
+from ..jobs import JobStatus, job_runner
+from ..schemas.job import JobResponse
+
+router = APIRouter(prefix="/jobs")
+
+
+def job_response(job: dict) -> dict:
+    job = dict(job)
+    job["id"] = str(job.pop("_id"))
+    job["status_url"] = f"/jobs/{job['id']}"
+    return job
+
+
+async def accepted(response: Response, kind: str, params: dict) -> dict:
+    """Queue a job and describe it in a 202 response"""
+    job = job_response(await job_runner.submit(kind, params))
+    response.status_code = 202
+    response.headers["Location"] = job["status_url"]
+    return job
+
+
+async def accepted_once(db, response: Response, kind: str, params: dict) -> dict:
+    """Like ``accepted``, but describe the queued or running job with the same params if there is one"""
+    pending = await db.jobs.find_one({
+        "kind": kind,
+        "status": {"$in": [JobStatus.QUEUED.value, JobStatus.RUNNING.value]},
+        **{f"params.{name}": value for name, value in params.items()},
+    }, {"heartbeat": 0})
+    if pending is None:
+        return await accepted(response, kind, params)
+    job = job_response(pending)
+    response.status_code = 202
+    response.headers["Location"] = job["status_url"]
+    return job
+
+
+@jobs.handler("recount_counters")
+async def recount_counters(db, params: dict, report):
+    drifted = await counters.recount(db, params.get("customer_id"))
+    response_cache.invalidate("customers")
+    return {"repaired": len(drifted)}
+
+
+@jobs.handler("backfill_documents")
+async def backfill_documents(db, params: dict, report):
+    return {"assets": await backfill_assets(db)}
+
+
+@router.get("", response_model=List[JobResponse])
+async def get_jobs(
+    status: Optional[JobStatus] = None,
+    kind: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db=Depends(get_database)
+):
+    """Most recent jobs first"""
+    query = {}
+    if status:
+        query["status"] = status.value
+    if kind:
+        query["kind"] = kind
+    cursor = db.jobs.find(query, {"heartbeat": 0}).sort("created", -1).limit(limit)
+    return [job_response(job) async for job in cursor]
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, db=Depends(get_database)):
+    """Status, progress and result of a job"""
+    try:
+        job = await db.jobs.find_one({"_id": ObjectId(job_id)})
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job_response(job)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid job ID format")
+
+
+@router.post("/{job_id}/retry", response_model=JobResponse, status_code=202)
+async def retry_job(job_id: str, response: Response, db=Depends(get_database)):
+    """Run a failed job again"""
+    try:
+        object_id = ObjectId(job_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid job ID format")
+    job = await job_runner.retry(object_id)
+    if job is None:
+        if not await db.jobs.find_one({"_id": object_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=409, detail="Only failed jobs can be retried")
+    job = job_response(job)
+    response.headers["Location"] = job["status_url"]
+    return job
+
+
+@router.post("/recount-counters", response_model=JobResponse, status_code=202)
+async def recount_counters_job(response: Response, customer_id: Optional[str] = None):
+    """Recompute the per-customer counters in the background"""
+    return await accepted(response, "recount_counters", {"customer_id": customer_id})
+
+
+@router.post("/backfill-documents", response_model=JobResponse, status_code=202)
+async def backfill_documents_job(response: Response):
+    """Recompute the derived document fields in the background"""
+    return await accepted(response, "backfill_documents", {})
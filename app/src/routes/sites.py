@@ -3,26 +3,45 @@ from typing import List, Optional
 from bson import ObjectId
 from bson.errors import InvalidId
 from fastapi import APIRouter, Depends, HTTPException
-
-from ..database import get_database
-from ..schemas.site import SiteBase, SiteCreate, SiteInDB, SiteUpdate
+from pymongo.errors import DuplicateKeyError
+
+from .. import counters
+from ..database import get_database, get_loaders
+from ..events import event_bus
+from ..models.site import AddressModel
+from ..pagination import PageParams, fetch_page, page_response
+from ..schemas.site import SiteBase, SiteCreate, SiteInDB, SitePatch
+from ..serialization import to_response
+from ..updates import (INITIAL_VERSION, is_complete, patch_fields,
+                       set_paths, update_counted_document,
+                       validate_partial)
 
 router = APIRouter()
 
+SORTABLE_FIELDS = ("name", "customer_id")
+
 @router.post("/", response_model=SiteInDB)
-async def create_site(site: SiteCreate, db=Depends(get_database)):
+async def create_site(
+    site: SiteCreate,
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
+):
     # Verify customer
     try:
-        customer_id = ObjectId(site.customer_id)
-        customer = await db.customers.find_one({"_id": customer_id})
+        customer = await loaders.customers.load(site.customer_id)
         if not customer:
             raise HTTPException(
                 status_code=404,
                 detail=f"Customer with ID {site.customer_id} not found"
             )
 
-        # Check if this is the first site for the customer
-        existing_sites = await db.sites.count_documents({"customer_id": site.customer_id})
+        # Check if this is the first site for the customer; customers that
+        # predate the stored counters fall back to counting
+        counts = customer.get("counts")
+        if counts is not None:
+            existing_sites = counts.get("sites", 0)
+        else:
+            existing_sites = await db.sites.count_documents({"customer_id": site.customer_id})
         if existing_sites == 0:
             # If this is the first site, don't create it as it was already created with the customer
             raise HTTPException(
@@ -34,59 +53,57 @@ async def create_site(site: SiteCreate, db=Depends(get_database)):
         site_dict = site.model_dump()
         combined_name = f"{customer['name']} - {site_dict['name']}"
 
-        # Check if site with this name already exists
-        existing_site = await db.sites.find_one({
-            "name": combined_name,
-            "customer_id": site.customer_id
-        })
-        if existing_site:
+        site_dict["name"] = combined_name
+        site_dict["version"] = INITIAL_VERSION
+        try:
+            await db.sites.insert_one(site_dict)
+        except DuplicateKeyError:
             raise HTTPException(
                 status_code=400,
                 detail=f"Site with name '{combined_name}' already exists for this customer"
             )
-
-        site_dict["name"] = combined_name
-        result = await db.sites.insert_one(site_dict)
-        return {"id": str(result.inserted_id), **site_dict}
+        await counters.increment(db, site.customer_id, "sites")
+        event_bus.publish("sites", "insert", site_dict, site_dict)
+        return to_response(site_dict)
     except InvalidId:
         raise HTTPException(
             status_code=400,
             detail=f"Invalid customer_id format: {site.customer_id}"
         )
 
+def site_filters(customer_id: Optional[str] = None) -> dict:
+    """Build the Mongo filter shared by the site list and export routes"""
+    query = {}
+    if customer_id:  # Only add customer_id to query if it's provided
+        query["customer_id"] = customer_id
+    return query
+
 @router.get("/", response_model=List[SiteInDB])
 async def get_sites(
-    customer_id: Optional[str] = None,
+    query: dict = Depends(site_filters),
+    page: PageParams = Depends(),
     db=Depends(get_database)
 ):
     """
     Get all sites, optionally filtered by customer_id
     """
-    query = {}
-    if customer_id:  # Only add customer_id to query if it's provided
-        try:
-            query["customer_id"] = customer_id
-        except InvalidId:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid customer_id format: {customer_id}"
-            )
-
-    sites = await db.sites.find(query).to_list(None)
-    return [
-        {
-            "id": str(site["_id"]), 
-            **{k:v for k,v in site.items() if k != "_id"}
-        }
-        for site in sites
-    ]
+    sites, next_cursor = await fetch_page(
+        db.sites, query, page, SORTABLE_FIELDS, SiteBase.model_fields
+    )
+    items = [to_response(site, SiteInDB.model_fields) for site in sites]
+    return page_response(items, next_cursor)
 
 @router.put("/{site_id}", response_model=SiteInDB)
-async def update_site(site_id: str, site: SiteBase, db=Depends(get_database)):
+async def update_site(
+    site_id: str,
+    site: SiteBase,
+    version: Optional[int] = None,
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
+):
     try:
         # Get the customer name
-        customer_id = ObjectId(site.customer_id)
-        customer = await db.customers.find_one({"_id": customer_id})
+        customer = await loaders.customers.load(site.customer_id)
         if not customer:
             raise HTTPException(
                 status_code=404,
@@ -95,50 +112,111 @@ async def update_site(site_id: str, site: SiteBase, db=Depends(get_database)):
 
         # Update site with combined name
         site_dict = site.model_dump()
-        combined_name = f"{customer['name']} - {site_dict['name']}"
-
-        # Check if another site with this name exists (excluding current site)
-        existing_site = await db.sites.find_one({
-            "name": combined_name,
-            "customer_id": site.customer_id,
-            "_id": {"$ne": ObjectId(site_id)}
-        })
-        if existing_site:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Another site with name '{combined_name}' already exists for this customer"
-            )
-
-        site_dict["name"] = combined_name
-        result = await db.sites.update_one(
-            {"_id": ObjectId(site_id)},
-            {"$set": site_dict}
+        site_dict["name"] = f"{customer['name']} - {site_dict['name']}"
+        updated = await _update(db, site_id, site_dict, site.customer_id, version)
+        return to_response(updated)
+    except InvalidId:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid ID format"
         )
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Site not found")
-        return {"id": site_id, **site_dict}
+
+@router.patch("/{site_id}", response_model=SiteInDB)
+async def patch_site(
+    site_id: str,
+    site: SitePatch,
+    version: Optional[int] = None,
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
+):
+    """Change only the given fields, including single address fields"""
+    try:
+        update_data = patch_fields(site, SiteBase)
+        customer_id = update_data.get("customer_id")
+        conditions = {}
+
+        if customer_id is not None or "name" in update_data:
+            if customer_id is None:
+                # Renaming needs the customer name, so read the current owner
+                current = await loaders.sites.load(site_id)
+                if not current:
+                    raise HTTPException(status_code=404, detail="Site not found")
+                conditions["customer_id"] = current["customer_id"]
+            customer = await loaders.customers.load(customer_id or current["customer_id"])
+            if not customer:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Customer with ID {customer_id} not found"
+                )
+            if "name" in update_data:
+                update_data["name"] = f"{customer['name']} - {update_data['name']}"
+
+        address = update_data.get("address")
+        if address is not None:
+            update_data["address"], _ = validate_partial("address", address, {None: AddressModel})
+            if not is_complete(address, AddressModel):
+                # Dotted paths into a missing address would create a partial one
+                conditions["address"] = {"$type": "object"}
+
+        changes = set_paths(update_data, ("address",))
+        updated = await _update(db, site_id, changes, customer_id, version, conditions)
+        return to_response(updated)
     except InvalidId:
         raise HTTPException(
             status_code=400,
             detail=f"Invalid ID format"
         )
 
+async def _update(db, site_id: str, changes: dict, customer_id: Optional[str], version: Optional[int], conditions=None):
+    try:
+        updated = await update_counted_document(
+            db, "sites", site_id, changes, customer_id,
+            version=version,
+            conditions=conditions,
+            not_found="Site not found",
+            conflict="Site was moved to another customer, or has no address yet",
+        )
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Another site with name '{changes.get('name')}' already exists for this customer"
+        )
+    event_bus.publish("sites", "update", updated, changes)
+    return updated
+
 @router.delete("/{site_id}")
-async def delete_site(site_id: str, db=Depends(get_database)):
+async def delete_site(
+    site_id: str,
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
+):
     try:
         # Check if this is the only site for the customer
-        site = await db.sites.find_one({"_id": ObjectId(site_id)})
+        site = await loaders.sites.load(site_id)
         if not site:
             raise HTTPException(status_code=404, detail="Site not found")
 
-        site_count = await db.sites.count_documents({"customer_id": site["customer_id"]})
-        if site_count <= 1:
-            raise HTTPException(
-                status_code=400,
-                detail="Cannot delete the only site for a customer. Delete the customer instead."
-            )
+        # Take the decrement first: the conditional $inc refuses to remove
+        # the last site, which also guards against concurrent deletes
+        reserved = await db.customers.update_one(
+            {"_id": ObjectId(site["customer_id"]), "counts.sites": {"$gt": 1}},
+            {"$inc": {"counts.sites": -1}}
+        )
+        if reserved.modified_count == 0:
+            # No stored counters yet (or they drifted): count instead
+            site_count = await db.sites.count_documents({"customer_id": site["customer_id"]})
+            if site_count <= 1:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Cannot delete the only site for a customer. Delete the customer instead."
+                )
 
         result = await db.sites.delete_one({"_id": ObjectId(site_id)})
+        if result.deleted_count == 0:
+            if reserved.modified_count:
+                await counters.increment(db, site["customer_id"], "sites")
+            raise HTTPException(status_code=404, detail="Site not found")
+        event_bus.publish("sites", "delete", site)
         return {"message": "Site deleted successfully"}
     except InvalidId:
         raise HTTPException(
@@ -0,0 +1,348 @@
+"""Reconcile a customer's stored assets with the complete set a discovery scan found.
+
+The stored side of the diff is read in two passes. The first projects only the
+match key, fingerprint and version of every asset in scope, from the index
+that leads with ``customer_id``. Only assets whose fingerprint differs from
+the scanned record's are then read in full and compared field by field. All
+inserts, updates and deletes go out in one unordered ``bulk_write``.
+"""
+import asyncio
+from datetime import datetime
+from enum import Enum
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, Depends, HTTPException, Request
+from pydantic import ValidationError
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .. import counters, history
+from ..config import settings
+from ..database import get_database, get_loaders
+from ..documents import ASSET_CONTENT_FIELDS, asset_document, fingerprint
+from ..events import event_bus
+from ..schemas.asset import (AssetCreate, AssetSyncChange, AssetSyncResponse,
+                             BulkAssetResult)
+from ..updates import INITIAL_VERSION
+from .assets import _bulk_records, _validation_message
+
+router = APIRouter()
+
+
+class SyncKey(str, Enum):
+    HOSTNAME = "hostname"
+    IP_ADDRESS = "ip_address"
+
+
+# Stored field each key is matched on; both follow customer_id in an index
+KEY_FIELDS = {SyncKey.HOSTNAME: "hostname_lc", SyncKey.IP_ADDRESS: "ip_numeric"}
+
+# Compared field by field when fingerprints differ; derived fields follow their source
+DIFFED_FIELDS = ASSET_CONTENT_FIELDS + ("hostname_lc", "ip_numeric")
+
+
+class Step(NamedTuple):
+    """What one bulk operation does; a fingerprint refresh has no changes"""
+    index: Optional[int]  # row of the scan, None for deletes
+    asset_id: ObjectId
+    changes: List[AssetSyncChange]
+    fields: Optional[dict]  # inserted document or $set
+    entries: List[dict]  # history
+
+
+def _key_of(record: dict, key: SyncKey):
+    """Match key of a record, normalised like the stored field, or ``None``"""
+    value = record.get(key.value)
+    if not isinstance(value, str):
+        return None
+    return asset_document({key.value: value}).get(KEY_FIELDS[key])
+
+
+async def _scan(request: Request, key: SyncKey, customer_id: str, site_id: Optional[str]):
+    """Validate the scanned records into ``{key: (index, document)}``.
+
+    Also returns the keys of every row, including rejected ones, so a bad row
+    never causes the asset it describes to be deleted.
+    """
+    desired: Dict[object, Tuple[int, dict]] = {}
+    keys, errors, received = set(), [], 0
+    async for index, record, error in _bulk_records(request):
+        received += 1
+        if error is None and isinstance(record, dict):
+            record.setdefault("customer_id", customer_id)
+            if site_id:
+                record.setdefault("site_id", site_id)
+            keys.add(_key_of(record, key))
+        if error is None:
+            try:
+                asset = AssetCreate.model_validate(record)
+            except ValidationError as e:
+                error = _validation_message(e)
+            else:
+                if asset.customer_id != customer_id:
+                    error = "customer_id does not match the synced customer"
+                elif site_id and asset.site_id != site_id:
+                    error = "site_id does not match the synced site"
+                elif asset.site_id and not ObjectId.is_valid(asset.site_id):
+                    error = "Invalid ID format"
+        if error is None:
+            document = asset_document(asset.model_dump(include=set(ASSET_CONTENT_FIELDS)))
+            value = document.get(KEY_FIELDS[key])
+            if value is None:
+                error = f"{key.value} {document[key.value]} is not an IP address"
+            elif value in desired:
+                error = f"Duplicate {key.value} {document[key.value]}, first given in row {desired[value][0]}"
+        if error is not None:
+            errors.append(BulkAssetResult(index=index, error=error))
+            continue
+        document["fingerprint"] = fingerprint(document)
+        desired[value] = (index, document)
+    return desired, keys, errors, received
+
+
+async def _reject_foreign_sites(loaders, desired: dict, customer_id: str, errors: list):
+    """Drop rows whose site does not belong to the customer, with one ``$in`` query"""
+    site_ids = {document["site_id"] for _, document in desired.values() if document.get("site_id")}
+    sites = {str(doc["_id"]): doc["customer_id"] for doc in await loaders.sites.load_many(site_ids) if doc}
+    for value, (index, document) in list(desired.items()):
+        if document.get("site_id") and sites.get(document["site_id"]) != customer_id:
+            errors.append(BulkAssetResult(index=index, error="Site not found or doesn't belong to customer"))
+            del desired[value]
+
+
+async def _stored(db, scope: dict, key: SyncKey):
+    """Stored assets in scope by match key, and those no key reaches.
+
+    Assets stored before the key field was derived are keyed on the field it
+    derives from; assets without a usable key, or sharing one with an earlier
+    asset, are left out.
+    """
+    key_field = KEY_FIELDS[key]
+    projection = {key_field: 1, key.value: 1, "fingerprint": 1, "version": 1}
+    stored, unkeyed = {}, []
+    async for doc in db.assets.find(scope, projection):
+        value = doc.get(key_field)
+        if value is None:
+            value = _key_of(doc, key)
+        if value is None or value in stored:
+            unkeyed.append(doc)
+        else:
+            stored[value] = doc
+    return stored, unkeyed
+
+
+async def _reject_ip_conflicts(db, customer_id: str, desired: dict, keeping: set, errors: list):
+    """Drop rows whose IP another row, or an asset the sync leaves alone, ends up with.
+
+    ``keeping`` is the ids of stored assets that keep their current IP.
+    """
+    ips = [document["ip_numeric"] for _, document in desired.values() if document.get("ip_numeric") is not None]
+    if not ips:
+        return
+    cursor = db.assets.find({"customer_id": customer_id, "ip_numeric": {"$in": ips}}, {"ip_numeric": 1})
+    taken = {doc["ip_numeric"] async for doc in cursor if doc["_id"] in keeping}
+    for value, (index, document) in sorted(desired.items(), key=lambda item: item[1][0]):
+        ip = document.get("ip_numeric")
+        if ip is None:
+            continue
+        if ip in taken:
+            errors.append(BulkAssetResult(index=index, error=f"IP address {document['ip_address']} is already in use"))
+            del desired[value]
+        else:
+            taken.add(ip)
+
+
+async def _full_documents(db, ids: List[ObjectId]) -> Dict[ObjectId, dict]:
+    projection = {"fingerprint": 0}
+    documents = {}
+    for start in range(0, len(ids), settings.bulk_batch_size):
+        chunk = ids[start:start + settings.bulk_batch_size]
+        async for doc in db.assets.find({"_id": {"$in": chunk}}, projection):
+            documents[doc["_id"]] = doc
+    return documents
+
+
+def _plan(desired: dict, stored: dict, current: Dict[ObjectId, dict], deleting: List[dict],
+          scope: dict, key: SyncKey, now: datetime):
+    """The bulk operations, each with its ``Step``.
+
+    Matched assets whose fields turn out equal only get their fingerprint
+    refreshed, which is not reported as a change.
+    """
+    operations, steps = [], []
+    for value, (index, document) in desired.items():
+        if value not in stored:
+            document.update({"_id": ObjectId(), "added": now, "modified": None, "version": INITIAL_VERSION})
+            operations.append(InsertOne(document))
+            change = AssetSyncChange(action="insert", id=str(document["_id"]), key=document[key.value])
+            steps.append(Step(index, document["_id"], [change], document, [history.inserted(document)]))
+            continue
+        existing = current.get(stored[value]["_id"])
+        if existing is None:
+            continue
+        changed = {
+            field: document.get(field) for field in DIFFED_FIELDS
+            if existing.get(field) != document.get(field)
+        }
+        # The version filter keeps a concurrent edit from being overwritten
+        query = {"_id": existing["_id"], "version": existing.get("version")}
+        if not changed:
+            fields = {"fingerprint": document["fingerprint"]}
+            operations.append(UpdateOne(query, {"$set": fields}))
+            steps.append(Step(index, existing["_id"], [], fields, []))
+            continue
+        fields = {**changed, "fingerprint": document["fingerprint"], "modified": now}
+        operations.append(UpdateOne(query, {"$set": fields, "$inc": {"version": 1}}))
+        change = AssetSyncChange(
+            action="update", id=str(existing["_id"]), key=document[key.value],
+            fields=[field for field in changed if field in ASSET_CONTENT_FIELDS],
+        )
+        after = {**existing, **fields, "version": (existing.get("version") or 0) + 1}
+        steps.append(Step(index, existing["_id"], [change], fields, [history.updated(after, fields)]))
+    for doc in deleting:
+        # Like updates, a delete only applies to the version the diff saw
+        operations.append(DeleteOne({**scope, "_id": doc["_id"], "version": doc.get("version")}))
+        change = AssetSyncChange(action="delete", id=str(doc["_id"]), key=doc.get(key.value))
+        entry = history.deleted({**doc, "customer_id": scope["customer_id"]})
+        steps.append(Step(None, doc["_id"], [change], None, [entry]))
+    return operations, steps
+
+
+async def _kept(db, deletes: Dict[int, Step]) -> set:
+    """Positions of deletes whose asset is still stored after the write"""
+    cursor = db.assets.find({"_id": {"$in": [step.asset_id for step in deletes.values()]}}, {"_id": 1})
+    stored = {doc["_id"] async for doc in cursor}
+    return {position for position, step in deletes.items() if step.asset_id in stored}
+
+
+async def _overwritten(db, updates: Dict[int, Step]) -> set:
+    """Positions of updates whose fingerprint is not the stored one after the write"""
+    ids = [step.asset_id for step in updates.values()]
+    cursor = db.assets.find({"_id": {"$in": ids}}, {"fingerprint": 1})
+    stored = {doc["_id"]: doc.get("fingerprint") async for doc in cursor}
+    return {
+        position for position, step in updates.items()
+        if stored.get(step.asset_id) != step.fields["fingerprint"]
+    }
+
+
+@router.post("/customers/{customer_id}/assets/sync", response_model=AssetSyncResponse)
+async def sync_assets(
+    customer_id: str,
+    request: Request,
+    key: SyncKey = SyncKey.HOSTNAME,
+    site_id: Optional[str] = None,
+    delete: bool = False,
+    dry_run: bool = False,
+    db=Depends(get_database),
+    loaders=Depends(get_loaders)
+):
+    """Make a customer's assets, or one site's, match a discovery scan.
+
+    The body is the complete desired set as a JSON array or an NDJSON stream
+    of asset records, matched to stored assets by ``key``. ``customer_id``
+    and, when syncing a site, ``site_id`` default to the synced ones. Only new
+    assets, changed fields and, with ``delete``, assets missing from the scan
+    are written; ``dry_run`` reports the changes without writing them.
+    """
+    try:
+        customer_lookup = loaders.customers.load(customer_id)
+        site_lookup = loaders.sites.load(site_id) if site_id else None
+        if not await customer_lookup:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        if site_lookup is not None:
+            site = await site_lookup
+            if not site or site["customer_id"] != customer_id:
+                raise HTTPException(status_code=404, detail="Site not found or doesn't belong to customer")
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid ID format")
+
+    scope = {"customer_id": customer_id}
+    if site_id:
+        scope["site_id"] = site_id
+    (desired, keys, errors, received), (stored, unkeyed) = await asyncio.gather(
+        _scan(request, key, customer_id, site_id), _stored(db, scope, key)
+    )
+    await _reject_foreign_sites(loaders, desired, customer_id, errors)
+
+    # Unkeyed assets are reported and never deleted: nothing in the scan can
+    # say whether they are still there
+    deleting = []
+    if delete:
+        deleting = [doc for value, doc in stored.items() if value not in keys]
+    writing = {stored[value]["_id"] for value in desired if value in stored}
+    writing.update(doc["_id"] for doc in deleting)
+    keeping = {doc["_id"] for doc in unkeyed + list(stored.values())} - writing
+    await _reject_ip_conflicts(db, customer_id, desired, keeping, errors)
+
+    matched = [value for value in desired if value in stored]
+    differing = [
+        stored[value]["_id"] for value in matched
+        if stored[value].get("fingerprint") != desired[value][1]["fingerprint"]
+    ]
+    current = await _full_documents(db, differing)
+    operations, steps = _plan(desired, stored, current, deleting, scope, key, datetime.now())
+
+    applied = set(range(len(operations)))
+    deleted = len(deleting)
+    conflicts = 0
+    if operations and not dry_run:
+        try:
+            result = (await db.assets.bulk_write(operations, ordered=False)).bulk_api_result
+        except BulkWriteError as e:
+            result = e.details
+            for err in result["writeErrors"]:
+                applied.discard(err["index"])
+                index = steps[err["index"]].index
+                errors.append(BulkAssetResult(index=-1 if index is None else index, error=err["errmsg"]))
+        updates = {
+            position: steps[position] for position in applied
+            if isinstance(operations[position], UpdateOne)
+        }
+        if len(updates) > result["nMatched"]:
+            overwritten = await _overwritten(db, updates)
+            applied -= overwritten
+            conflicts = sum(1 for position in overwritten if steps[position].changes)
+        deletes = {
+            position: steps[position] for position in applied
+            if isinstance(operations[position], DeleteOne)
+        }
+        if len(deletes) > result["nRemoved"]:
+            kept = await _kept(db, deletes)
+            applied -= kept
+            conflicts += len(kept)
+        deleted = result["nRemoved"]
+
+    changes = [change for position in sorted(applied) for change in steps[position].changes]
+    planned_updates = sum(1 for step in steps if step.changes and step.changes[0].action == "update")
+    inserted = sum(1 for change in changes if change.action == "insert")
+    updated = sum(1 for change in changes if change.action == "update")
+    if not dry_run:
+        if inserted != deleted:
+            await counters.increment(db, customer_id, "assets", inserted - deleted)
+        await history.record(db, [entry for position in sorted(applied) for entry in steps[position].entries])
+        for position in sorted(applied):
+            step = steps[position]
+            for change in step.changes:
+                if change.action == "delete":
+                    event_bus.publish("assets", "delete", {"_id": change.id, "customer_id": customer_id})
+                else:
+                    document = {"_id": step.asset_id, "customer_id": customer_id}
+                    event_bus.publish("assets", change.action, document, step.fields)
+
+    errors.sort(key=lambda error: error.index)
+    return {
+        "dry_run": dry_run,
+        "received": received,
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": len(matched) - planned_updates,
+        "deleted": deleted,
+        "failed": len(errors),
+        "conflicts": conflicts,
+        "changes": changes,
+        "errors": errors,
+        "unkeyed": [str(doc["_id"]) for doc in unkeyed],
+    }
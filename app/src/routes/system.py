@@ -0,0 +1,55 @@
+import time
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from ..cache import response_cache
+from ..config import settings
+from ..database import get_database
+from ..metrics import registry
+from ..pool import pool_monitor
+from ..query_debug import query_debugger
+
+router = APIRouter()
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """Response cache size, hit/miss counters and collection versions"""
+    return response_cache.stats()
+
+@router.get("/health/db")
+async def get_db_health(db=Depends(get_database)):
+    """Ping MongoDB and report connection pool usage; 503 when unreachable"""
+    start = time.perf_counter()
+    try:
+        await db.command("ping")
+        status, error = "ok", None
+    except Exception as e:
+        status, error = "unavailable", str(e)
+    body = {
+        "status": status,
+        "error": error,
+        "ping_ms": round((time.perf_counter() - start) * 1000, 3),
+        "pool": {
+            "max_pool_size": settings.mongo_max_pool_size,
+            "min_pool_size": settings.mongo_min_pool_size,
+            **pool_monitor.stats(),
+        },
+    }
+    return JSONResponse(body, status_code=200 if status == "ok" else 503)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Request and MongoDB command metrics in Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/debug/queries")
+async def get_query_findings():
+    """Slow queries, requests over the round-trip threshold and sampled query plans"""
+    return query_debugger.report()
+
+@router.delete("/debug/queries")
+async def clear_query_findings():
+    """Forget the recorded findings and plans"""
+    query_debugger.clear()
+    return {"message": "Query findings cleared"}
@@ -1,9 +1,13 @@
 from datetime import datetime
-from typing import Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
-from pydantic import BaseModel, model_validator
+from pydantic import (BaseModel, TypeAdapter, ValidationInfo, field_validator,
+                      model_validator)
 
-from ..models.asset import AssetType, HostSpecs, NetworkDeviceSpecs, VmSpecs
+from ..models.asset import (SPECS_BY_TYPE, AssetType, HostSpecs,
+                            NetworkDeviceSpecs, VmSpecs)
+
+SPECS_ADAPTERS = {asset_type: TypeAdapter(model) for asset_type, model in SPECS_BY_TYPE.items()}
 
 
 class AssetBase(BaseModel):
@@ -17,13 +21,18 @@ class AssetBase(BaseModel):
     added: datetime = datetime.now()
     modified: Optional[datetime] = None
 
+    @field_validator('specs', mode='wrap')
+    @classmethod
+    def validate_specs(cls, value, handler, info: ValidationInfo):
+        # Validate against the one model of the asset type instead of trying
+        # every union member; VmSpecs requires infrastructure_location_id
+        adapter = SPECS_ADAPTERS.get(info.data.get('asset_type'))
+        if adapter is None:
+            return handler(value)
+        return adapter.validate_python(value)
+
     @model_validator(mode='after')
     def validate_location(self):
-        # VMs need infrastructure_location_id in specs
-        if self.asset_type == AssetType.VM:
-            if not hasattr(self.specs, 'infrastructure_location_id'):
-                raise ValueError("VM assets require infrastructure_location_id in specs")
-            
         # Physical hardware needs site_id
         if self.asset_type in [AssetType.SWITCH, AssetType.FIREWALL, AssetType.HOST]:
             if not self.site_id:
@@ -34,5 +43,84 @@ class AssetBase(BaseModel):
 class AssetCreate(AssetBase):
     pass
 
+class AssetPatch(BaseModel):
+    """Fields to change; ``specs`` may hold only some of the specs fields"""
+    hostname: Optional[str] = None
+    ip_address: Optional[str] = None
+    asset_type: Optional[AssetType] = None
+    customer_id: Optional[str] = None
+    notes: Optional[str] = None
+    site_id: Optional[str] = None
+    specs: Optional[Dict[str, Any]] = None
+
 class AssetInDB(AssetBase):
     id: str
+    version: Optional[int] = None
+
+class AssetExpanded(AssetInDB):
+    """List row; the references named in ``?expand=`` are embedded"""
+    customer: Optional[Dict[str, Any]] = None
+    site: Optional[Dict[str, Any]] = None
+    infrastructure: Optional[Dict[str, Any]] = None
+
+class BulkAssetResult(BaseModel):
+    """Outcome of one row of a bulk import, in request order"""
+    index: int
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkAssetResponse(BaseModel):
+    inserted: int
+    failed: int
+    results: List[BulkAssetResult]
+
+class AssetSyncChange(BaseModel):
+    """One write of a sync; ``fields`` lists what an update changed"""
+    action: str  # insert, update or delete
+    id: str
+    key: Optional[str] = None
+    fields: List[str] = []
+
+class AssetSyncResponse(BaseModel):
+    """What a sync changed, or with ``dry_run`` would change"""
+    dry_run: bool
+    received: int
+    inserted: int
+    updated: int
+    unchanged: int
+    deleted: int
+    failed: int
+    conflicts: int  # updates and deletes skipped because the asset changed during the sync
+    changes: List[AssetSyncChange]
+    errors: List[BulkAssetResult]
+    unkeyed: List[str] = []  # stored assets without a usable or unique key, left alone
+
+class AssetRevision(BaseModel):
+    """One write of an asset; ``changes`` are the fields it set, or the whole asset"""
+    id: str
+    asset_id: str
+    ts: datetime
+    op: str  # insert, update, delete or snapshot
+    version: Optional[int] = None
+    customer_id: Optional[str] = None
+    changes: Optional[Dict[str, Any]] = None
+
+class AssetSearchResult(BaseModel):
+    """Projected asset returned by search, best match first"""
+    id: str
+    hostname: str
+    ip_address: str
+    asset_type: AssetType
+    customer_id: str
+    site_id: Optional[str] = None
+    score: Optional[float] = None
+
+class SubnetUtilization(BaseModel):
+    """Address usage of one network by assets"""
+    cidr: str
+    customer_id: Optional[str] = None
+    total_addresses: int
+    usable_addresses: int
+    used: int
+    free: int
+    utilization: float
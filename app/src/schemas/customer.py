@@ -1,5 +1,5 @@
 # schemas/customer.py
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -21,8 +21,60 @@ class CustomerUpdate(CustomerBase):
     contact_phone: Optional[str] = None
     address: Optional[AddressModel] = None
 
+class CustomerPatch(BaseModel):
+    """Fields to change; ``address`` may hold only some of the address fields"""
+    name: Optional[str] = None
+    contact_email: Optional[str] = None
+    contact_phone: Optional[str] = None
+    address: Optional[Dict[str, Any]] = None
+
+class CustomerCounts(BaseModel):
+    sites: int = 0
+    assets: int = 0
+    infrastructure: int = 0
+
 class CustomerResponse(CustomerBase):
     id: str
+    counts: Optional[CustomerCounts] = None
+    version: Optional[int] = None
 
     class Config:
         from_attributes = True
+
+class SiteAssetCount(BaseModel):
+    site_id: str
+    name: Optional[str] = None
+    assets: int
+
+class InfrastructureCapacity(BaseModel):
+    """VM totals hosted on one infrastructure location"""
+    infrastructure_location_id: Optional[str] = None
+    vms: int
+    cpu_cores: int
+    ram_gb: int
+
+class CustomerSummary(BaseModel):
+    """Inventory overview for one customer"""
+    customer_id: str
+    name: str
+    sites_total: int
+    assets_total: int
+    assets_by_type: Dict[str, int]
+    assets_by_site: List[SiteAssetCount]
+    infrastructure_total: int
+    infrastructure_by_type: Dict[str, int]
+    infrastructure_active: int
+    infrastructure_inactive: int
+    vm_capacity: List[InfrastructureCapacity]
+
+class TopologyNode(BaseModel):
+    kind: str  # customer, site, infrastructure or asset
+    name: Optional[str] = None
+    type: Optional[str] = None  # location type or asset type
+    active: Optional[bool] = None  # infrastructure only
+
+class CustomerTopology(BaseModel):
+    """A customer's sites, infrastructure and assets as an adjacency list"""
+    customer_id: str
+    nodes: Dict[str, TopologyNode]
+    children: Dict[str, List[str]]  # parent id -> child ids
@@ -1,10 +1,13 @@
-from datetime import datetime
-from typing import Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
-from pydantic import BaseModel
+from pydantic import (BaseModel, TypeAdapter, ValidationInfo, field_validator,
+                      model_validator)
 
-from ..models.infrastructure import (AwsConfig, AzureConfig, DatacenterConfig,
-                                     LocationType, OnPremiseConfig)
+from ..models.infrastructure import (CONFIG_BY_TYPE, AwsConfig, AzureConfig,
+                                     DatacenterConfig, LocationType,
+                                     OnPremiseConfig)
+
+CONFIG_ADAPTERS = {location_type: TypeAdapter(model) for location_type, model in CONFIG_BY_TYPE.items()}
 
 
 class InfrastructureBase(BaseModel):
@@ -16,7 +19,17 @@ class InfrastructureBase(BaseModel):
     is_active: bool = True
     site_id: Optional[str] = None  # Will be required for ON_PREMISE type
 
-    # Custom validator to ensure site_id is provided for ON_PREMISE
+    @field_validator('config', mode='wrap')
+    @classmethod
+    def validate_config(cls, value, handler, info: ValidationInfo):
+        # Validate against the one model of the location type
+        adapter = CONFIG_ADAPTERS.get(info.data.get('type'))
+        if adapter is None:
+            return handler(value)
+        return adapter.validate_python(value)
+
+    # Ensure site_id is provided for ON_PREMISE
+    @model_validator(mode='after')
     def validate_site_id(self):
         if self.type == LocationType.ON_PREMISE and not self.site_id:
             raise ValueError("site_id is required for on-premise locations")
@@ -34,9 +47,40 @@ class InfrastructureUpdate(BaseModel):
     is_active: Optional[bool] = None
     site_id: Optional[str] = None
 
+class InfrastructurePatch(BaseModel):
+    """Fields to change; ``config`` may hold only some of the config fields"""
+    name: Optional[str] = None
+    description: Optional[str] = None
+    config: Optional[Dict[str, Any]] = None
+    is_active: Optional[bool] = None
+    site_id: Optional[str] = None
+
 class InfrastructureInDB(InfrastructureBase):
     """Schema for infrastructure location responses from the API"""
     id: str
+    version: Optional[int] = None
 
     class Config:
         from_attributes = True
+
+class InfrastructureExpanded(InfrastructureInDB):
+    """List row; the site is embedded with ``?expand=site``"""
+    site: Optional[Dict[str, Any]] = None
+
+class HostedAsset(BaseModel):
+    id: str
+    hostname: Optional[str] = None
+    asset_type: Optional[str] = None
+    ip_address: Optional[str] = None
+
+class InfrastructureImpact(BaseModel):
+    """What is affected when an infrastructure location goes down"""
+    infrastructure_id: str
+    name: Optional[str] = None
+    type: Optional[str] = None
+    active: bool = True
+    customer_id: Optional[str] = None
+    site: Optional[Dict[str, Any]] = None
+    assets_total: int
+    assets_by_type: Dict[str, int]
+    assets: List[HostedAsset]
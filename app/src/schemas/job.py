@@ -0,0 +1,21 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+from ..jobs import JobStatus
+
+
+class JobResponse(BaseModel):
+    """State of a background job; poll ``status_url`` until it finishes"""
+    id: str
+    kind: str
+    status: JobStatus
+    params: Dict[str, Any]
+    progress: Dict[str, int]
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created: datetime
+    started: Optional[datetime] = None
+    finished: Optional[datetime] = None
+    status_url: str
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Optional
 
 from pydantic import BaseModel
 
@@ -26,9 +26,19 @@ class SiteUpdate(SiteBase):
     address: Optional[AddressModel] = None
 
 
+class SitePatch(BaseModel):
+    """Fields to change; ``address`` may hold only some of the address fields"""
+    name: Optional[str] = None
+    address: Optional[Dict[str, Any]] = None
+    customer_id: Optional[str] = None
+    notes: Optional[str] = None
+    is_primary: Optional[bool] = None
+
+
 class SiteInDB(SiteBase):
     """Schema for customer responses from the API"""
     id: str
+    version: Optional[int] = None
 
     class Config:
         from_attributes = True
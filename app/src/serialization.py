@@ -0,0 +1,44 @@
+from typing import Collection, Optional
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+
+def to_response(doc: dict, fields: Optional[Collection[str]] = None) -> dict:
+    """Rename a BSON document's ``_id`` to a string ``id`` in place.
+
+    Mutating the document avoids building a second dict per row; callers own
+    the documents they fetched, so nothing else observes the change.
+    ``fields``, usually a schema's ``model_fields``, drops every other stored
+    field; routes that skip ``response_model`` validation need it so internal
+    fields never reach clients.
+    """
+    doc["id"] = str(doc.pop("_id"))
+    if fields is not None:
+        for key in [key for key in doc if key not in fields]:
+            del doc[key]
+    return doc
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def encode(content) -> bytes:
+    """orjson-encode ``content``, with ObjectIds as strings"""
+    return orjson.dumps(content, default=_default)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response encoded with orjson.
+
+    datetime and enum values are handled natively and ObjectId through
+    ``default``. Returning this from a route skips ``response_model``
+    validation, so it is meant for documents that were validated on write.
+    """
+
+    def render(self, content) -> bytes:
+        return encode(content)
@@ -0,0 +1,126 @@
+"""Customer topology and infrastructure impact, each resolved in one aggregation.
+
+A topology is a compact adjacency list: ``nodes`` maps every id to its kind,
+name and type, ``children`` maps a parent id to the ids below it. The
+hierarchy is customer -> site -> on-premise infrastructure -> VM, with
+physical assets under their site, cloud locations under the customer, and
+VMs whose location is unknown under the customer as well.
+
+The branches are streamed with ``$unionWith`` rather than embedded with
+``$lookup``: a lookup puts every asset of a customer into one result
+document, which large customers would push past MongoDB's 16 MB limit. Each
+branch matches on an indexed reference field.
+"""
+from collections import Counter
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+
+from .documents import LIVE_CUSTOMERS
+
+ASSET_FIELDS = ["hostname", "asset_type", "site_id", "specs.infrastructure_location_id"]
+INFRASTRUCTURE_FIELDS = ["name", "type", "site_id", "is_active"]
+
+
+def customer_branch(collection: str, kind: str, customer_id: str, fields: List[str]) -> dict:
+    """``$unionWith`` stage adding a customer's documents of one collection, tagged with their kind"""
+    return {"$unionWith": {"coll": collection, "pipeline": [
+        {"$match": {"customer_id": customer_id}},
+        {"$project": {"_kind": {"$literal": kind}, **{field: 1 for field in fields}}},
+    ]}}
+
+
+def topology_pipeline(customer_id: str) -> list:
+    return [
+        {"$match": {"_id": ObjectId(customer_id), **LIVE_CUSTOMERS}},
+        {"$project": {"_kind": {"$literal": "customer"}, "name": 1}},
+        customer_branch("sites", "site", customer_id, ["name"]),
+        customer_branch("infrastructure", "infrastructure", customer_id, INFRASTRUCTURE_FIELDS),
+        customer_branch("assets", "asset", customer_id, ASSET_FIELDS),
+    ]
+
+
+def _node(row: dict) -> dict:
+    kind = row["_kind"]
+    if kind == "asset":
+        return {"kind": kind, "name": row.get("hostname"), "type": row.get("asset_type")}
+    node = {"kind": kind, "name": row.get("name"), "type": row.get("type")}
+    if kind == "infrastructure":
+        node["active"] = row.get("is_active", True)
+    return node
+
+
+def build_topology(rows: List[dict]) -> Optional[dict]:
+    """Adjacency list of the rows of ``topology_pipeline``, ``None`` without a customer row"""
+    customer = next((row for row in rows if row["_kind"] == "customer"), None)
+    if customer is None:
+        return None
+    root = str(customer["_id"])
+    nodes: Dict[str, dict] = {str(row["_id"]): _node(row) for row in rows}
+    children: Dict[str, List[str]] = {}
+
+    def parent(*candidates) -> str:
+        return next((c for c in candidates if isinstance(c, str) and nodes.get(c)), root)
+
+    for row in rows:
+        kind = row["_kind"]
+        if kind == "customer":
+            continue
+        if kind == "site":
+            above = root
+        elif kind == "infrastructure":
+            above = parent(row.get("site_id"))
+        else:
+            location = (row.get("specs") or {}).get("infrastructure_location_id")
+            above = parent(location, row.get("site_id"))
+        children.setdefault(above, []).append(str(row["_id"]))
+    return {"customer_id": root, "nodes": nodes, "children": children}
+
+
+def impact_pipeline(infrastructure_id: str) -> list:
+    """The location with its site looked up, followed by the assets it hosts"""
+    site_id = {"$convert": {"input": "$site_id", "to": "objectId", "onError": None, "onNull": None}}
+    return [
+        {"$match": {"_id": ObjectId(infrastructure_id)}},
+        {"$project": {
+            "_kind": {"$literal": "infrastructure"},
+            "_site": site_id,
+            "customer_id": 1,
+            **{field: 1 for field in INFRASTRUCTURE_FIELDS},
+        }},
+        {"$lookup": {
+            "from": "sites", "localField": "_site", "foreignField": "_id",
+            "pipeline": [{"$project": {"name": 1}}], "as": "site",
+        }},
+        {"$unionWith": {"coll": "assets", "pipeline": [
+            {"$match": {"specs.infrastructure_location_id": infrastructure_id}},
+            {"$project": {"_kind": {"$literal": "asset"}, "hostname": 1, "asset_type": 1, "ip_address": 1}},
+        ]}},
+    ]
+
+
+def build_impact(rows: List[dict]) -> Optional[dict]:
+    """What depends on a location, from the rows of ``impact_pipeline``"""
+    if not rows or rows[0]["_kind"] != "infrastructure":
+        return None
+    location, assets = rows[0], rows[1:]
+    site = location["site"][0] if location.get("site") else None
+    return {
+        "infrastructure_id": str(location["_id"]),
+        "name": location.get("name"),
+        "type": location.get("type"),
+        "active": location.get("is_active", True),
+        "customer_id": location.get("customer_id"),
+        "site": {"id": str(site["_id"]), "name": site.get("name")} if site else None,
+        "assets_total": len(assets),
+        "assets_by_type": dict(Counter(asset.get("asset_type") for asset in assets)),
+        "assets": [
+            {
+                "id": str(asset["_id"]),
+                "hostname": asset.get("hostname"),
+                "asset_type": asset.get("asset_type"),
+                "ip_address": asset.get("ip_address"),
+            }
+            for asset in assets
+        ],
+    }
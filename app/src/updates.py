@@ -0,0 +1,176 @@
+"""Single round-trip document updates with optimistic concurrency.
+
+Every update is one ``find_one_and_update`` that applies the changes, bumps
+the document ``version`` and returns the updated document. What the write
+depends on (the version the client last saw, the type partial ``specs`` or
+``config`` fields belong to, ...) is part of the filter, so only a write that
+matches nothing reads the document again, to tell the client why.
+"""
+from functools import lru_cache
+from typing import Dict, Hashable, Optional, Type
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from pymongo import ReturnDocument
+
+from . import counters
+
+INITIAL_VERSION = 1
+
+NOT_FOUND = "Document not found"
+CONFLICT = "Document does not satisfy the update preconditions"
+
+
+def set_paths(changes: dict, nested=()) -> dict:
+    """``$set`` document for ``changes``, with dotted paths into ``nested`` fields."""
+    paths = {}
+    for key, value in changes.items():
+        if key in nested and isinstance(value, dict):
+            for field, field_value in value.items():
+                paths[f"{key}.{field}"] = field_value
+        else:
+            paths[key] = value
+    return paths
+
+
+@lru_cache(maxsize=None)
+def _field_adapter(model: Type[BaseModel], field: str) -> TypeAdapter:
+    return TypeAdapter(model.model_fields[field].annotation)
+
+
+@lru_cache(maxsize=None)
+def _nullable(model: Type[BaseModel], field: str) -> bool:
+    try:
+        _field_adapter(model, field).validate_python(None)
+    except ValidationError:
+        return False
+    return True
+
+
+def patch_fields(patch: BaseModel, model: Type[BaseModel]) -> dict:
+    """The fields a PATCH body sets, explicit nulls included.
+
+    A null clears a field that ``model`` allows to be null; any other null
+    is rejected.
+    """
+    data = patch.model_dump(exclude_unset=True)
+    cleared = [field for field, value in data.items() if value is None and not _nullable(model, field)]
+    if cleared:
+        raise HTTPException(status_code=422, detail=f"Fields cannot be null: {', '.join(cleared)}")
+    return data
+
+
+def validate_partial(name: str, data: dict, models: Dict[Hashable, Type[BaseModel]]):
+    """Validate some of the fields of a nested model.
+
+    Returns the validated values and the keys of ``models`` whose model has
+    every given field, for the caller to turn into a filter condition.
+    """
+    candidates = [key for key, model in models.items() if set(data) <= set(model.model_fields)]
+    if not candidates:
+        raise HTTPException(status_code=422, detail=f"Unknown {name} fields: {', '.join(sorted(data))}")
+    model = models[candidates[0]]
+    try:
+        values = {field: _field_adapter(model, field).validate_python(value) for field, value in data.items()}
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid {name}: {e.errors()[0]['msg']}")
+    return values, candidates
+
+
+def is_complete(data: dict, model: Type[BaseModel]) -> bool:
+    """Whether ``data`` has every required field of ``model``"""
+    return all(field in data for field, info in model.model_fields.items() if info.is_required())
+
+
+async def _explain_miss(collection, query: dict, not_found: str = NOT_FOUND, conflict: Optional[str] = None):
+    current = await collection.find_one({"_id": query["_id"]}, {"version": 1})
+    if current is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    if "version" in query and current.get("version") != query["version"]:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Version {query['version']} is stale, the current version is {current.get('version')}"
+        )
+    raise HTTPException(status_code=409, detail=conflict or CONFLICT)
+
+
+async def update_document(
+    collection,
+    document_id: str,
+    changes: dict,
+    version: Optional[int] = None,
+    conditions: Optional[dict] = None,
+    projection: Optional[dict] = None,
+    not_found: str = NOT_FOUND,
+    conflict: Optional[str] = None,
+    return_document: ReturnDocument = ReturnDocument.AFTER,
+) -> dict:
+    """``$set`` the changes and return the updated document.
+
+    Raises 404 when the document does not exist, and 409 when ``version`` or
+    one of ``conditions`` does not match it. With ``ReturnDocument.BEFORE``
+    the document is returned as it was before the update instead.
+    """
+    query = {"_id": ObjectId(document_id), **(conditions or {})}
+    if version is not None:
+        query["version"] = version
+    updated = await collection.find_one_and_update(
+        query,
+        {"$set": changes, "$inc": {"version": 1}},
+        projection=projection,
+        return_document=return_document,
+    )
+    if updated is None:
+        await _explain_miss(collection, query, not_found, conflict)
+    return updated
+
+
+async def update_counted_document(
+    db,
+    collection_name: str,
+    document_id: str,
+    changes: dict,
+    customer_id: Optional[str],
+    **kwargs,
+) -> dict:
+    """``update_document`` for documents counted on their customer.
+
+    The write is first attempted on the assumption that ``customer_id`` is
+    unchanged, which keeps the common case to one round trip. When the
+    document is moved to another customer, the previous owner is needed to
+    move the counter, so that path reads the document back separately.
+    """
+    collection = db[collection_name]
+    if customer_id is None:
+        return await update_document(collection, document_id, changes, **kwargs)
+
+    conditions = kwargs.pop("conditions", None) or {}
+    version = kwargs.pop("version", None)
+    projection = kwargs.pop("projection", None)
+    return_document = kwargs.pop("return_document", ReturnDocument.AFTER)
+    query = {"_id": ObjectId(document_id), **conditions}
+    if version is not None:
+        query["version"] = version
+    update = {"$set": changes, "$inc": {"version": 1}}
+
+    updated = await collection.find_one_and_update(
+        {**query, "customer_id": customer_id},
+        update,
+        projection=projection,
+        return_document=return_document,
+    )
+    if updated is not None:
+        return updated
+
+    before = return_document == ReturnDocument.BEFORE
+    # The projection must keep customer_id when the previous document is returned
+    previous = await collection.find_one_and_update(
+        query, update, projection=projection if before else {"customer_id": 1}
+    )
+    if previous is None:
+        await _explain_miss(collection, query, **kwargs)
+    await counters.move(db, collection_name, previous["customer_id"], customer_id)
+    if before:
+        return previous
+    return await collection.find_one({"_id": query["_id"]}, projection)